@@ -0,0 +1,257 @@
+# Batch version of the `get_dy` view (dex_core/views.ligo)
+#
+# All lanes of a batch run the Newton iterations of get_D and calc_y in
+# lockstep on NumPy object arrays, so the arithmetic stays arbitrary precision
+# and matches the contract to the last unit. Lanes that have converged (or
+# failed) are masked out of the following iterations. Pools whose D is in
+# the shared `stable_math.d_cache` skip the get_D solve altogether.
+
+import numpy as np
+
+from stable_math import Constants, ContractError, Errors, d_cache, get_dev_fee, get_pool_A, sum_all_fee, xp
+
+MAX_TOKENS = Constants.max_tokens_count
+
+
+def _objects(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = list(values)
+    return array
+
+def _ceil_div(numerator, denominator):
+    result = numerator // denominator
+    return result + (numerator % denominator > 0)
+
+def _fail(errors, lanes, error):
+    for lane in lanes:
+        if errors[lane] is None:
+            errors[lane] = error
+
+
+def batch_get_D(xps, tokens_count, amp_f):
+    """
+    Lockstep get_D for several pools.
+
+    `xps` is a (pools, 4) object array padded with zeroes, `tokens_count` and
+    `amp_f` are per-pool arrays. Returns (d, errors) where errors holds the
+    failwith string for pools the contract would reject and None otherwise.
+    """
+    count = len(tokens_count)
+    valid = np.arange(MAX_TOKENS)[None, :] < tokens_count[:, None]
+    errors = [None] * count
+
+    sum_c = xps.sum(axis=1)
+    a_nn_f = amp_f * tokens_count
+    d = sum_c.copy()
+    prev_d = np.zeros(count, dtype=object)
+
+    active = np.nonzero(abs(d - prev_d) > 1)[0]
+    while len(active):
+        n = tokens_count[active]
+        d_a = d[active]
+        d_p_den = np.where(valid[active], xps[active] * n[:, None], 1).prod(axis=1)
+        a_nn_f_a = a_nn_f[active]
+
+        broken = (d_p_den == 0) | (a_nn_f_a < Constants.a_precision)
+        if broken.any():
+            for lane, den in zip(active[broken], d_p_den[broken]):
+                errors[lane] = Errors.div_by_zero if den == 0 else Errors.Dex.wrong_precision
+            keep = ~broken
+            active, n, d_a, d_p_den, a_nn_f_a = active[keep], n[keep], d_a[keep], d_p_den[keep], a_nn_f_a[keep]
+            if not len(active):
+                break
+
+        d_p = d_a ** (n + 1) // d_p_den
+        denominator = (a_nn_f_a - Constants.a_precision) * d_a // Constants.a_precision + (n + 1) * d_p
+        zero = denominator == 0
+        if zero.any():
+            _fail(errors, active[zero], Errors.div_by_zero)
+            keep = ~zero
+            active, n, d_a, d_p, denominator, a_nn_f_a = \
+                active[keep], n[keep], d_a[keep], d_p[keep], denominator[keep], a_nn_f_a[keep]
+
+        prev_d[active] = d_a
+        d[active] = (a_nn_f_a * sum_c[active] // Constants.a_precision + d_p * n) * d_a // denominator
+        active = active[abs(d[active] - prev_d[active]) > 1]
+
+    return d, errors
+
+def batch_calc_y(c, a_nn_f, s_, d, tokens_count, errors):
+    """ Lockstep calc_y, lanes with an error already set are skipped """
+    count = len(c)
+    y = np.zeros(count, dtype=object)
+    prev_y = np.zeros(count, dtype=object)
+    lanes = np.array([k for k in range(count) if errors[k] is None], dtype=int)
+    if not len(lanes):
+        return y
+
+    den = a_nn_f[lanes] * tokens_count[lanes]
+    zero = den == 0
+    _fail(errors, lanes[zero], Errors.Math.ediv_error)
+    lanes = lanes[~zero]
+    den = den[~zero]
+
+    c = c.copy()
+    b = np.zeros(count, dtype=object)
+    c[lanes] = _ceil_div(c[lanes] * d[lanes] * Constants.a_precision, den)
+    b[lanes] = s_[lanes] + d[lanes] * Constants.a_precision // a_nn_f[lanes]
+    y[lanes] = d[lanes]
+
+    active = lanes[abs(y[lanes] - prev_y[lanes]) > 1]
+    while len(active):
+        y_a = y[active]
+        denominator = 2 * y_a + b[active] - d[active]
+        broken = denominator <= 0
+        if broken.any():
+            # negative is a nat error, zero is an EDIV failure of ceil_div
+            for lane, value in zip(active[broken], denominator[broken]):
+                errors[lane] = Errors.Math.nat_error if value < 0 else Errors.Math.ediv_error
+            keep = ~broken
+            active, y_a, denominator = active[keep], y_a[keep], denominator[keep]
+        prev_y[active] = y_a
+        y[active] = _ceil_div(y_a * y_a + c[active], denominator)
+        active = active[abs(y[active] - prev_y[active]) > 1]
+    return y
+
+
+def get_dy_batch(storage, pool_ids, i, j, dx, now=0, return_errors=False, ramps=None):
+    """
+    Quotes `get_dy` for every lane `(pool_ids[k], i[k], j[k], dx[k])` at once.
+
+    `storage` is the full contract storage as kept by LocalChain. Returns an
+    object array of dy amounts after fees; lanes where the view would fail
+    hold None. With `return_errors` the failwith strings are returned too.
+    `ramps` may map pool ids to a `ramp.RampSchedule` to take A from.
+    """
+    ramps = ramps or {}
+    pool_ids = [int(v) for v in pool_ids]
+    i = [int(v) for v in i]
+    j = [int(v) for v in j]
+    dx = _objects([int(v) for v in dx])
+    count = len(pool_ids)
+    errors = [None] * count
+
+    s = storage["storage"]
+    pools = s["pools"]
+    dev_fee_f = get_dev_fee(s)
+
+    # per-pool data, D is solved once for each distinct pool
+    unique = sorted(set(pool_ids) & set(pools.keys()))
+    pool_index = {pool_id: k for k, pool_id in enumerate(unique)}
+    pool_xps = np.zeros((len(unique), MAX_TOKENS), dtype=object)
+    pool_counts = np.zeros(len(unique), dtype=object)
+    pool_amps = np.zeros(len(unique), dtype=object)
+    amp_errors = [None] * len(unique)
+    for k, pool_id in enumerate(unique):
+        pool = pools[pool_id]
+        for idx, value in xp(pool).items():
+            pool_xps[k, idx] = value
+        pool_counts[k] = len(pool["tokens_info"])
+        try:
+            pool_amps[k] = ramps[pool_id].at(now) if pool_id in ramps else get_pool_A(pool, now)
+        except ContractError as e:
+            amp_errors[k] = e.error
+
+    # only pools missing from the D cache go through the solver
+    pool_d = np.zeros(len(unique), dtype=object)
+    pool_errors = list(amp_errors)
+    to_solve = []
+    for k, pool_id in enumerate(unique):
+        if amp_errors[k] is not None:
+            continue
+        cached = d_cache.lookup(pools[pool_id]["tokens_info"], pool_amps[k])
+        if cached is None:
+            to_solve.append(k)
+        else:
+            pool_d[k] = cached
+    if to_solve:
+        solved, solve_errors = batch_get_D(pool_xps[to_solve], pool_counts[to_solve], pool_amps[to_solve])
+        for k, d_value, error in zip(to_solve, solved, solve_errors):
+            pool_errors[k] = error
+            if error is None:
+                pool_d[k] = d_value
+                d_cache.store(pools[unique[k]]["tokens_info"], pool_amps[k], d_value)
+
+    rows = np.zeros(count, dtype=int)
+    lane_i = np.zeros(count, dtype=int)
+    lane_j = np.ones(count, dtype=int)
+    tokens_count = np.ones(count, dtype=object)
+    amp_f = np.zeros(count, dtype=object)
+    d = np.zeros(count, dtype=object)
+    xp_i = np.zeros(count, dtype=object)
+    xp_j = np.zeros(count, dtype=object)
+    rate_j = np.ones(count, dtype=object)
+    reserves_j = np.zeros(count, dtype=object)
+    fee_f = np.zeros(count, dtype=object)
+    x = np.zeros(count, dtype=object)
+
+    for k in range(count):
+        pool_id = pool_ids[k]
+        if pool_id not in pool_index:
+            errors[k] = Errors.Dex.pool_not_listed
+            continue
+        row = pool_index[pool_id]
+        pool = pools[pool_id]
+        tokens_info = pool["tokens_info"]
+        if i[k] not in tokens_info or j[k] not in tokens_info:
+            errors[k] = Errors.Dex.wrong_index
+            continue
+        if i[k] == j[k]:
+            errors[k] = Errors.assertion
+            continue
+        if pool_errors[row] is not None:
+            errors[k] = pool_errors[row]
+            continue
+        rows[k] = row
+        lane_i[k] = i[k]
+        lane_j[k] = j[k]
+        tokens_count[k] = pool_counts[row]
+        amp_f[k] = pool_amps[row]
+        d[k] = pool_d[row]
+        xp_i[k] = pool_xps[row, i[k]]
+        xp_j[k] = pool_xps[row, j[k]]
+        rate_j[k] = tokens_info[j[k]]["rate_f"]
+        reserves_j[k] = tokens_info[j[k]]["reserves"]
+        fee_f[k] = sum_all_fee(pool["fee"], dev_fee_f)
+        x[k] = xp_i[k] + dx[k] * tokens_info[i[k]]["rate_f"] // Constants.precision
+
+    # s_ and c over every token except j, with x[i] replaced by the new x
+    lane_xps = pool_xps[rows] if len(unique) else np.zeros((count, MAX_TOKENS), dtype=object)
+    lane_xps[np.arange(count), lane_i] = x
+    keep = np.arange(MAX_TOKENS)[None, :] < tokens_count[:, None]
+    keep[np.arange(count), lane_j] = False
+    s_ = np.where(keep, lane_xps, 0).sum(axis=1)
+    c_den = np.where(keep, lane_xps * tokens_count[:, None], 1).prod(axis=1)
+    c_num = d ** tokens_count
+    c = np.zeros(count, dtype=object)
+    for k in range(count):
+        if errors[k] is not None:
+            continue
+        if c_den[k] == 0:
+            errors[k] = Errors.Math.ediv_error
+            continue
+        c[k] = -(-c_num[k] // c_den[k])
+
+    y = batch_calc_y(c, amp_f * tokens_count, s_, d, tokens_count, errors)
+
+    dy = np.empty(count, dtype=object)
+    for k in range(count):
+        if errors[k] is not None:
+            continue
+        out = xp_j[k] - y[k]
+        if out < 0:
+            errors[k] = Errors.Math.nat_error
+            continue
+        out = out * Constants.precision // rate_j[k]
+        if out >= reserves_j[k]:
+            errors[k] = Errors.Dex.low_reserves
+            continue
+        fee = fee_f[k] * out // Constants.fee_denominator
+        if fee > out:
+            errors[k] = Errors.Dex.fee_overflow
+            continue
+        dy[k] = out - fee
+
+    if return_errors:
+        return dy, errors
+    return dy
@@ -0,0 +1,89 @@
+# Bulk versions of the `get_staker_info` and `get_referral_rewards` views
+#
+# Instead of answering a list of requests these walk the whole
+# `stakers_balance` (or `referral_rewards`) map and stream the pending
+# rewards out as columnar batches: dicts of equally long NumPy arrays, one row
+# per (staker, pool, token). Amounts live in object arrays so the arithmetic
+# stays arbitrary precision and matches the contract to the last unit.
+
+import numpy as np
+
+from stable_math import Constants, ContractError, Errors
+
+STAKER_COLUMNS = ("user", "pool_id", "token_index", "balance", "reward")
+REFERRAL_COLUMNS = ("user", "token", "reward")
+
+
+def _objects(values):
+    # filled one by one, slice assignment would unpack tuple items like token keys
+    array = np.empty(len(values), dtype=object)
+    for k, value in enumerate(values):
+        array[k] = value
+    return array
+
+def pending_rewards(balance, accumulator_f, reward_f, former_f):
+    """ (reward_f + |balance * accumulator_f - former_f|) / accum_precision on equally long object arrays """
+    return (reward_f + abs(balance * accumulator_f - former_f)) // Constants.accum_precision
+
+def _staker_batch(rows):
+    user, pool_id, token_index, balance, accumulator_f, reward_f, former_f = zip(*rows)
+    balance = _objects(balance)
+    return {
+        "user": _objects(user),
+        "pool_id": np.array(pool_id, dtype=np.int64),
+        "token_index": np.array(token_index, dtype=np.int64),
+        "balance": balance,
+        "reward": pending_rewards(balance, _objects(accumulator_f), _objects(reward_f), _objects(former_f)),
+    }
+
+def staker_reward_batches(storage, batch_size=65536, pool_ids=None):
+    """
+    Yields the pending rewards of every staker as columnar batches of at most
+    `batch_size` rows with the STAKER_COLUMNS keys.
+
+    `storage` is the full storage as kept by LocalChain. Like the view, a row
+    is produced only for the tokens present in the staker's `earnings`, with
+    the reward `get_staker_info` would report for it. `pool_ids` restricts the
+    walk to the given pools.
+    """
+    s = storage["storage"]
+    pools = s["pools"]
+    if pool_ids is not None:
+        pool_ids = set(pool_ids)
+    rows = []
+    for (user, pool_id), info in s["stakers_balance"].items():
+        if pool_ids is not None and pool_id not in pool_ids:
+            continue
+        if pool_id not in pools:
+            raise ContractError(Errors.Dex.pool_not_listed)
+        accumulator_f = pools[pool_id]["staker_accumulator"]["accumulator_f"]
+        balance = info["balance"]
+        for i, reward in info["earnings"].items():
+            rows.append((user, pool_id, i, balance, accumulator_f.get(i, 0), reward["reward_f"], reward["former_f"]))
+            if len(rows) == batch_size:
+                yield _staker_batch(rows)
+                rows = []
+    if rows:
+        yield _staker_batch(rows)
+
+def referral_reward_batches(storage, batch_size=65536):
+    """
+    Yields every `referral_rewards` entry as columnar batches with the
+    REFERRAL_COLUMNS keys. Tokens are in the big_map key form of
+    `stable_math.token_key`.
+    """
+    items = list(storage["storage"]["referral_rewards"].items())
+    for start in range(0, len(items), batch_size):
+        chunk = items[start:start + batch_size]
+        yield {
+            "user": _objects([user for (user, _), _ in chunk]),
+            "token": _objects([token for (_, token), _ in chunk]),
+            "reward": _objects([reward for _, reward in chunk]),
+        }
+
+def concat_batches(batches, columns):
+    """ joins streamed batches back into a single one """
+    batches = list(batches)
+    if not batches:
+        return {name: _objects([]) for name in columns}
+    return {name: np.concatenate([batch[name] for batch in batches]) for name in columns}
@@ -0,0 +1,190 @@
+# Cost benchmarks of the dex entrypoints
+#
+# Every entrypoint runs through LocalChain on 2, 3 and 4 token pools over a
+# range of reserve magnitudes, and each call records
+#
+#   steps          length of the interpreter's execution trace, about one
+#                  line per Michelson instruction. The pytezos interpreter
+#                  does not meter gas, this is the deterministic stand-in
+#   get_D, calc_y  Newton iterations the contract runs, counted on the
+#                  Python model with the D cache off so every solve happens
+#   diff_bytes     forged size of the big_map updates the call made
+#   storage_bytes  forged size of the storage outside big_maps
+#
+# Results are keyed "entrypoint/width/1eN" and compared against a JSON
+# baseline, where a metric growing past its threshold is a regression.
+#
+#   python3 scenario/bench_gas.py --baseline bench_baseline.json --update   # record
+#   python3 scenario/bench_gas.py --baseline bench_baseline.json            # compare
+
+import json
+from contextlib import contextmanager
+
+from pytezos.michelson.forge import forge_micheline
+
+from constants import *
+from helpers import *
+from fuzz import FAR_DEADLINE, Step
+from dex_model import DexModel
+from stable_math import Constants, ContractError, SolverStats, d_cache
+from chain_profile import ChainProfiler
+
+WIDTHS = (2, 3, 4)
+MAGNITUDES = (6, 12, 18, 24)
+METRICS = ("steps", "get_D", "calc_y", "diff_bytes", "storage_bytes")
+
+# relative growth tolerated before a metric counts as a regression
+DEFAULT_THRESHOLDS = {"steps": 0.01, "get_D": 0.0, "calc_y": 0.0, "diff_bytes": 0.0, "storage_bytes": 0.0}
+
+TOKENS = [token_a, token_b, token_c, token_d]
+
+
+def scenario(width, reserves):
+    """
+    Steps exercising every entrypoint on a fresh pool, as functions of the
+    storage since later amounts depend on what earlier calls left
+    """
+    share = reserves // 100
+    pool_id = 0
+
+    def shares(storage, user):
+        return storage["storage"]["ledger"].get((user, pool_id), 0)
+
+    return [
+        lambda s: Step("add_pool", dict(a_constant=A_CONST, input_tokens=TOKENS[:width], tokens_info=equal_pool_rates([reserves] * width), fees=fees), admin),
+        lambda s: Step("invest", dict(pool_id=pool_id, shares=1, in_amounts={i: share for i in range(width)}, deadline=FAR_DEADLINE, receiver=None, referral=None), alice),
+        lambda s: Step("invest", dict(pool_id=pool_id, shares=1, in_amounts={0: share}, deadline=FAR_DEADLINE, receiver=None, referral=None), bob),
+        lambda s: Step("swap", dict(pool_id=pool_id, idx_from=0, idx_to=1, amount=share, min_amount_out=1, deadline=FAR_DEADLINE, receiver=None, referral=None), bob),
+        lambda s: Step("swap", dict(pool_id=pool_id, idx_from=1, idx_to=0, amount=reserves // 2, min_amount_out=1, deadline=FAR_DEADLINE, receiver=None, referral=None), bob),
+        lambda s: Step("stake", {"add": {"pool_id": pool_id, "amount": shares(s, alice) // 2}}, alice),
+        lambda s: Step("divest_imbalanced", dict(pool_id=pool_id, amounts_out={0: share // 4, 1: share // 8}, max_shares=shares(s, alice), deadline=FAR_DEADLINE, receiver=None, referral=None), alice),
+        lambda s: Step("divest_one_coin", dict(pool_id=pool_id, shares=shares(s, alice) // 4, token_index=width - 1, min_amount_out=1, deadline=FAR_DEADLINE, receiver=None, referral=None), alice),
+        lambda s: Step("stake", {"remove": {"pool_id": pool_id, "amount": s["storage"]["stakers_balance"][(alice, pool_id)]["balance"]}}, alice),
+        lambda s: Step("divest", dict(pool_id=pool_id, min_amounts_out={i: 1 for i in range(width)}, shares=shares(s, alice), deadline=FAR_DEADLINE, receiver=None), alice),
+        lambda s: Step("set_fees", dict(pool_id=pool_id, fee=fees), admin),
+        lambda s: Step("ramp_A", dict(pool_id=pool_id, future_A=A_CONST // 2, future_time=FAR_DEADLINE), admin),
+        lambda s: Step("stop_ramp_A", pool_id, admin),
+    ]
+
+
+def diff_bytes(lazy_diff):
+    """ forged size of the keys and values a big_map diff writes """
+    size = 0
+    for item in lazy_diff:
+        for update in item.get("diff", {}).get("updates", []):
+            size += len(forge_micheline(update["key"]))
+            if update.get("value") is not None:
+                size += len(forge_micheline(update["value"]))
+    return size
+
+@contextmanager
+def _uncached():
+    """ every get_D solved from scratch, the way the contract does """
+    maxsize = d_cache.maxsize
+    d_cache.maxsize = 0
+    d_cache.invalidate()
+    try:
+        yield
+    finally:
+        d_cache.maxsize = maxsize
+
+def model_iterations(model, step):
+    """ runs `step` on a DexModel, returning the get_D and calc_y iterations it took """
+    stats = SolverStats()
+    counted = DexModel(model.storage, model.now, stats)
+    with _uncached():
+        counted.execute(step.entrypoint, step.params, step.sender)
+    model.storage = counted.storage
+    totals = {"get_D": 0, "calc_y": 0}
+    for (solver, _), iterations in stats.iterations.items():
+        totals[solver] = totals.get(solver, 0) + iterations
+    return totals
+
+def run(dex, storage, widths=WIDTHS, magnitudes=MAGNITUDES):
+    """ {"entrypoint/width/1eN": {metric: value}}, the first call of an entrypoint in a scenario keeps its name """
+    results = {}
+    for width in widths:
+        for magnitude in magnitudes:
+            profiler = ChainProfiler()
+            chain = LocalChain(storage=storage, profiler=profiler)
+            model = DexModel(storage)
+            seen = {}
+            for make in scenario(width, 10**magnitude):
+                step = make(model.storage)
+                if step.entrypoint == "ramp_A":
+                    # A can only start moving min_ramp_time after the pool was added
+                    chain.now = model.now = Constants.min_ramp_time
+                entrypoint = getattr(dex, step.entrypoint)
+                call = entrypoint(**step.params) if isinstance(step.params, dict) else entrypoint(step.params)
+                res = chain.execute(call, sender=step.sender)
+
+                try:
+                    iterations = model_iterations(model, step)
+                except ContractError as e:
+                    raise AssertionError(f"{step.entrypoint} fails on the model with {e.error} but not on the chain")
+
+                seen[step.entrypoint] = seen.get(step.entrypoint, 0) + 1
+                name = step.entrypoint if seen[step.entrypoint] == 1 else f"{step.entrypoint}_{seen[step.entrypoint]}"
+                results[f"{name}/{width}/1e{magnitude}"] = {
+                    "steps": profiler.last_run["steps"],
+                    **iterations,
+                    "diff_bytes": diff_bytes(res.lazy_diff),
+                    "storage_bytes": len(forge_micheline(profiler.last_run["storage"])),
+                }
+    return results
+
+
+def compare(results, baseline):
+    """
+    Regressions of `results` against a baseline {"thresholds": {...}, "results": {...}}
+    as (key, metric, baseline value, new value), and the keys the baseline misses
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS, **baseline.get("thresholds", {}))
+    regressions = []
+    missing = []
+    for key, metrics in sorted(results.items()):
+        old = baseline["results"].get(key)
+        if old is None:
+            missing.append(key)
+            continue
+        for metric, value in metrics.items():
+            if metric in old and value > old[metric] * (1 + thresholds.get(metric, 0.0)):
+                regressions.append((key, metric, old[metric], value))
+    return regressions, missing
+
+def save_baseline(results, path, thresholds=None):
+    with open(path, "w") as f:
+        json.dump({"thresholds": thresholds or DEFAULT_THRESHOLDS, "results": results}, f, indent=1, sort_keys=True)
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    from initial_storage import load_dex, load_storage
+
+    parser = argparse.ArgumentParser(description="benchmark the cost of the dex entrypoints")
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument("--update", action="store_true", help="record the results as the new baseline")
+    parser.add_argument("--widths", nargs="+", type=int, default=list(WIDTHS))
+    parser.add_argument("--magnitudes", nargs="+", type=int, default=list(MAGNITUDES), help="reserves are 10**N")
+    args = parser.parse_args()
+
+    storage = load_storage()
+    storage["storage"]["admin"] = admin
+    results = run(load_dex(), storage, args.widths, args.magnitudes)
+
+    if args.update:
+        save_baseline(results, args.baseline)
+        print(f"{len(results)} results written to {args.baseline}")
+        sys.exit(0)
+
+    regressions, missing = compare(results, load_baseline(args.baseline))
+    for key in missing:
+        print(f"{key}: not in the baseline")
+    for key, metric, old, new in regressions:
+        print(f"{key}: {metric} {old} -> {new}")
+    sys.exit(1 if regressions else 0)
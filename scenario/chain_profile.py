@@ -0,0 +1,192 @@
+# Per-phase profiling of LocalChain calls
+#
+# A LocalChain given a ChainProfiler splits every execute/interpret into the
+# phases below and adds their wall time and allocations up per entrypoint:
+#
+#   build           building the call (`dex.swap(...)`), for interfaces
+#                   wrapped with ChainProfiler.wrap
+#   encode_storage  Python storage -> Michelson
+#   run             the Michelson interpreter
+#   decode_storage  Michelson storage and operations -> Python
+#   bookkeeping     parsing the emitted operations and moving balances
+#                   (execute only)
+#
+#   profiler = ChainProfiler(cprofile=True)
+#   dex = profiler.wrap(load_dex())
+#   chain = LocalChain(storage=storage, profiler=profiler)
+#   ...
+#   print(profiler.table())
+#   profiler.write_collapsed("chain.folded")   # flamegraph.pl chain.folded > chain.svg
+#   profiler.dump_stats("chain.prof")          # python3 -m pstats chain.prof
+
+import cProfile
+import pstats
+import sys
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+from time import perf_counter
+
+from pytezos.contract.result import ContractCallResult
+from pytezos.michelson.repl import Interpreter
+from pytezos.michelson.sections import StorageSection
+
+from native_storage import NativeCallResult, NativeStorage
+
+PHASES = ("build", "encode_storage", "run", "decode_storage", "bookkeeping")
+
+# `blocks` is the net number of memory blocks the phase left allocated
+# (sys.getallocatedblocks), `peak` the most bytes it had allocated on top of
+# what it started with, only measured with trace_memory
+PhaseStats = namedtuple("PhaseStats", ["entrypoint", "phase", "calls", "seconds", "blocks", "peak"])
+
+
+class ChainProfiler:
+    """
+    Aggregates per-phase timings of LocalChain calls by entrypoint. With
+    `cprofile` every phase also runs under a cProfile.Profile of its
+    entrypoint, with `trace_memory` under tracemalloc (slow).
+    """
+    def __init__(self, cprofile=False, trace_memory=False):
+        self.cprofile = cprofile
+        self.trace_memory = trace_memory
+        self.stats = {}
+        self.profiles = {}
+        # what the interpreter reported for the last call: `steps`, the length
+        # of its execution trace (a line per instruction, plus one when a
+        # block is entered and left), the Micheline storage and the big_map diff
+        self.last_run = None
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def reset(self):
+        self.stats = {}
+        self.profiles = {}
+
+    @contextmanager
+    def phase(self, entrypoint, name):
+        """ accounts the enclosed code to `name` of `entrypoint` """
+        profile = None
+        if self.cprofile:
+            profile = self.profiles.get(entrypoint)
+            if profile is None:
+                profile = self.profiles[entrypoint] = cProfile.Profile()
+        if self.trace_memory:
+            start_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        blocks = sys.getallocatedblocks()
+        if profile:
+            profile.enable()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            if profile:
+                profile.disable()
+            stats = self.stats.setdefault((entrypoint, name), [0, 0.0, 0, 0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += sys.getallocatedblocks() - blocks
+            if self.trace_memory:
+                stats[3] = max(stats[3], tracemalloc.get_traced_memory()[1] - start_memory)
+
+    def interpret(self, call, storage, amount, balance, now, sender):
+        """
+        ContractCall.interpret with every phase accounted separately. Given a
+        NativeStorage, returns a NativeCallResult and converts nothing.
+        """
+        entrypoint = call.parameters["entrypoint"]
+        context = call.context
+        native = isinstance(storage, NativeStorage)
+        with self.phase(entrypoint, "encode_storage"):
+            if native:
+                initial_storage = storage.expr
+            else:
+                storage_ty = StorageSection.match(context.storage_expr)
+                initial_storage = storage_ty.from_python_object(storage).to_micheline_value(lazy_diff=True)
+        with self.phase(entrypoint, "run"):
+            operations, new_storage, lazy_diff, stdout, error = Interpreter.run_code(
+                parameter=call.parameters["value"],
+                entrypoint=entrypoint,
+                storage=initial_storage,
+                script=context.script["code"],
+                sender=sender,
+                amount=amount or call.amount,
+                balance=balance,
+                now=now,
+            )
+        self.last_run = {"steps": len(stdout), "storage": new_storage, "lazy_diff": lazy_diff}
+        if error:
+            raise error
+        with self.phase(entrypoint, "decode_storage"):
+            if native:
+                return NativeCallResult(
+                    storage.after_run(new_storage, lazy_diff),
+                    parameters=call.parameters,
+                    lazy_diff=lazy_diff,
+                    operations=operations,
+                )
+            return ContractCallResult.from_run_code(
+                {"operations": operations, "storage": new_storage, "lazy_storage_diff": lazy_diff},
+                parameters=call.parameters,
+                context=context,
+            )
+
+    def wrap(self, interface):
+        """ `interface` (a ContractInterface) with its entrypoint calls accounted to "build" """
+        return _TimedInterface(interface, self)
+
+    def summary(self):
+        """ PhaseStats of every (entrypoint, phase) seen, slowest first """
+        rows = [PhaseStats(entrypoint, phase, *stats) for (entrypoint, phase), stats in self.stats.items()]
+        return sorted(rows, key=lambda row: row.seconds, reverse=True)
+
+    def table(self):
+        """ summary() as an aligned text table, phases in call order within an entrypoint """
+        order = {phase: k for k, phase in enumerate(PHASES)}
+        totals = {}
+        for row in self.summary():
+            totals[row.entrypoint] = totals.get(row.entrypoint, 0) + row.seconds
+        rows = sorted(self.summary(), key=lambda row: (-totals[row.entrypoint], order[row.phase]))
+        lines = [f"{'entrypoint':<20} {'phase':<15} {'calls':>7} {'total s':>9} {'per call ms':>12} {'blocks':>9}"]
+        for row in rows:
+            lines.append(
+                f"{row.entrypoint:<20} {row.phase:<15} {row.calls:>7} {row.seconds:>9.3f} "
+                f"{row.seconds / row.calls * 1000:>12.3f} {row.blocks:>9}"
+            )
+        return "\n".join(lines)
+
+    def write_collapsed(self, path):
+        """ the phase times in the collapsed stack format flamegraph.pl and speedscope read, in microseconds """
+        with open(path, "w") as f:
+            for (entrypoint, phase), stats in sorted(self.stats.items()):
+                f.write(f"chain;{entrypoint};{phase} {round(stats[1] * 1e6)}\n")
+
+    def dump_stats(self, path, entrypoint=None):
+        """ cProfile stats of one entrypoint, or all of them merged, for pstats or snakeviz """
+        if not self.cprofile:
+            raise RuntimeError("the profiler was created without cprofile=True")
+        profiles = [self.profiles[entrypoint]] if entrypoint is not None else list(self.profiles.values())
+        if not profiles:
+            raise ValueError("nothing was profiled")
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+
+class _TimedInterface:
+    def __init__(self, interface, profiler):
+        self._interface = interface
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attr = getattr(self._interface, name)
+        if not callable(attr):
+            return attr
+        profiler = self._profiler
+
+        def build(*args, **kwargs):
+            with profiler.phase(name, "build"):
+                return attr(*args, **kwargs)
+        return build
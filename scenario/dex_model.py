@@ -0,0 +1,519 @@
+# Python model of the dex entrypoints
+#
+# Mirrors contracts/partials/dex_core/lambdas.ligo and admin/lambdas.ligo on
+# top of the math in `stable_math`, over the same storage dict LocalChain
+# keeps. Calls take the parameters in the form the PyTezos entrypoints
+# accept (`dex.swap(**params)`), checks run in the order the contract makes
+# them and a failing call raises `ContractError` with the contract's error
+# string, leaving the storage untouched.
+
+from pytezos.michelson.parse import michelson_to_micheline
+from pytezos.michelson.types import MichelsonType
+
+from stable_math import (
+    Constants, ContractError, Errors,
+    balance_inputs, calc_withdraw_one_coin, ceil_div, d_cache, get_dev_fee, get_pool_A,
+    nat_or_error, nip_fees_off_reserves, perform_swap, require, slice_fee, sum_all_fee, token_key,
+)
+
+# same as helpers.contract_self_address and helpers.me
+SELF_ADDRESS = "KT1BEqzn5Wx8uJrZNvuS9DVHmLvG9td3fDLi"
+DEFAULT_SENDER = "tz1Ke2h7sDdakHJQh8WX4Z372du1KChsksyU"
+
+DEFAULT_TOKEN_METADATA = {
+    "name": b"QuipuSwap Stableswap LP",
+    "symbol": b"sQPLP",
+    "decimals": b"18",
+    "description": b"Liquidity Pool token of QuipuSwap Stableswap AMM",
+    "shouldPreferSymbol": b"true",
+    "thumbnailUri": b"ipfs://QmR1nqRCcCnBu57wREdCa5Ya6ju3DyujbpV6fL8Rr5vKwh",
+}
+
+_TOKENS_MAP_TYPE = MichelsonType.match(michelson_to_micheline(
+    "map nat (or (address %fa12) (pair %fa2 (address %token_address) (nat %token_id)))"
+))
+
+def pack_tokens(tokens):
+    """ Bytes.pack(tokens) as add_pool computes it for `pool_to_id` """
+    return _TOKENS_MAP_TYPE.from_python_object(tokens).pack()
+
+def token_value(token):
+    """ token_t the way PyTezos shows it inside maps, the inverse of `token_key` """
+    kind, value = token_key(token)
+    if kind == "fa2":
+        return {"fa2": {"token_address": value[0], "token_id": value[1]}}
+    return {"fa12": value}
+
+def token_address_id(token):
+    """ (address, token_id) a transfer of `token` goes to, token_id is None for fa12 """
+    kind, value = token_key(token)
+    if kind == "fa2":
+        return value
+    return value, None
+
+def _unwrap(mapping, key, error):
+    if mapping is None or key not in mapping:
+        raise ContractError(error)
+    return mapping[key]
+
+def check_shares_and_reserves(pool):
+    reserves_sum = sum(info["reserves"] for info in pool["tokens_info"].values())
+    if pool["total_supply"] == 0 and reserves_sum > 0:
+        raise ContractError(Errors.Dex.supply_drained)
+    if pool["total_supply"] > 0 and reserves_sum == 0:
+        raise ContractError(Errors.Dex.reserves_drained)
+
+
+class DexModel:
+    """
+    Executes dex calls without the Michelson interpreter.
+
+    `storage` is the full storage as LocalChain keeps it. Like LocalChain the
+    model never mutates a storage in place, so storages can be shared with
+    chains, snapshots and other models. `execute` returns the token transfers
+    the call emits as (token_address, token_id, source, destination, amount)
+    tuples, the same shape `helpers.scan_balance_changes` yields.
+    """
+
+    entrypoints = (
+        "add_pool", "set_fees", "ramp_A", "stop_ramp_A",
+        "swap", "invest", "divest", "divest_imbalanced", "divest_one_coin", "stake",
+    )
+
+    def __init__(self, storage, now=0, stats=None):
+        self.storage = storage
+        self.now = now
+        # a stable_math.SolverStats counting the Newton iterations of the calls
+        self.stats = stats
+
+    def execute(self, entrypoint, params, sender=None):
+        if entrypoint not in self.entrypoints:
+            raise ValueError(f"entrypoint {entrypoint!r} is not modelled")
+        sender = sender or DEFAULT_SENDER
+        s = dict(self.storage["storage"])
+        transfers = []
+        getattr(self, f"_{entrypoint}")(s, params, sender, transfers)
+        self.storage = dict(self.storage, storage=s)
+        return transfers
+
+    def interpret(self, entrypoint, params, sender=None):
+        """ runs the call but keeps the current storage """
+        storage = self.storage
+        try:
+            return self.execute(entrypoint, params, sender)
+        finally:
+            self.storage = storage
+
+    # every write goes through these to copy the touched map first
+
+    @staticmethod
+    def _put(s, field, key, value):
+        s[field] = dict(s[field])
+        s[field][key] = value
+
+    @staticmethod
+    def _add(s, field, key, amount):
+        s[field] = dict(s[field])
+        s[field][key] = s[field].get(key, 0) + amount
+
+    def _transfer(self, transfers, token, source, destination, amount):
+        # `op # operations` in the contract, the list comes out newest first
+        address, token_id = token_address_id(token)
+        transfers.insert(0, (address, token_id, source, destination, amount))
+
+    def _check_deadline(self, deadline):
+        require(deadline >= self.now, Errors.Dex.time_expired)
+
+    def _check_admin(self, s, sender):
+        require(sender == s["admin"], Errors.Dex.not_contract_admin)
+
+    # admin lambdas
+
+    def _set_fees(self, s, params, sender, transfers):
+        self._check_admin(s, sender)
+        require(sum_all_fee(params["fee"], 0) < Constants.fee_denominator // 2, Errors.Dex.fee_overflow)
+        pool = _unwrap(s["pools"], params["pool_id"], Errors.Dex.pool_not_listed)
+        self._put(s, "pools", params["pool_id"], dict(pool, fee=params["fee"]))
+
+    def _ramp_A(self, s, params, sender, transfers):
+        self._check_admin(s, sender)
+        require(0 < params["future_A"] <= Constants.max_a, Errors.Dex.a_limit)
+        require(params["future_time"] >= self.now + Constants.min_ramp_time, Errors.Dex.timestamp_error)
+        pool = _unwrap(s["pools"], params["pool_id"], Errors.Dex.pool_not_listed)
+        require(self.now >= pool["initial_A_time"] + Constants.min_ramp_time, Errors.Dex.timestamp_error)
+
+        initial_A_f = get_pool_A(pool, self.now)
+        future_A_f = params["future_A"] * Constants.a_precision
+        if future_A_f >= initial_A_f:
+            require(future_A_f <= initial_A_f * Constants.max_a_change, Errors.Dex.a_limit)
+        else:
+            require(future_A_f * Constants.max_a_change >= initial_A_f, Errors.Dex.a_limit)
+
+        self._put(s, "pools", params["pool_id"], dict(
+            pool,
+            initial_A_f=initial_A_f,
+            future_A_f=future_A_f,
+            initial_A_time=self.now,
+            future_A_time=params["future_time"],
+        ))
+
+    def _stop_ramp_A(self, s, pool_id, sender, transfers):
+        self._check_admin(s, sender)
+        pool = _unwrap(s["pools"], pool_id, Errors.Dex.pool_not_listed)
+        current_A_f = get_pool_A(pool, self.now)
+        self._put(s, "pools", pool_id, dict(
+            pool,
+            initial_A_f=current_A_f,
+            future_A_f=current_A_f,
+            initial_A_time=self.now,
+            future_A_time=self.now,
+        ))
+
+    def _add_pool(self, s, params, sender, transfers):
+        self._check_admin(s, sender)
+        input_tokens = sorted(set(token_key(token) for token in params["input_tokens"]))
+        n_tokens = len(input_tokens)
+        require(
+            Constants.min_tokens_count <= n_tokens <= Constants.max_tokens_count
+            and n_tokens == len(params["tokens_info"]),
+            Errors.Dex.wrong_tokens_count
+        )
+        require(0 < params["a_constant"] <= Constants.max_a, Errors.Dex.a_limit)
+        require(sum_all_fee(params["fees"], 0) < Constants.fee_denominator // 2, Errors.Dex.fee_overflow)
+
+        tokens = {i: token_value(token) for i, token in enumerate(input_tokens)}
+        token_bytes = pack_tokens(tokens)
+        pool_id = s["pool_to_id"].get(token_bytes, s["pools_count"])
+        pool = s["pools"].get(pool_id) or {
+            "initial_A_f": 0,
+            "future_A_f": 0,
+            "initial_A_time": self.now,
+            "future_A_time": self.now,
+            "tokens_info": {},
+            "fee": {"lp_f": 0, "stakers_f": 0, "ref_f": 0},
+            "staker_accumulator": {"accumulator_f": {}, "total_fees": {}, "total_staked": 0},
+            "total_supply": 0,
+        }
+        require(pool["total_supply"] == 0, Errors.Dex.pool_listed)
+        self._put(s, "tokens", pool_id, tokens)
+
+        if s["pools_count"] == pool_id:
+            self._put(s, "pool_to_id", token_bytes, pool_id)
+            self._put(s, "token_metadata", pool_id, {"token_id": pool_id, "token_info": dict(DEFAULT_TOKEN_METADATA)})
+            s["pools_count"] += 1
+
+        inputs = {}
+        tokens_info = dict(params["tokens_info"])
+        for i, info in sorted(params["tokens_info"].items()):
+            inputs[i] = info["reserves"]
+            tokens_info[i] = dict(info, reserves=0)
+
+        pool = dict(
+            pool,
+            initial_A_f=params["a_constant"] * Constants.a_precision,
+            future_A_f=params["a_constant"] * Constants.a_precision,
+            initial_A_time=self.now,
+            future_A_time=self.now,
+            tokens_info=tokens_info,
+            fee=params["fees"],
+        )
+        self._add_liq(s, pool_id, pool, inputs, 1, sender, None, sender, transfers)
+
+    # dex lambdas
+
+    def _add_liq(self, s, pool_id, pool, inputs, min_mint_amount, receiver, referral, sender, transfers):
+        require(min_mint_amount > 0, Errors.Dex.zero_min_out)
+        amp_f = get_pool_A(pool, self.now)
+        init_tokens_info = pool["tokens_info"]
+        d0 = d_cache.get_D(init_tokens_info, amp_f, stats=self.stats)
+        token_supply = pool["total_supply"]
+
+        new_tokens_info = {}
+        for key, info in sorted(init_tokens_info.items()):
+            value = inputs.get(key, 0)
+            require(token_supply != 0 or value > 0, Errors.Dex.zero_in)
+            new_tokens_info[key] = dict(info, reserves=info["reserves"] + value)
+        d1 = d_cache.get_D(new_tokens_info, amp_f, stats=self.stats)
+        require(d1 > d0, Errors.Dex.zero_in)
+
+        if token_supply > 0:
+            balanced = balance_inputs(
+                init_tokens_info,
+                d0,
+                new_tokens_info,
+                d1,
+                _unwrap(s["tokens"], pool_id, Errors.Dex.pool_not_listed),
+                pool["fee"],
+                get_dev_fee(s),
+                referral or s["default_referral"],
+                {
+                    "dev_rewards": s["dev_rewards"],
+                    "referral_rewards": s["referral_rewards"],
+                    "staker_accumulator": pool["staker_accumulator"],
+                    "tokens_info": new_tokens_info,
+                    "tokens_info_without_lp": new_tokens_info,
+                }
+            )
+            s["dev_rewards"] = balanced["dev_rewards"]
+            s["referral_rewards"] = balanced["referral_rewards"]
+            pool = dict(pool, staker_accumulator=balanced["staker_accumulator"], tokens_info=balanced["tokens_info"])
+            d2 = d_cache.get_D(balanced["tokens_info_without_lp"], amp_f, stats=self.stats)
+            mint_amount = token_supply * nat_or_error(d2 - d0, Errors.Math.nat_error) // d0
+        else:
+            pool = dict(pool, tokens_info=new_tokens_info)
+            mint_amount = d1
+
+        require(mint_amount >= min_mint_amount, Errors.Dex.wrong_shares_out)
+
+        pool["total_supply"] += mint_amount
+        receiver = receiver or sender
+        self._add(s, "ledger", (receiver, pool_id), mint_amount)
+        self._put(s, "pools", pool_id, pool)
+
+        for key, value in sorted(inputs.items()):
+            if value > 0:
+                token = _unwrap(_unwrap(s["tokens"], pool_id, Errors.Dex.pool_not_listed), key, Errors.Dex.wrong_index)
+                self._transfer(transfers, token, sender, SELF_ADDRESS, value)
+
+    def _invest(self, s, params, sender, transfers):
+        self._check_deadline(params["deadline"])
+        pool = _unwrap(s["pools"], params["pool_id"], Errors.Dex.pool_not_listed)
+        self._add_liq(
+            s, params["pool_id"], pool, params["in_amounts"], params["shares"],
+            params.get("receiver"), params.get("referral"), sender, transfers
+        )
+
+    def _swap(self, s, params, sender, transfers):
+        self._check_deadline(params["deadline"])
+        require(params["min_amount_out"] > 0, Errors.Dex.zero_min_out)
+        dx = params["amount"]
+        require(dx != 0, Errors.Dex.zero_in)
+        pool_id = params["pool_id"]
+        tokens = _unwrap(s["tokens"], pool_id, Errors.Dex.pool_not_listed)
+        i = params["idx_from"]
+        j = params["idx_to"]
+        require(i < len(tokens) and j < len(tokens), Errors.Dex.wrong_index)
+        receiver = params.get("receiver") or sender
+        pool = _unwrap(s["pools"], pool_id, Errors.Dex.pool_not_listed)
+
+        dy = perform_swap(i, j, dx, pool, self.now, stats=self.stats)
+        total_staked = pool["staker_accumulator"]["total_staked"]
+        after_fees = slice_fee(dy, pool["fee"], get_dev_fee(s), total_staked)
+        accumulator = dict(pool["staker_accumulator"])
+        to_stakers_f = 0
+        if total_staked > 0:
+            accumulator["total_fees"] = dict(accumulator["total_fees"])
+            accumulator["total_fees"][j] = accumulator["total_fees"].get(j, 0) + after_fees["stakers"]
+            to_stakers_f = after_fees["stakers"] * Constants.accum_precision // total_staked
+        referral = params.get("referral") or s["default_referral"]
+        token_j = _unwrap(tokens, j, Errors.Dex.no_token)
+        self._add(s, "referral_rewards", (referral, token_key(token_j)), after_fees["ref"])
+        self._add(s, "dev_rewards", token_key(token_j), after_fees["dev"])
+        accumulator["accumulator_f"] = dict(accumulator["accumulator_f"])
+        accumulator["accumulator_f"][j] = accumulator["accumulator_f"].get(j, 0) + to_stakers_f
+
+        require(after_fees["dy"] >= params["min_amount_out"], Errors.Dex.high_min_out)
+
+        token_info_i = _unwrap(pool["tokens_info"], i, Errors.Dex.no_token_info)
+        token_info_j = nip_fees_off_reserves(
+            after_fees["stakers"],
+            after_fees["ref"],
+            after_fees["dev"],
+            _unwrap(pool["tokens_info"], j, Errors.Dex.no_token_info)
+        )
+        token_info_i = dict(token_info_i, reserves=token_info_i["reserves"] + dx)
+        token_info_j["reserves"] = nat_or_error(token_info_j["reserves"] - after_fees["dy"], Errors.Dex.no_liquidity)
+        tokens_info = dict(pool["tokens_info"])
+        tokens_info[i] = token_info_i
+        tokens_info[j] = token_info_j
+        self._put(s, "pools", pool_id, dict(pool, tokens_info=tokens_info, staker_accumulator=accumulator))
+
+        self._transfer(transfers, token_j, SELF_ADDRESS, receiver, after_fees["dy"])
+        self._transfer(transfers, _unwrap(tokens, i, Errors.Dex.no_token), sender, SELF_ADDRESS, dx)
+
+    def _divest(self, s, params, sender, transfers):
+        self._check_deadline(params["deadline"])
+        pool_id = params["pool_id"]
+        require(s["pools_count"] > pool_id, Errors.Dex.pool_not_listed)
+        shares = params["shares"]
+        require(shares != 0, Errors.Dex.zero_in)
+
+        pool = _unwrap(s["pools"], pool_id, Errors.Dex.pool_not_listed)
+        receiver = params.get("receiver") or sender
+        total_supply = pool["total_supply"]
+
+        tokens = _unwrap(s["tokens"], pool_id, Errors.Dex.pool_not_listed)
+        tokens_info = dict(pool["tokens_info"])
+        for key, token in sorted(tokens.items()):
+            token_info = _unwrap(tokens_info, key, Errors.Dex.no_token_info)
+            min_amount_out = params["min_amounts_out"].get(key, 1)
+            require(min_amount_out > 0, Errors.Dex.zero_min_out)
+            require(total_supply != 0, Errors.div_by_zero)
+            value = token_info["reserves"] * shares // total_supply
+            require(value >= min_amount_out, Errors.Dex.high_min_out)
+            require(value != 0, Errors.Dex.dust_out)
+            self._transfer(transfers, token, SELF_ADDRESS, receiver, value)
+            tokens_info[key] = dict(token_info, reserves=nat_or_error(token_info["reserves"] - value, Errors.Dex.low_reserves))
+
+        pool = dict(
+            pool,
+            tokens_info=tokens_info,
+            total_supply=nat_or_error(pool["total_supply"] - shares, Errors.Dex.low_total_supply),
+        )
+        key = (sender, pool_id)
+        self._put(s, "ledger", key, nat_or_error(s["ledger"].get(key, 0) - shares, Errors.Dex.insufficient_lp))
+        self._put(s, "pools", pool_id, pool)
+
+    def _divest_imbalanced(self, s, params, sender, transfers):
+        self._check_deadline(params["deadline"])
+        require(params["max_shares"] > 0, Errors.Dex.zero_in)
+
+        pool_id = params["pool_id"]
+        receiver = params.get("receiver") or sender
+        key = (sender, pool_id)
+        share = s["ledger"].get(key, 0)
+
+        pool = _unwrap(s["pools"], pool_id, Errors.Dex.pool_not_listed)
+        tokens = _unwrap(s["tokens"], pool_id, Errors.Dex.pool_not_listed)
+        amp_f = get_pool_A(pool, self.now)
+        init_tokens_info = pool["tokens_info"]
+        d0 = d_cache.get_D(init_tokens_info, amp_f, stats=self.stats)
+        token_supply = pool["total_supply"]
+
+        new_tokens_info = dict(init_tokens_info)
+        for idx, value in sorted(params["amounts_out"].items()):
+            t_i = _unwrap(new_tokens_info, idx, Errors.Dex.no_token_info)
+            reserves = nat_or_error(t_i["reserves"] - value, Errors.Dex.low_reserves)
+            require(reserves > 0, Errors.Dex.low_reserves)
+            new_tokens_info[idx] = dict(t_i, reserves=reserves)
+            if value > 0:
+                self._transfer(transfers, _unwrap(tokens, idx, Errors.Dex.wrong_index), SELF_ADDRESS, receiver, value)
+
+        d1 = d_cache.get_D(new_tokens_info, amp_f, stats=self.stats)
+        require(d1 < d0, Errors.Dex.zero_in)
+        balanced = balance_inputs(
+            init_tokens_info,
+            d0,
+            new_tokens_info,
+            d1,
+            tokens,
+            pool["fee"],
+            get_dev_fee(s),
+            params.get("referral") or s["default_referral"],
+            {
+                "dev_rewards": s["dev_rewards"],
+                "referral_rewards": s["referral_rewards"],
+                "staker_accumulator": pool["staker_accumulator"],
+                "tokens_info": new_tokens_info,
+                "tokens_info_without_lp": new_tokens_info,
+            }
+        )
+        d2 = d_cache.get_D(balanced["tokens_info_without_lp"], amp_f, stats=self.stats)
+        burn_amount = ceil_div(nat_or_error(d0 - d2, Errors.Math.nat_error) * token_supply, d0)
+        require(burn_amount > 0, Errors.Dex.zero_burn_amount)
+        require(burn_amount <= params["max_shares"], Errors.Dex.low_max_shares_in)
+        new_shares = nat_or_error(share - burn_amount, Errors.Dex.insufficient_lp)
+
+        s["dev_rewards"] = balanced["dev_rewards"]
+        s["referral_rewards"] = balanced["referral_rewards"]
+        pool = dict(
+            pool,
+            staker_accumulator=balanced["staker_accumulator"],
+            tokens_info=balanced["tokens_info"],
+            total_supply=nat_or_error(token_supply - burn_amount, Errors.Math.nat_error),
+        )
+        check_shares_and_reserves(pool)
+        self._put(s, "pools", pool_id, pool)
+        self._put(s, "ledger", key, new_shares)
+
+    def _divest_one_coin(self, s, params, sender, transfers):
+        self._check_deadline(params["deadline"])
+        require(params["min_amount_out"] > 0, Errors.Dex.zero_min_out)
+        require(params["shares"] > 0, Errors.Dex.zero_in)
+
+        pool_id = params["pool_id"]
+        i = params["token_index"]
+        pool = _unwrap(s["pools"], pool_id, Errors.Dex.pool_not_listed)
+        require(i < len(pool["tokens_info"]), Errors.Dex.wrong_index)
+        sender_key = (sender, pool_id)
+        token = _unwrap(_unwrap(s["tokens"], pool_id, Errors.Dex.pool_not_listed), i, Errors.Dex.wrong_index)
+
+        amp_f = get_pool_A(pool, self.now)
+        dev_fee_f = get_dev_fee(s)
+        result = calc_withdraw_one_coin(amp_f, params["shares"], i, dev_fee_f, pool, self.stats)
+        require(result["dy"] >= params["min_amount_out"], Errors.Dex.high_min_out)
+        all_fee_f = sum_all_fee(pool["fee"], dev_fee_f) or 1
+        dev_fee = result["dy_fee"] * dev_fee_f // all_fee_f
+        ref_fee = result["dy_fee"] * pool["fee"]["ref_f"] // all_fee_f
+        staker_fee = result["dy_fee"] * pool["fee"]["stakers_f"] // all_fee_f
+        accumulator = pool["staker_accumulator"]
+        if accumulator["total_staked"] > 0:
+            accumulator = dict(
+                accumulator,
+                total_fees=dict(accumulator["total_fees"]),
+                accumulator_f=dict(accumulator["accumulator_f"]),
+            )
+            accumulator["total_fees"][i] = accumulator["total_fees"].get(i, 0) + staker_fee
+            accumulator["accumulator_f"][i] = accumulator["accumulator_f"].get(i, 0) \
+                + staker_fee * Constants.accum_precision // accumulator["total_staked"]
+        else:
+            staker_fee = 0
+
+        info = nip_fees_off_reserves(staker_fee, ref_fee, dev_fee, _unwrap(pool["tokens_info"], i, Errors.Dex.no_token_info))
+        info["reserves"] = nat_or_error(info["reserves"] - result["dy"], Errors.Dex.low_reserves)
+        tokens_info = dict(pool["tokens_info"])
+        tokens_info[i] = info
+        pool = dict(pool, tokens_info=tokens_info, total_supply=result["ts"], staker_accumulator=accumulator)
+        check_shares_and_reserves(pool)
+        self._put(s, "pools", pool_id, pool)
+
+        account_bal = s["ledger"].get(sender_key, 0)
+        self._put(s, "ledger", sender_key, nat_or_error(account_bal - params["shares"], Errors.FA2.insufficient_balance))
+        self._add(s, "dev_rewards", token_key(token), dev_fee)
+        referral = params.get("referral") or s["default_referral"]
+        self._add(s, "referral_rewards", (referral, token_key(token)), ref_fee)
+
+        self._transfer(transfers, token, SELF_ADDRESS, params.get("receiver") or sender, result["dy"])
+
+    def _stake(self, s, params, sender, transfers):
+        (action, args), = params.items()
+        pool_id = args["pool_id"]
+        shares = args["amount"]
+        staker_key = (sender, pool_id)
+        info = s["stakers_balance"].get(staker_key, {"balance": 0, "earnings": {}})
+        pool = _unwrap(s["pools"], pool_id, Errors.Dex.pool_not_listed)
+        accumulator = pool["staker_accumulator"]
+
+        # harvest
+        earnings = dict(info["earnings"])
+        for i, pool_accum_f in sorted(accumulator["accumulator_f"].items()):
+            reward = earnings.get(i, {"former_f": 0, "reward_f": 0})
+            new_former_f = info["balance"] * pool_accum_f
+            reward_amt, reward_change = divmod(reward["reward_f"] + abs(new_former_f - reward["former_f"]), Constants.accum_precision)
+            if reward_amt > 0:
+                token = _unwrap(_unwrap(s["tokens"], pool_id, Errors.Dex.pool_not_listed), i, Errors.Dex.wrong_index)
+                self._transfer(transfers, token, SELF_ADDRESS, sender, reward_amt)
+            earnings[i] = {"reward_f": reward_change, "former_f": new_former_f}
+        info = {"balance": info["balance"], "earnings": earnings}
+
+        if shares > 0:
+            if action == "add":
+                new_balance = info["balance"] + shares
+                forwarder, receiver = sender, SELF_ADDRESS
+                total_staked = accumulator["total_staked"] + shares
+            else:
+                new_balance = nat_or_error(info["balance"] - shares, Errors.Dex.wrong_shares_out)
+                forwarder, receiver = SELF_ADDRESS, sender
+                total_staked = nat_or_error(accumulator["total_staked"] - shares, Errors.Dex.wrong_shares_out)
+            info = {
+                "balance": new_balance,
+                "earnings": {
+                    i: dict(reward, former_f=new_balance * accumulator["accumulator_f"].get(i, 0))
+                    for i, reward in earnings.items()
+                },
+            }
+            pool = dict(pool, staker_accumulator=dict(accumulator, total_staked=total_staked))
+            self._transfer(transfers, {"fa2": s["quipu_token"]}, forwarder, receiver, shares)
+
+        self._put(s, "pools", pool_id, pool)
+        self._put(s, "stakers_balance", staker_key, info)
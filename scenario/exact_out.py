@@ -0,0 +1,95 @@
+# Exact output quotes, the inverse of the `get_dy` view
+#
+# `get_dx` finds the smallest dx for which get_dy(dx) is at least the amount
+# wanted. get_dy goes through calc_y's Newton iterations and several floor
+# divisions, so it is not inverted in closed form. Instead, the balance of
+# the bought token the swap has to leave is worked out exactly, get_y run
+# backwards gives the input balance reaching it, and that estimate is
+# settled against the exact forward quote. The search gallops away from the
+# estimate until it brackets the answer and then bisects the bracket, so it
+# evaluates get_dy at most about 2 * log2 of the distance between the
+# estimate and the answer - in practice the estimate is right and two
+# evaluations confirm it.
+#
+# A swap takes its fees in several pieces that are rounded down one by one,
+# so the swap itself pays at least as much as the view, and the dx found
+# here is safe to send with min_amount_out set to the amount wanted.
+
+from stable_math import (
+    Constants, ContractError, Errors,
+    ceil_div, get_dev_fee, get_y, require, sum_all_fee, xp,
+)
+from views import _pool, get_dy
+
+
+def _target_y(pool, j, dy, fee_f):
+    """ the highest balance xp[j] may be left at for get_dy to give `dy` """
+    # get_dy is gross - floor(gross * fee_f / fee_denominator), the least gross giving dy
+    gross = (dy - 1) * Constants.fee_denominator // (Constants.fee_denominator - fee_f) + 1
+    return xp(pool)[j] - ceil_div(gross * pool["tokens_info"][j]["rate_f"], Constants.precision)
+
+def _estimate(pool, i, j, y, now):
+    """ dx leaving xp[j] at `y` by the continuous invariant, None if it cannot tell """
+    xp_ = xp(pool)
+    try:
+        x = get_y(j, i, y, xp_, pool, now)
+    except ContractError:
+        return None
+    return max(1, ceil_div((x - xp_[i]) * Constants.precision, pool["tokens_info"][i]["rate_f"]))
+
+def get_dx(storage, pool_id, i, j, dy, now=0, return_steps=False):
+    """
+    Smallest dx of token i with get_dy(storage, pool_id, i, j, dx) >= dy.
+    Raises ContractError (low-reserves) if no swap of the pool gets `dy`.
+    With `return_steps` returns (dx, number of get_dy evaluations).
+    """
+    pool = _pool(storage, pool_id)
+    tokens_info = pool["tokens_info"]
+    require(i in tokens_info and j in tokens_info, Errors.Dex.wrong_index)
+    require(i != j, Errors.assertion)
+    require(dy > 0, Errors.Dex.zero_min_out)
+    fee_f = sum_all_fee(pool["fee"], get_dev_fee(storage["storage"]))
+    steps = 0
+    drained = set()
+
+    def enough(dx):
+        """ get_dy(dx) >= dy, or too much to be swapped at all """
+        nonlocal steps
+        steps += 1
+        try:
+            return get_dy(storage, pool_id, i, j, dx, now) >= dy
+        except ContractError as e:
+            if e.error != Errors.Dex.low_reserves:
+                raise
+            drained.add(dx)
+            return True
+
+    # calc_y never goes below 1, past that no amount in gets dy out
+    y = _target_y(pool, j, dy, fee_f)
+    require(y >= 1, Errors.Dex.low_reserves)
+
+    # bracket the answer: `lo` is not enough, `hi` is
+    guess = _estimate(pool, i, j, y, now) or 1
+    if enough(guess):
+        lo, hi, step = guess - 1, guess, 1
+        while lo > 0 and enough(lo):
+            hi = lo
+            lo = max(0, lo - step)
+            step *= 2
+    else:
+        lo, hi, step = guess, guess + 1, 1
+        while not enough(hi):
+            lo = hi
+            hi += step
+            step *= 2
+
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if enough(mid):
+            hi = mid
+        else:
+            lo = mid
+
+    # the pool runs dry before giving that much
+    require(hi not in drained, Errors.Dex.low_reserves)
+    return (hi, steps) if return_steps else hi
@@ -0,0 +1,305 @@
+# Differential fuzzing of the dex against the Python model
+#
+# Random call sequences run through two backends, normally LocalChain (the
+# real contract in the Michelson interpreter) and `dex_model.DexModel`. After
+# every step the outcome (error or emitted transfers) and the economic part
+# of the storage have to agree. Sequences are screened on the model first and
+# only those reaching behaviour not seen before go to the interpreter. A
+# disagreeing sequence is shrunk to a minimal reproduction.
+#
+#   python3 scenario/fuzz.py --iterations 200 --seed 1
+
+import random
+from collections import namedtuple
+
+from pytezos import MichelsonRuntimeError
+
+from constants import *
+from helpers import *
+from dex_model import DexModel
+from stable_math import Constants, ContractError
+
+Step = namedtuple("Step", ["entrypoint", "params", "sender"])
+Outcome = namedtuple("Outcome", ["error", "transfers"])
+Discrepancy = namedtuple("Discrepancy", ["index", "steps", "what", "reference", "candidate"])
+
+# parts of the storage both backends must agree on
+STATE_FIELDS = (
+    "pools_count", "tokens", "pool_to_id", "pools", "ledger",
+    "dev_rewards", "referral_rewards", "stakers_balance",
+)
+
+ACTORS = [admin, alice, bob, carol]
+
+TOKENS = [
+    token_a, token_b, token_c, token_d,
+    {"fa2": {"token_address": token_e_address, "token_id": 0}},
+    {"fa2": {"token_address": token_e_address, "token_id": 1}},
+]
+
+FAR_DEADLINE = 10**9
+
+# parameters the shrinker leaves alone
+FIXED_PARAMS = ("deadline", "rate_f", "precision_multiplier_f")
+
+
+class ModelRunner:
+    def __init__(self, storage, model=DexModel):
+        self.model = model(storage)
+
+    def run(self, step):
+        try:
+            return Outcome(None, self.model.execute(step.entrypoint, step.params, step.sender))
+        except ContractError as e:
+            return Outcome(e.error, None)
+
+    def state(self):
+        s = self.model.storage["storage"]
+        return {field: s[field] for field in STATE_FIELDS}
+
+class ChainRunner:
+    def __init__(self, dex, storage):
+        self.dex = dex
+        self.chain = LocalChain(storage=storage)
+
+    def run(self, step):
+        entrypoint = getattr(self.dex, step.entrypoint)
+        # stop_ramp_A takes a bare pool id
+        call = entrypoint(**step.params) if isinstance(step.params, dict) else entrypoint(step.params)
+        try:
+            res = self.chain.execute(call, sender=step.sender)
+        except MichelsonRuntimeError as e:
+            return Outcome(str(e), None)
+        transfers = [change[1:] for change in scan_balance_changes(res.operations) if change[0] == "token"]
+        return Outcome(None, transfers)
+
+    def state(self):
+        s = self.chain.storage["storage"]
+        return {field: s[field] for field in STATE_FIELDS}
+
+def same_error(reference, candidate):
+    # the interpreter wraps the failwith string into a longer message
+    if reference is None or candidate is None:
+        return reference is candidate
+    return reference == candidate or candidate in reference or reference in candidate
+
+
+def differential(steps, reference, candidate):
+    """
+    Runs `steps` on fresh backends made by the `reference` and `candidate`
+    factories and returns the first Discrepancy, or None if they agree.
+    """
+    ref = reference()
+    cand = candidate()
+    for index, step in enumerate(steps):
+        ref_outcome = ref.run(step)
+        cand_outcome = cand.run(step)
+        if not same_error(ref_outcome.error, cand_outcome.error):
+            return Discrepancy(index, steps[:index + 1], "error", ref_outcome, cand_outcome)
+        if ref_outcome.transfers != cand_outcome.transfers:
+            return Discrepancy(index, steps[:index + 1], "transfers", ref_outcome, cand_outcome)
+        ref_state = ref.state()
+        cand_state = cand.state()
+        for field in STATE_FIELDS:
+            if ref_state[field] != cand_state[field]:
+                return Discrepancy(index, steps[:index + 1], field, ref_state[field], cand_state[field])
+    return None
+
+
+def _smaller(value):
+    """ candidates to replace an int parameter with while shrinking """
+    if not isinstance(value, int) or isinstance(value, bool) or value <= 1:
+        return []
+    return [1, value // 2, value - 1]
+
+def _shrink_params(params):
+    """ yields copies of `params` with a single int leaf made smaller """
+    for key, value in params.items():
+        if isinstance(value, dict):
+            for smaller in _shrink_params(value):
+                yield {**params, key: smaller}
+        elif key not in FIXED_PARAMS:
+            for smaller in _smaller(value):
+                yield {**params, key: smaller}
+
+def shrink(steps, still_fails, max_attempts=2000):
+    """
+    Greedily drops steps and shrinks integer parameters while
+    `still_fails(steps)` keeps returning a Discrepancy. Returns the smallest
+    failing discrepancy found.
+    """
+    best = still_fails(steps)
+    if best is None:
+        return None
+    steps = list(best.steps)
+    attempts = 0
+    progress = True
+    while progress and attempts < max_attempts:
+        progress = False
+        for i in reversed(range(len(steps))):
+            candidate = steps[:i] + steps[i + 1:]
+            attempts += 1
+            found = still_fails(candidate) if candidate else None
+            if found is not None:
+                best, steps, progress = found, list(found.steps), True
+                break
+        if progress:
+            continue
+        for i, step in enumerate(steps):
+            for params in _shrink_params(step.params):
+                candidate = steps[:i] + [step._replace(params=params)] + steps[i + 1:]
+                attempts += 1
+                found = still_fails(candidate)
+                if found is not None:
+                    best, steps, progress = found, list(found.steps), True
+                    break
+            if progress:
+                break
+    return best
+
+
+def _amount(rng, limit):
+    """ log-uniform amount in [1, limit] with extra weight on edge values """
+    limit = max(limit, 1)
+    roll = rng.random()
+    if roll < 0.05:
+        return limit
+    if roll < 0.1:
+        return 1
+    return max(1, int(limit ** rng.random()))
+
+def _fees(rng):
+    if rng.random() < 0.3:
+        return {"lp_f": 0, "stakers_f": 0, "ref_f": 0}
+    return {name: rng.randrange(0, Constants.fee_denominator // 20) for name in ("lp_f", "stakers_f", "ref_f")}
+
+def random_step(rng, s):
+    """ a plausible random call given the current inner storage `s` """
+    pools = s["pools"]
+    sender = rng.choice(ACTORS)
+    if not pools or rng.random() < 0.05:
+        count = rng.randint(Constants.min_tokens_count, Constants.max_tokens_count)
+        return Step("add_pool", {
+            "a_constant": _amount(rng, Constants.max_a),
+            "input_tokens": rng.sample(TOKENS, count),
+            "tokens_info": equal_pool_rates([_amount(rng, 10**12) for _ in range(count)]),
+            "fees": _fees(rng),
+        }, admin if rng.random() < 0.95 else sender)
+
+    pool_id = rng.choice(list(pools)) if rng.random() < 0.97 else len(pools)
+    pool = pools.get(pool_id) or next(iter(pools.values()))
+    count = len(pool["tokens_info"])
+    reserves = [info["reserves"] for _, info in sorted(pool["tokens_info"].items())]
+    shares = s["ledger"].get((sender, pool_id), 0)
+    i, j = rng.sample(range(count), 2) if rng.random() < 0.97 else (rng.randrange(count + 1), rng.randrange(count + 1))
+    referral = rng.choice([None, None, alice, bob])
+
+    kind = rng.choices(
+        ["swap", "invest", "divest", "divest_imbalanced", "divest_one_coin", "stake", "set_fees"],
+        weights=[30, 20, 8, 10, 10, 12, 4],
+    )[0]
+    if kind == "swap":
+        return Step("swap", {
+            "pool_id": pool_id, "idx_from": i, "idx_to": j,
+            "amount": _amount(rng, 2 * reserves[min(i, count - 1)] + 1),
+            "min_amount_out": 1, "deadline": FAR_DEADLINE, "receiver": None, "referral": referral,
+        }, sender)
+    if kind == "invest":
+        return Step("invest", {
+            "pool_id": pool_id, "shares": 1,
+            "in_amounts": {k: _amount(rng, 2 * reserves[k] + 1) for k in range(count) if rng.random() < 0.8},
+            "deadline": FAR_DEADLINE, "receiver": None, "referral": referral,
+        }, sender)
+    if kind == "divest":
+        return Step("divest", {
+            "pool_id": pool_id, "min_amounts_out": {}, "shares": _amount(rng, shares),
+            "deadline": FAR_DEADLINE, "receiver": None,
+        }, sender)
+    if kind == "divest_imbalanced":
+        return Step("divest_imbalanced", {
+            "pool_id": pool_id, "max_shares": max(shares, 1),
+            "amounts_out": {k: _amount(rng, reserves[k]) for k in range(count) if rng.random() < 0.5} or {i: 1},
+            "deadline": FAR_DEADLINE, "receiver": None, "referral": referral,
+        }, sender)
+    if kind == "divest_one_coin":
+        return Step("divest_one_coin", {
+            "pool_id": pool_id, "shares": _amount(rng, shares), "token_index": i, "min_amount_out": 1,
+            "deadline": FAR_DEADLINE, "receiver": None, "referral": referral,
+        }, sender)
+    if kind == "stake":
+        staked = s["stakers_balance"].get((sender, pool_id), {"balance": 0})["balance"]
+        if staked and rng.random() < 0.4:
+            return Step("stake", {"remove": {"pool_id": pool_id, "amount": rng.randint(0, staked)}}, sender)
+        return Step("stake", {"add": {"pool_id": pool_id, "amount": rng.choice([0, _amount(rng, 10**6)])}}, sender)
+    return Step("set_fees", {"pool_id": pool_id, "fee": _fees(rng)}, admin if rng.random() < 0.9 else sender)
+
+def random_sequence(rng, storage, length):
+    """ generates steps against the model so later steps fit the state earlier ones created """
+    model = DexModel(storage)
+    steps = []
+    for _ in range(length):
+        step = random_step(rng, model.storage["storage"])
+        try:
+            model.execute(step.entrypoint, step.params, step.sender)
+        except ContractError:
+            pass
+        steps.append(step)
+    return steps
+
+
+def coverage(storage, steps):
+    """ behaviour features of `steps` on the model, used to pick sequences worth interpreting """
+    runner = ModelRunner(storage)
+    features = set()
+    for step in steps:
+        outcome = runner.run(step)
+        s = runner.model.storage["storage"]
+        features.add((step.entrypoint, outcome.error or "ok"))
+        if outcome.error is None and step.entrypoint in ("swap", "invest", "divest_imbalanced", "divest_one_coin"):
+            pool = s["pools"][step.params["pool_id"]]
+            features.add((step.entrypoint, "tokens", len(pool["tokens_info"])))
+            features.add((step.entrypoint, "staked", pool["staker_accumulator"]["total_staked"] > 0))
+            features.add((step.entrypoint, "fees", any(pool["fee"].values())))
+    return features
+
+def fuzz(storage, reference, candidate=None, iterations=100, length=20, seed=0, explore=0.1, shrink_attempts=2000):
+    """
+    Yields a shrunk Discrepancy for every generated sequence on which
+    `reference()` and `candidate()` backends disagree. `candidate` defaults
+    to the model. Sequences adding no new coverage are only sent to the
+    backends with probability `explore`.
+    """
+    rng = random.Random(seed)
+    candidate = candidate or (lambda: ModelRunner(storage))
+    seen = set()
+    for _ in range(iterations):
+        steps = random_sequence(rng, storage, length)
+        features = coverage(storage, steps)
+        if features <= seen and rng.random() >= explore:
+            continue
+        seen |= features
+
+        found = differential(steps, reference, candidate)
+        if found is not None:
+            yield shrink(found.steps, lambda steps: differential(steps, reference, candidate), shrink_attempts)
+
+
+if __name__ == "__main__":
+    import argparse
+    from pprint import pprint
+    from initial_storage import load_dex, load_storage
+
+    parser = argparse.ArgumentParser(description="fuzz the dex against the Python model")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--length", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dex = load_dex()
+    storage = load_storage()
+    storage["storage"]["admin"] = admin
+
+    for found in fuzz(storage, lambda: ChainRunner(dex, storage), iterations=args.iterations, length=args.length, seed=args.seed):
+        print(f"step {found.index} disagrees on {found.what}")
+        pprint(found.steps)
+        pprint({"reference": found.reference, "candidate": found.candidate})
@@ -1,81 +1,226 @@
-
-import json
-from pprint import pprint
-from constants import A_CONST
+# Standard charts of a run, built from sweep results and traces
+#
+# Computing the data and drawing it are kept apart: the chart functions turn
+# precomputed data (sweep.run_sweep results, simulate rows or a
+# tracefile.Trace) into `Chart` descriptions, and a RenderPool draws them in
+# background processes while the next chart is being computed.
+#
+#   python3 scenario/generate_graphs.py --out graphs
+
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from constants import A_CONST, fees
 
 from helpers import *
 
-from pytezos import ContractInterface, pytezos, MichelsonRuntimeError
-from initial_storage import admin_lambdas, dex_lambdas, token_lambdas
-
-import matplotlib.pyplot as plt
-import matplotlib.ticker
-
-token_a = {
-    "fa2": {
-        "token_address": "KT1RJ6PbjHpwc3M5rw5s2Nbmefwbuwbdxton",
-        "token_id": 0
-    }
-}
-
-token_b = {
-    "fa2": {
-        "token_address": "KT1Wz32jY2WEwWq8ZaA2C6cYFHGchFYVVczC",
-        "token_id": 1
-    }
-}
-
+from initial_storage import load_dex, load_storage
+from batch_quote import get_dy_batch
+from sweep import run_sweep
+from stable_math import Constants, ContractError, perform_swap
 
 token_a_alt = ("fa12", "KT1Wz32jY2WEwWq8ZaA2C6cYFHGchFYVVczC")
 token_b_alt = ("fa12", "KT1RJ6PbjHpwc3M5rw5s2Nbmefwbuwbdxton")
-token_c = ("fa12", "KT1C9X9s5rpVJGxwVuHEVBLYEdAQ1Qw8QDjH")
-
-class GraphDrawer:
-    def __init__(cls):
-        text = open("./build/dex.json").read()
-        code = json.loads(text)
-
-        cls.dex = ContractInterface.from_micheline(code["michelson"])
-
-        storage = cls.dex.storage.dummy()
-        storage["token_lambdas"] = token_lambdas
-        storage["dex_lambdas"] = dex_lambdas
-        storage["admin_lambdas"] = admin_lambdas
-        storage["storage"]["admin"] = admin
-        cls.init_storage = storage
-
-    def divest_to_invest_proportion(self):
-        x_axis = []
-        y_axis = []
-        for i in range(10):
-            chain = LocalChain(storage=self.init_storage)
-            res = chain.execute(self.dex.add_pool(A_CONST, [token_a_alt, token_b_alt], form_pool_rates(100_000_000, 50),{ "lp_f": 0, "stakers_f": 0, "ref_f": 0}), sender=admin)
-
-            coef = i / 10
-            invested_a = int(coef * 20_000_000) + 2_000_088
-
-            invest = self.dex.invest(pool_id=0, shares=1, in_amounts={0: invested_a, 1: 1}, time_expiration=1, receiver=None, referral=None)
-            res = chain.execute(invest)
-            transfers = parse_transfers(res)
-
-            all_shares = res.storage["storage"]["ledger"][(me,0)]
-            res = chain.execute(self.dex.divest(pool_id=0, min_amounts_out={0: 1, 1: 1}, shares=all_shares, time_expiration=1, receiver=None))
-            transfers = parse_transfers(res)
-            divested_a = transfers[1]["amount"]
-            divested_b = transfers[0]["amount"]
-            
-            x_axis.append(invested_a)
-            y_axis.append(divested_a + divested_b)
-
-        fig, ax = plt.subplots()
-        ax.set(xlabel="invested", ylabel="divested")
-        ax.plot(x_axis, y_axis)
-        ax.set_ylim(0, 22_000_000)
-        ax.set_xlim(0, 22_000_000)
-        ax.xaxis.set_major_formatter(matplotlib.ticker.FuncFormatter(format_number)) 
-        ax.yaxis.set_major_formatter(matplotlib.ticker.FuncFormatter(format_number)) 
-        ax.grid()
-        fig.savefig("test.png")
-
-graphs = GraphDrawer()
-graphs.divest_to_invest_proportion()
\ No newline at end of file
+
+# `series` is a list of (label, xs, ys)
+Chart = namedtuple("Chart", ["title", "xlabel", "ylabel", "series", "xlim", "ylim", "format_numbers", "log_x"])
+Chart.__new__.__defaults__ = (None, None, False, False)
+
+
+def _failed(results):
+    errors = [f"{result.params}: {result.error}" for result in results if result.error]
+    if errors:
+        raise RuntimeError("sweep points failed:\n" + "\n".join(errors))
+
+def invest_vs_divest(results):
+    """ `results` of a sweep of divest_to_invest_point over "invested_a" """
+    results = list(results)
+    _failed(results)
+    points = sorted((result.params["invested_a"], result.result) for result in results)
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    top = max(xs + ys) * 1.1
+    return Chart(
+        "divested for invested", "invested", "divested",
+        [("divested", xs, ys), ("break even", [0, top], [0, top])],
+        xlim=(0, top), ylim=(0, top), format_numbers=True,
+    )
+
+def price_impact(storage, pool_id=0, i=0, j=1, sizes=None, now=0):
+    """ percent lost to the curve and fees when selling `sizes` of token i for token j """
+    pool = storage["storage"]["pools"][pool_id]
+    reserves = pool["tokens_info"][i]["reserves"]
+    sizes = sizes or sorted({max(1, reserves * k // 1000) for k in range(1, 501, 10)})
+    dy, errors = get_dy_batch(storage, [pool_id] * len(sizes), [i] * len(sizes), [j] * len(sizes), sizes, now=now, return_errors=True)
+    rate_i = pool["tokens_info"][i]["rate_f"]
+    rate_j = pool["tokens_info"][j]["rate_f"]
+    xs, ys = [], []
+    for dx, out, error in zip(sizes, dy, errors):
+        if error is None:
+            xs.append(dx)
+            ys.append(100 * (1 - (out * rate_j) / (dx * rate_i)))
+    return Chart(f"price impact {i} -> {j}", "sold", "impact, %", [("impact", xs, ys)], format_numbers=True)
+
+def slippage_vs_a(results):
+    """ `results` of a sweep of slippage_point over "a_constant" and "amount" """
+    results = list(results)
+    _failed(results)
+    by_amount = {}
+    for result in results:
+        by_amount.setdefault(result.params["amount"], []).append((result.params["a_constant"], result.result))
+    series = []
+    for amount, points in sorted(by_amount.items()):
+        points.sort()
+        series.append((f"swap {format_number(amount, None)}", [a for a, _ in points], [s for _, s in points]))
+    return Chart("slippage vs A", "A", "slippage, %", series, log_x=True)
+
+def fee_accrual(rows, pool_id=0):
+    """ virtual price growth and staker fees over time from simulate rows or a tracefile.Trace """
+    rows = [row for row in rows if row["pool_id"] == pool_id and row["virtual_price"] is not None]
+    if not rows:
+        return Chart("fee accrual", "block", "growth, %", [])
+    blocks = [row["block"] for row in rows]
+    first = rows[0]["virtual_price"]
+    series = [("virtual price", blocks, [100 * (row["virtual_price"] - first) / first for row in rows])]
+    for i in range(Constants.max_tokens_count):
+        column = f"staker_fees_{i}"
+        if rows[0][column] is None:
+            continue
+        reserves = rows[0][f"reserves_{i}"] or 1
+        series.append((f"staker fees {i}", blocks, [100 * row[column] / reserves for row in rows]))
+    return Chart("fee accrual", "block", "growth, %", series)
+
+
+def render_chart(chart, path):
+    """ draws `chart` into `path`, runs in the render workers """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker
+
+    fig, ax = plt.subplots()
+    ax.set(title=chart.title, xlabel=chart.xlabel, ylabel=chart.ylabel)
+    for label, xs, ys in chart.series:
+        ax.plot(xs, ys, label=label)
+    if chart.xlim:
+        ax.set_xlim(*chart.xlim)
+    if chart.ylim:
+        ax.set_ylim(*chart.ylim)
+    if chart.log_x:
+        ax.set_xscale("log")
+    if chart.format_numbers:
+        ax.xaxis.set_major_formatter(matplotlib.ticker.FuncFormatter(format_number))
+        if chart.ylim:
+            ax.yaxis.set_major_formatter(matplotlib.ticker.FuncFormatter(format_number))
+    if len(chart.series) > 1:
+        ax.legend()
+    ax.grid()
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+class RenderPool:
+    """
+    Renders charts in background processes. `submit` returns at once so the
+    caller can compute the next chart meanwhile; `wait` (or leaving the with
+    block) collects the written paths and raises the first rendering error.
+    """
+    def __init__(self, out_dir, max_workers=None, renderer=render_chart):
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.renderer = renderer
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+        self.futures = []
+
+    def submit(self, chart, name):
+        path = os.path.join(self.out_dir, f"{name}.png")
+        self.futures.append(self.executor.submit(self.renderer, chart, path))
+        return path
+
+    def wait(self):
+        paths = [future.result() for future in self.futures]
+        self.futures = []
+        return paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        try:
+            if exc_type is None:
+                self.wait()
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+# sweep scenarios, module level so worker processes can run them
+
+def divest_to_invest_point(pool_storage, invested_a):
+    """ invests `invested_a` of token a into the pool and returns everything divested back """
+    dex = load_dex()
+    chain = LocalChain(storage=pool_storage)
+
+    invest = dex.invest(pool_id=0, shares=1, in_amounts={0: invested_a, 1: 1}, time_expiration=1, receiver=None, referral=None)
+    res = chain.execute(invest)
+
+    all_shares = res.storage["storage"]["ledger"][(me,0)]
+    res = chain.execute(dex.divest(pool_id=0, min_amounts_out={0: 1, 1: 1}, shares=all_shares, time_expiration=1, receiver=None))
+    transfers = parse_transfers(res)
+    return transfers[0]["amount"] + transfers[1]["amount"]
+
+def slippage_point(reserves, a_constant, amount):
+    """ percent below 1:1 received for swapping `amount` of token 0 in a fee-less pool, None if it fails """
+    pool = {
+        "initial_A_f": a_constant * Constants.a_precision,
+        "future_A_f": a_constant * Constants.a_precision,
+        "initial_A_time": 0,
+        "future_A_time": 0,
+        "tokens_info": equal_pool_rates(reserves),
+        "total_supply": sum(reserves),
+    }
+    try:
+        dy = perform_swap(0, 1, amount, pool, 0)
+    except ContractError:
+        return None
+    return 100 * (1 - dy / amount)
+
+
+def analysis_pack(out_dir, max_workers=None):
+    """ computes and renders the standard charts into `out_dir` """
+    from simulate import ModelBackend, OrderFlow, Scheduled, combine, simulate
+    from fuzz import Step
+
+    dex = load_dex()
+    storage = load_storage()
+    storage["storage"]["admin"] = admin
+
+    with RenderPool(out_dir, max_workers) as pool:
+        chain = LocalChain(storage=storage)
+        chain.execute(dex.add_pool(A_CONST, [token_a_alt, token_b_alt], form_pool_rates(100_000_000, 50), { "lp_f": 0, "stakers_f": 0, "ref_f": 0}), sender=admin)
+        invested = [int(i / 10 * 20_000_000) + 2_000_088 for i in range(10)]
+        pool.submit(invest_vs_divest(run_sweep(partial(divest_to_invest_point, chain.storage), {"invested_a": invested}, max_workers)), "invest_divest")
+
+        reserves = [10**9, 10**9]
+        grid = {"reserves": [reserves], "a_constant": [1, 10, 100, 1_000, 10_000, 100_000], "amount": [10**7, 10**8, 5 * 10**8]}
+        pool.submit(slippage_vs_a(run_sweep(slippage_point, grid, max_workers, preload=False)), "slippage_vs_a")
+
+        add_pool = Step("add_pool", dict(a_constant=A_CONST, input_tokens=[token_a_alt, token_b_alt], tokens_info=equal_pool_rates(reserves), fees=fees), admin)
+        backend = ModelBackend(storage)
+        rows = list(simulate(backend, combine(Scheduled({0: [add_pool]}), OrderFlow(0, 2.0)), 2880, every=10))
+        pool.submit(fee_accrual(rows), "fee_accrual")
+        pool.submit(price_impact(backend.storage, now=backend.now), "price_impact")
+        return pool.wait()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="render the standard charts")
+    parser.add_argument("--out", default="graphs")
+    parser.add_argument("--workers", type=int)
+    args = parser.parse_args()
+
+    for path in analysis_pack(args.out, args.workers):
+        print(path)
@@ -1,9 +1,15 @@
 import sys
+from collections import namedtuple
+from contextlib import nullcontext
 from os import urandom
-from pytezos import pytezos
+from pytezos import pytezos, MichelsonRuntimeError
 
 from pytezos.crypto.encoding import base58_encode
 
+from lambda_cache import lambda_cache as default_lambda_cache
+from native_storage import NativeCallResult, NativeStorage, interpret as interpret_native
+from ledger import TEZ, BalanceLedger
+
 BLOCK_TIME = 30
 
 alice = "tz1iA1iceA1iceA1iceA1iceA1ice9ydjsaW"
@@ -77,26 +83,114 @@ def calc_pool_rate(res, pair=-1):
     return tez_pool / token_pool
     
 
+class ParsedOp:
+    """
+    Base of the records `parse_ops` produces. Fields live in __slots__ but the
+    records also read like the dicts the tests have always used: op["amount"],
+    "token_id" in op, op.get(...), and they compare equal to such a dict.
+    """
+    __slots__ = ()
+    type = None
+
+    def keys(self):
+        return ["type"] + [name for name in self.__slots__ if getattr(self, name) is not None]
+
+    def as_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+    def __getitem__(self, key):
+        if key != "type" and key not in self.__slots__:
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        if isinstance(other, ParsedOp):
+            return self.as_dict() == other.as_dict()
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+class TezTransfer(ParsedOp):
+    __slots__ = ("destination", "amount", "source")
+    type = "tez"
+
+    def __init__(self, destination, amount, source):
+        self.destination = destination
+        self.amount = amount
+        self.source = source
+
+class TokenTransfer(ParsedOp):
+    # token_id is None for fa12 transfers
+    __slots__ = ("token_id", "destination", "amount", "source", "token_address")
+    type = "token"
+
+    def __init__(self, destination, amount, source, token_id=None, token_address=None):
+        self.token_id = token_id
+        self.destination = destination
+        self.amount = amount
+        self.source = source
+        self.token_address = token_address
+
+class CloseOp(ParsedOp):
+    __slots__ = ()
+    type = "close"
+
+class LazyOps:
+    """
+    Read-only list of parsed operations. Nothing is decoded until the list is
+    first indexed, iterated or measured, so unread results cost nothing.
+    """
+    __slots__ = ("_operations", "_parse", "_items")
+
+    def __init__(self, operations, parse):
+        self._operations = operations
+        self._parse = parse
+        self._items = None
+
+    def _decoded(self):
+        if self._items is None:
+            items = []
+            for op in self._operations:
+                items += self._parse(op)
+            self._items = items
+        return self._items
+
+    def __getitem__(self, index):
+        return self._decoded()[index]
+
+    def __len__(self):
+        return len(self._decoded())
+
+    def __iter__(self):
+        return iter(self._decoded())
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(self._decoded())
+
 def parse_tez_transfer(op):
-    dest = op["destination"]
-    amount = int(op["amount"])
-    source = op["source"]
-    return {
-        "type": "tez", 
-        "destination": dest,
-        "amount": amount,
-        "source": source
-    }
+    return TezTransfer(op["destination"], int(op["amount"]), op["source"])
 
 def parse_as_fa12(value):
     args = value["args"]
-
-    return {
-        "type": "token",
-        "amount": int(args[2]["int"]),
-        "destination": args[1]["string"],
-        "source": args[0]["string"]
-    }
+    return TokenTransfer(args[1]["string"], int(args[2]["int"]), args[0]["string"])
 
 def parse_as_fa2(values):
     result = []
@@ -105,46 +199,27 @@ def parse_as_fa2(values):
     transfers = value["args"][1]
     for transfer in transfers:
         args = transfer["args"]
-
-        amount = args[-1]["int"]
-        amount = int(amount)
-
-        token_id = args[1]["int"]
-        token_id = int(token_id)
-
-        dest = args[0]["string"]
-
-        result.append({
-            "type": "token",
-            "token_id": token_id,
-            "destination": dest,
-            "amount": amount,
-            "source": source
-        })
+        result.append(TokenTransfer(args[0]["string"], int(args[-1]["int"]), source, token_id=int(args[1]["int"])))
 
     return result
 
+def _transfer_ops(op):
+    if op["kind"] == "transaction" and op["parameters"]["entrypoint"] == "transfer":
+        return parse_transfer(op)
+    return ()
+
 def parse_transfers(res):
-    token_transfers = []
-    for op in res.operations:
-        if op["kind"] == "transaction":
-            entrypoint = op["parameters"]["entrypoint"]
-            if entrypoint == "transfer":
-                txs = parse_transfer(op)
-                token_transfers += txs
-    return token_transfers
+    return LazyOps(res.operations, _transfer_ops)
 
 def parse_transfer(op):
-    transfers = []
     value = op["parameters"]["value"]
     if not isinstance(value, list):
-        transfer = parse_as_fa12(value)
-        transfers.append(transfer)
+        transfers = [parse_as_fa12(value)]
     else:
-        transfers += parse_as_fa2(value)
+        transfers = parse_as_fa2(value)
 
     for transfer in transfers:
-        transfer["token_address"] = op["destination"]
+        transfer.token_address = op["destination"]
 
     return transfers
 
@@ -156,20 +231,48 @@ def parse_delegations(res):
     return delegates
 
 
+def _any_op(op):
+    if op["kind"] != "transaction":
+        return ()
+    entrypoint = op["parameters"]["entrypoint"]
+    if entrypoint == "default":
+        return (parse_tez_transfer(op),)
+    elif entrypoint == "transfer":
+        return parse_transfer(op)
+    elif entrypoint == "close":
+        return (CloseOp(),)
+    return ()
+
 def parse_ops(res):
-    result = []
-    for op in res.operations:
-        if op["kind"] == "transaction":
-            entrypoint = op["parameters"]["entrypoint"]
-            if entrypoint == "default":
-                tx = parse_tez_transfer(op)
-                result.append(tx)
-            elif entrypoint == "transfer":
-                txs = parse_transfer(op)
-                result += txs
-            elif entrypoint == "close":
-                result.append({"type" : "close"})
-    return result
+    return LazyOps(res.operations, _any_op)
+
+def scan_balance_changes(operations):
+    """
+    Fast path for balance bookkeeping: yields plain tuples
+    (type, token_address, token_id, source, destination, amount)
+    straight from the raw operations without building any records.
+    "close" entries carry None in every field but the type.
+    """
+    for op in operations:
+        if op["kind"] != "transaction":
+            continue
+        params = op["parameters"]
+        entrypoint = params["entrypoint"]
+        if entrypoint == "default":
+            yield "tez", None, None, op["source"], op["destination"], int(op["amount"])
+        elif entrypoint == "transfer":
+            address = op["destination"]
+            value = params["value"]
+            if not isinstance(value, list):
+                args = value["args"]
+                yield "token", address, None, args[0]["string"], args[1]["string"], int(args[2]["int"])
+                continue
+            source = value[0]["args"][0]["string"]
+            for transfer in value[0]["args"][1]:
+                args = transfer["args"]
+                yield "token", address, int(args[1]["int"]), source, args[0]["string"], int(args[-1]["int"])
+        elif entrypoint == "close":
+            yield "close", None, None, None, None, None
 
 # calculates shares balance
 def calc_total_balance(res, address):
@@ -244,65 +347,225 @@ def operator_add(owner, operator, token_id=0):
         }
     }
 
+# the reentrancy flag a "close" callback clears, as a path of field annotations
+_ENTERED = ("storage", "entered")
+_FALSE = {"prim": "False"}
+
+# a call of LocalChain.execute_many: its result, or the error it failed with
+Executed = namedtuple("Executed", ["res", "error"])
+
 class LocalChain():
-    def __init__(self, storage):
+    def __init__(self, storage, profiler=None, lambda_cache=default_lambda_cache, native=False):
+        # with `native` the storage stays in the interpreter's form between
+        # calls (see native_storage) and `storage` is a read-only view of it
+        self.native = native
+        self._native = None
         self.storage = storage
 
         self.balance = 0
         self.now = 0
+        self.ledger = BalanceLedger()
+        # tez and tokens credited to every destination, see `ledger` for the net balances
         self.payouts = {}
         self.contract_balances = {}
         self.last_res = None
+        # a chain_profile.ChainProfiler to account the calls to
+        self.profiler = profiler
+        # a lambda_cache.LambdaCache the calls unpack lambdas through, None to unpack every time
+        self.lambda_cache = lambda_cache
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            self._storage = self._native.python
+        return self._storage
+
+    @storage.setter
+    def storage(self, storage):
+        self._storage = storage
+        self._native = None
+
+    def _keep(self, res):
+        """ installs the storage `res` leaves, unconverted if it is native """
+        if isinstance(res, NativeCallResult):
+            self._storage = None
+            self._native = res.native
+        else:
+            self.storage = res.storage
+
+    def _move(self, kind, address, token_id, source, dest, amount):
+        """ books a transfer the contract emitted """
+        if kind == "tez":
+            self.ledger.transfer(TEZ, None, source, dest, amount)
+            self.payouts[dest] = self.payouts.get(dest, 0) + amount
+        elif kind == "token":
+            self.ledger.transfer(address, token_id, source, dest, amount)
+            contract_balance = self.contract_balances.setdefault(address, {})
+            contract_balance[dest] = contract_balance.get(dest, 0) + amount
+
+    def _interpret(self, call, amount, balance, sender):
+        with self.lambda_cache.installed() if self.lambda_cache is not None else nullcontext():
+            return self._run(call, amount, balance, sender)
+
+    def _run(self, call, amount, balance, sender):
+        if self.native:
+            if self._native is None:
+                self._native = NativeStorage.for_call(call, self._storage)
+            storage = self._native
+        else:
+            storage = self.storage
+        if self.profiler is not None:
+            return self.profiler.interpret(call, storage, amount, balance, self.now, sender)
+        if self.native:
+            return interpret_native(call, storage, amount, balance, self.now, sender)
+        return call.interpret(amount=amount, \
+            storage=storage, \
+            balance=balance, \
+            now=self.now, \
+            sender=sender
+        )
 
     def execute(self, call, amount=0, sender=None):
         new_balance = self.balance + amount
-        res = call.interpret(amount=amount, \
-            storage=self.storage, \
-            balance=new_balance, \
-            now=self.now, \
-            sender=sender    
-        )
+        res = self._interpret(call, amount, new_balance, sender)
+        phase = self.profiler.phase(call.parameters["entrypoint"], "bookkeeping") if self.profiler else nullcontext()
+        with phase:
+            self._book(res, amount, new_balance, sender)
+        return res
+
+    def _book(self, res, amount, new_balance, sender):
         self.balance = new_balance
-        self.storage = res.storage
+        if amount:
+            self.ledger.transfer(TEZ, None, sender or me, contract_self_address, amount)
+        self._keep(res)
         self.last_res = res
 
-        # calculate total xtz payouts from contract
-        ops = parse_ops(res)
-        for op in ops:
-            if op["type"] == "tez":
-                dest = op["destination"]
-                amount = op["amount"]
-                self.payouts[dest] = self.payouts.get(dest, 0) + amount
-
-                # reduce contract balance in case it has sent something
-                if op["source"] == contract_self_address:
-                    self.balance -= op["amount"]
-
-            elif op["type"] == "token":
-                dest = op["destination"]
-                amount = op["amount"]
-                address = op["token_address"]
-                if address not in self.contract_balances:
-                    self.contract_balances[address] = {}
-                contract_balance = self.contract_balances[address] 
-                if dest not in contract_balance:
-                    contract_balance[dest] = 0
-                contract_balance[dest] += amount 
-            # imitate closing of the function for convenience
-            elif op["type"] == "close":
-                self.storage["storage"]["entered"] = False   
-
-        return res
+        # move tez and tokens between holders as the emitted transfers say
+        for kind, address, token_id, source, dest, amount in scan_balance_changes(res.operations):
+            self._move(kind, address, token_id, source, dest, amount)
+
+            # reduce contract balance in case it has sent something
+            if kind == "tez" and source == contract_self_address:
+                self.balance -= amount
+
+            elif kind == "close":
+                self._close()
+
+    def _close(self):
+        """ imitates closing of the function for convenience """
+        if self._native is not None:
+            # set in the Micheline, the storage is decoded when read
+            self._native = self._native.replace(_ENTERED, _FALSE)
+            self._storage = None
+            return
+        # copy the touched levels, other snapshots may share this storage
+        inner = dict(self.storage["storage"], entered=False)
+        self.storage = dict(self.storage, storage=inner)
+
+    def execute_many(self, calls, stop_on_error=True):
+        """
+        Executes `(call, amount, sender)` tuples in order, as many `execute`s
+        would. The storage goes from call to call in native form, and the
+        ledger moves, which don't feed into the next call, wait for the end
+        of the batch. Returns an Executed per call run. The results' storages
+        are only decoded when read.
+
+        A call failing with MichelsonRuntimeError gets it as its error and
+        leaves the chain as it was. With `stop_on_error` the batch ends there,
+        otherwise it carries on with the next call.
+        """
+        executed = []
+        native = None
+        balance = self.balance
+        moves = []
+        with self.lambda_cache.installed() if self.lambda_cache is not None else nullcontext():
+            for call, amount, sender in calls:
+                if native is None:
+                    native = self._native if self._native is not None else NativeStorage.for_call(call, self._storage)
+                entrypoint = call.parameters["entrypoint"]
+                try:
+                    if self.profiler is not None:
+                        res = self.profiler.interpret(call, native, amount, balance + amount, self.now, sender)
+                    else:
+                        res = interpret_native(call, native, amount, balance + amount, self.now, sender)
+                except MichelsonRuntimeError as e:
+                    executed.append(Executed(None, e))
+                    if stop_on_error:
+                        break
+                    continue
+
+                phase = self.profiler.phase(entrypoint, "bookkeeping") if self.profiler else nullcontext()
+                with phase:
+                    balance += amount
+                    native = res.native
+                    # only what the next call sees: tez leaving the contract and closed callbacks
+                    for op in res.operations:
+                        if op["kind"] != "transaction":
+                            continue
+                        op_entrypoint = op["parameters"]["entrypoint"]
+                        if op_entrypoint == "default" and op["source"] == contract_self_address:
+                            balance -= int(op["amount"])
+                        elif op_entrypoint == "close":
+                            native = native.replace(_ENTERED, _FALSE)
+                    moves.append((res.operations, amount, sender))
+                executed.append(Executed(res, None))
+                last = res
+
+        if not moves:
+            return executed
+        self.balance = balance
+        self.last_res = last
+        for operations, amount, sender in moves:
+            if amount:
+                self.ledger.transfer(TEZ, None, sender or me, contract_self_address, amount)
+            for kind, address, token_id, source, dest, value in scan_balance_changes(operations):
+                self._move(kind, address, token_id, source, dest, value)
+
+        if self.native:
+            self._storage = None
+            self._native = native
+        else:
+            self.storage = native.decoded()
+        return executed
 
     # just interpret, don't store anything
     def interpret(self, call, amount=0, sender=None):
-        res = call.interpret(amount=amount, \
-            storage=self.storage, \
-            balance=self.balance, \
-            now=self.now, \
-            sender=sender
-        )
-        return res
+        return self._interpret(call, amount, self.balance, sender)
 
     def advance_blocks(self, count=1):
         self.now += count * BLOCK_TIME
+
+    # The storage is never mutated in place: every `execute` installs the
+    # fresh storage the interpreter returns. Snapshots and forks therefore
+    # share the storage object and all of its big maps, and only the
+    # bookkeeping is copied.
+    def snapshot(self):
+        """ state of the chain that `restore` can return to any number of times """
+        return {
+            "storage": self._native if self._native is not None else self._storage,
+            "balance": self.balance,
+            "now": self.now,
+            "ledger": self.ledger.copy(),
+            "payouts": dict(self.payouts),
+            "contract_balances": {address: dict(balances) for address, balances in self.contract_balances.items()},
+            "last_res": self.last_res,
+        }
+
+    def restore(self, snapshot):
+        if isinstance(snapshot["storage"], NativeStorage):
+            self._storage = None
+            self._native = snapshot["storage"]
+        else:
+            self.storage = snapshot["storage"]
+        self.balance = snapshot["balance"]
+        self.now = snapshot["now"]
+        self.ledger = snapshot["ledger"].copy()
+        self.payouts = dict(snapshot["payouts"])
+        self.contract_balances = {address: dict(balances) for address, balances in snapshot["contract_balances"].items()}
+        self.last_res = snapshot["last_res"]
+
+    def fork(self):
+        """ independent chain starting from the current state """
+        chain = LocalChain(storage=None, profiler=self.profiler, lambda_cache=self.lambda_cache, native=self.native)
+        chain.restore(self.snapshot())
+        return chain
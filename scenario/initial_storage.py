@@ -1,4 +1,21 @@
+import copy
+import hashlib
 import json
+import os
+import pickle
+from functools import lru_cache
+
+from pytezos import ContractInterface
+
+BUILD_DIR = "./build"
+CACHE_DIR = os.path.join(BUILD_DIR, ".cache")
+
+LAMBDA_FILES = {
+    "admin_lambdas": "Admin_lambdas.json",
+    "dex_lambdas": "Dex_lambdas.json",
+    "token_lambdas": "Token_lambdas.json",
+    "dev_lambdas": "Dev_lambdas.json",
+}
 
 def parse_lambdas(path):
     lambdas = {}
@@ -9,11 +26,83 @@ def parse_lambdas(path):
         lbytes = args[0]["bytes"]
         lambdas[i] = lbytes
 
-        assert int(args[1]["int"]) == i 
+        assert int(args[1]["int"]) == i
 
     return lambdas
 
-admin_lambdas = parse_lambdas("./build/lambdas/Admin_lambdas.json")
-dex_lambdas = parse_lambdas("./build/lambdas/Dex_lambdas.json")
-token_lambdas = parse_lambdas("./build/lambdas/Token_lambdas.json")
-dev_lambdas = parse_lambdas("./build/lambdas/Dev_lambdas.json")
\ No newline at end of file
+def build_hash():
+    """ hash of everything `yarn compile` put into build/ """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(BUILD_DIR):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != CACHE_DIR)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(path.encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+def _parse_build():
+    text = open(os.path.join(BUILD_DIR, "dex.json")).read()
+    code = json.loads(text)
+    lambdas = {
+        name: parse_lambdas(os.path.join(BUILD_DIR, "lambdas", file))
+        for name, file in LAMBDA_FILES.items()
+    }
+    return { "michelson": code["michelson"], "lambdas": lambdas }
+
+@lru_cache(maxsize=None)
+def load_build():
+    """
+    Parsed dex michelson and lambdas. Parsed once per process and pickled to
+    build/.cache keyed by the build hash, so other processes (e.g. pytest-xdist
+    workers) just unpickle it until the contracts are recompiled.
+    """
+    path = os.path.join(CACHE_DIR, f"{build_hash()}.pickle")
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    build = _parse_build()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        for stale in os.listdir(CACHE_DIR):
+            if stale.endswith(".pickle"):
+                os.remove(os.path.join(CACHE_DIR, stale))
+        # write aside and rename so concurrent workers never read a partial file
+        tmp_path = f"{path}.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(build, f)
+        os.replace(tmp_path, path)
+    except OSError:
+        pass
+    return build
+
+@lru_cache(maxsize=None)
+def load_dex():
+    """
+    Process-wide dex ContractInterface. It holds dynamically generated types
+    and can't be pickled, so it is built from the cached michelson once per process.
+    """
+    return ContractInterface.from_micheline(load_build()["michelson"])
+
+@lru_cache(maxsize=None)
+def _base_storage():
+    lambdas = load_build()["lambdas"]
+    storage = load_dex().storage.dummy()
+    storage["token_lambdas"] = lambdas["token_lambdas"]
+    storage["dex_lambdas"] = lambdas["dex_lambdas"]
+    storage["admin_lambdas"] = lambdas["admin_lambdas"]
+    return storage
+
+def load_storage():
+    """ a private copy of the dummy storage with the dex, token and admin lambdas set """
+    return copy.deepcopy(_base_storage())
+
+def __getattr__(name):
+    # admin_lambdas, dex_lambdas, ... are parsed on first use rather than on import
+    if name in LAMBDA_FILES:
+        return load_build()["lambdas"][name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,114 @@
+# Process-wide cache of unpacked lambdas
+#
+# The dex keeps its entrypoints as packed lambdas in big_maps and every call
+# UNPACKs one before EXECing it. pytezos unpacks by unforging the bytes and
+# building a fresh instruction class for every node of the code, which costs
+# more than running a short entrypoint. The code only depends on the bytes and
+# the lambda type, so while a cache is installed the unpacked code is kept by
+# the type and the sha256 of the packed bytes, and later UNPACKs of the same
+# bytes at the same type reuse it.
+#
+# The patch of LambdaType.unpack is shared by every cache: it is put in place
+# when the first `installed()` block is entered and taken out when the last
+# one is left, UNPACKs going through the innermost cache installed.
+#
+# LocalChain installs `lambda_cache` around every call it interprets:
+#
+#   chain = LocalChain(storage=storage)                     # cached
+#   chain = LocalChain(storage=storage, lambda_cache=None)  # plain pytezos
+#   ...
+#   print(lambda_cache.report())
+
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from pytezos.michelson.forge import unforge_micheline
+from pytezos.michelson.types.domain import LambdaType
+
+
+# caches of the installed() blocks entered, innermost last
+_installed = []
+# the LambdaType.unpack the patch replaced, None when it was inherited
+_original = None
+_lock = threading.Lock()
+
+def _unpack(ty, data):
+    return _installed[-1].unpack(ty, data)
+
+def _install(cache):
+    global _original
+    with _lock:
+        if not _installed:
+            _original = LambdaType.__dict__.get("unpack")
+            LambdaType.unpack = classmethod(_unpack)
+        _installed.append(cache)
+
+def _uninstall(cache):
+    with _lock:
+        # blocks may be left out of order by other threads
+        for position in range(len(_installed) - 1, -1, -1):
+            if _installed[position] is cache:
+                del _installed[position]
+                break
+        if not _installed:
+            if _original is None:
+                del LambdaType.unpack
+            else:
+                LambdaType.unpack = _original
+
+
+class LambdaCache:
+    """
+    Unpacked lambda code by the lambda type and the sha256 of its packed
+    bytes. `saved_seconds` estimates the time hits saved as what decoding
+    their entry took.
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.decode_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def unpack(self, ty, data):
+        """ `ty.unpack(data)` for a lambda type, decoding `data` only the first time """
+        # type classes are built anew by every UNPACK, their Micheline identifies them
+        key = (json.dumps(ty.as_micheline_expr(), sort_keys=True), hashlib.sha256(data).digest())
+        entry = self.entries.get(key)
+        if entry is not None:
+            code, seconds = entry
+            self.hits += 1
+            self.saved_seconds += seconds
+            return ty(code)
+
+        start = perf_counter()
+        assert data.startswith(b'\x05'), 'packed data should start with 05'
+        value = ty.from_micheline_value(unforge_micheline(data[1:]))
+        seconds = perf_counter() - start
+        self.entries[key] = (value.value, seconds)
+        self.misses += 1
+        self.decode_seconds += seconds
+        return value
+
+    @contextmanager
+    def installed(self):
+        """ UNPACKs of lambdas go through the cache in the enclosed code """
+        _install(self)
+        try:
+            yield self
+        finally:
+            _uninstall(self)
+
+    def report(self):
+        return (
+            f"{len(self.entries)} lambdas decoded in {self.decode_seconds:.3f}s, "
+            f"{self.hits} reused saving about {self.saved_seconds:.3f}s"
+        )
+
+lambda_cache = LambdaCache()
@@ -0,0 +1,100 @@
+# Token and tez balances of every holder LocalChain has seen
+#
+# Balances are keyed by (token_address, token_id, holder). FA1.2 tokens have
+# token_id None and tez lives under the TEZ address. Holders start at zero and
+# may go negative: nobody mints the users' tokens before they invest, so their
+# balance is the net flow in and out of the contract.
+
+import numpy as np
+
+TEZ = "tez"
+
+LEDGER_DTYPE = np.dtype([
+    ("token_address", object),
+    ("token_id", object),
+    ("holder", object),
+    ("balance", object),
+])
+
+class BalanceLedger:
+    def __init__(self):
+        self.balances = {}
+        # token -> sum over holders, kept in step with `balances`
+        self.totals = {}
+        # token -> amount minted minus burned, see `check_conservation`
+        self.supply = {}
+        # token -> holders with an entry, to avoid scans in `holders`
+        self.index = {}
+
+    def balance(self, token_address, token_id, holder):
+        return self.balances.get((token_address, token_id, holder), 0)
+
+    def total(self, token_address, token_id=None):
+        return self.totals.get((token_address, token_id), 0)
+
+    def holders(self, token_address, token_id=None):
+        """ {holder: balance} of a single token """
+        return {holder: self.balances[(token_address, token_id, holder)] for holder in self.index.get((token_address, token_id), ())}
+
+    def tokens(self):
+        return list(self.totals)
+
+    def net_tez(self, exclude=()):
+        """ {holder: tez received less tez sent} of the holders not in `exclude` """
+        return {holder: balance for holder, balance in self.holders(TEZ).items() if holder not in exclude}
+
+    def token_balances(self):
+        """ {(token_address, token_id): {holder: balance}} of every token but tez """
+        return {token: self.holders(*token) for token in self.totals if token[0] != TEZ}
+
+    def _add(self, token_address, token_id, holder, amount):
+        key = (token_address, token_id, holder)
+        token = (token_address, token_id)
+        if key not in self.balances:
+            self.index.setdefault(token, set()).add(holder)
+        self.balances[key] = self.balances.get(key, 0) + amount
+        self.totals[token] = self.totals.get(token, 0) + amount
+
+    def credit(self, token_address, token_id, holder, amount):
+        """ mints `amount` to `holder` """
+        self._add(token_address, token_id, holder, amount)
+        token = (token_address, token_id)
+        self.supply[token] = self.supply.get(token, 0) + amount
+
+    def debit(self, token_address, token_id, holder, amount):
+        """ burns `amount` from `holder` """
+        self.credit(token_address, token_id, holder, -amount)
+
+    def transfer(self, token_address, token_id, source, destination, amount):
+        self._add(token_address, token_id, source, -amount)
+        self._add(token_address, token_id, destination, amount)
+        self.supply.setdefault((token_address, token_id), 0)
+
+    def check_conservation(self):
+        """
+        Raises AssertionError unless, for every token, the balances add up to
+        the tracked total and transfers neither created nor destroyed anything.
+        """
+        sums = {}
+        for (token_address, token_id, _), balance in self.balances.items():
+            token = (token_address, token_id)
+            sums[token] = sums.get(token, 0) + balance
+        for token in self.totals.keys() | sums.keys() | self.supply.keys():
+            total = self.totals.get(token, 0)
+            assert sums.get(token, 0) == total, f"{token}: balances add up to {sums.get(token, 0)}, total is {total}"
+            assert total == self.supply.get(token, 0), f"{token}: total {total} differs from supply {self.supply.get(token, 0)}"
+
+    def to_numpy(self):
+        """ structured array with a row per balance, amounts stay python ints """
+        array = np.empty(len(self.balances), dtype=LEDGER_DTYPE)
+        for row, ((token_address, token_id, holder), balance) in enumerate(self.balances.items()):
+            array[row] = (token_address, token_id, holder, balance)
+        return array
+
+    def copy(self):
+        ledger = BalanceLedger()
+        ledger.balances = dict(self.balances)
+        ledger.totals = dict(self.totals)
+        ledger.supply = dict(self.supply)
+        ledger.index = {token: set(holders) for token, holders in self.index.items()}
+        return ledger
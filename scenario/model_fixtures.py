@@ -0,0 +1,56 @@
+# Storages and call parameters the DexModel tests build their scenarios from
+#
+# Shared by several test modules, kept out of the test_* files so importing
+# them doesn't pull test classes into another module's namespace.
+
+from constants import *
+
+from helpers import *
+
+from dex_model import DexModel
+from fuzz import Step
+from simulate import OrderFlow, Scheduled, combine
+
+no_fees = { "lp_f": 0, "stakers_f": 0, "ref_f": 0}
+
+def model_storage():
+    """ the parts of the dex storage the model reads, as load_storage() has them """
+    return {"storage": {
+        "admin": admin,
+        "default_referral": "KT18amZmM5W7qDWVt2pH6uj7sCEd3kbzLrHT",
+        "managers": set(),
+        "pools_count": 0,
+        "tokens": {},
+        "pool_to_id": {},
+        "pools": {},
+        "ledger": {},
+        "allowances": {},
+        "token_metadata": {},
+        "dev_rewards": {},
+        "referral_rewards": {},
+        "stakers_balance": {},
+        "quipu_token": {"token_address": quipu_token, "token_id": 0},
+        "dev_store": {"dev_address": dev, "dev_fee_f": 0, "dev_lambdas": {}},
+    }}
+
+def swap(i, j, amount):
+    return dict(pool_id=0, idx_from=i, idx_to=j, amount=amount, min_amount_out=1, deadline=0, receiver=None, referral=None)
+
+def priced_model(reserves, rates=None, a_constant=A_CONST, pool_fees=fees):
+    model = DexModel(model_storage())
+    tokens_info = equal_pool_rates(reserves)
+    for i, rate_f in (rates or {}).items():
+        tokens_info[i]["rate_f"] = rate_f
+    tokens = [token_a, token_b, token_c, token_d][:len(reserves)]
+    model.execute("add_pool", dict(a_constant=a_constant, input_tokens=tokens, tokens_info=tokens_info, fees=pool_fees), admin)
+    return model
+
+def add_pool_step(reserves, a_constant=A_CONST):
+    tokens = [token_a, token_b, token_c, token_d][:len(reserves)]
+    return Step("add_pool", dict(a_constant=a_constant, input_tokens=tokens, tokens_info=equal_pool_rates(reserves), fees=fees), admin)
+
+def schedule(reserves=(10**9, 10**9), trades_per_block=2.0, seed=1, extra={}):
+    actions = {0: [add_pool_step(list(reserves))]}
+    for block, steps in extra.items():
+        actions.setdefault(block, []).extend(steps)
+    return combine(Scheduled(actions), OrderFlow(0, trades_per_block, size=0.001, seed=seed))
@@ -0,0 +1,264 @@
+# Contract storage kept in the interpreter's own form between calls
+#
+# ContractCall.interpret turns the Python storage into Micheline for every
+# call and the Micheline it gets back into Python again, each time walking
+# every big_map, lambdas included. A NativeStorage is the Micheline the
+# interpreter takes, big_maps inlined as Elt lists. After a call, the big_map
+# ids of the returned storage are swapped for the contents the big_map diff
+# lists, following the storage type so only the path down to the big_maps is
+# walked. Nothing is converted to Python until the storage is read, and then
+# big_maps become LazyBigMaps decoding a value the first time its key is read.
+#
+#   chain = LocalChain(storage=storage, native=True)
+
+import json
+from collections.abc import Mapping
+from functools import lru_cache
+
+from pytezos.contract.result import ContractCallResult
+from pytezos.michelson.repl import Interpreter
+from pytezos.michelson.sections import StorageSection
+from pytezos.michelson.types import BigMapType, MichelsonType, OptionType, OrType, PairType
+
+# stand-in big_map ids while the rest of the storage is converted, far from
+# the ids the interpreter hands out and from any amount a storage holds
+_SENTINEL = -10**40
+
+
+def _key(expr):
+    return json.dumps(expr, sort_keys=True, separators=(",", ":"))
+
+@lru_cache(maxsize=None)
+def _has_big_map(ty):
+    return issubclass(ty, BigMapType) or any(
+        isinstance(arg, type) and issubclass(arg, MichelsonType) and _has_big_map(arg) for arg in ty.args
+    )
+
+def _map_big_maps(ty, expr, replace):
+    """ `expr` of type `ty` with every big_map in it replaced by `replace(big_map type, expr)` """
+    if not _has_big_map(ty):
+        return expr
+    if issubclass(ty, BigMapType):
+        return replace(ty, expr)
+    if issubclass(ty, PairType):
+        args = expr["args"] if isinstance(expr, dict) else expr
+        # right combs come flattened
+        if len(args) > 2:
+            args = [args[0], {"prim": "Pair", "args": args[1:]}]
+        return {"prim": "Pair", "args": [_map_big_maps(ty.args[0], args[0], replace), _map_big_maps(ty.args[1], args[1], replace)]}
+    if issubclass(ty, OptionType):
+        if expr["prim"] == "None":
+            return expr
+        return {"prim": "Some", "args": [_map_big_maps(ty.args[0], expr["args"][0], replace)]}
+    if issubclass(ty, OrType):
+        side = ty.args[0] if expr["prim"] == "Left" else ty.args[1]
+        return {"prim": expr["prim"], "args": [_map_big_maps(side, expr["args"][0], replace)]}
+    raise NotImplementedError(f"big_maps inside {ty.prim} are not supported")
+
+def _set_field(ty, expr, path, value):
+    """
+    `expr` of type `ty` with the field at `path`, field annotations outermost
+    first, set to the Micheline `value`, or None if there is no such field
+    """
+    if not path:
+        return value
+    if not issubclass(ty, PairType):
+        return None
+    args = expr["args"] if isinstance(expr, dict) else expr
+    if len(args) > 2:
+        args = [args[0], {"prim": "Pair", "args": args[1:]}]
+    for k, arg_ty in enumerate(ty.args):
+        if arg_ty.field_name == path[0]:
+            arg = _set_field(arg_ty, args[k], path[1:], value)
+        elif arg_ty.field_name is None:
+            # the unannotated pairs a record is combed into
+            arg = _set_field(arg_ty, args[k], path, value)
+        else:
+            continue
+        if arg is not None:
+            args = list(args)
+            args[k] = arg
+            return {"prim": "Pair", "args": args}
+    return None
+
+def _inline(contents):
+    """ replace() putting the contents of big_map ids back in place """
+    def replace(ty, expr):
+        return contents[int(expr["int"])] if isinstance(expr, dict) else expr
+    return replace
+
+def _attach(value, big_maps):
+    """ the Python `value` with the sentinel ids of `big_maps` swapped for them """
+    if isinstance(value, int) and value in big_maps:
+        return big_maps[value]
+    if isinstance(value, dict):
+        return {key: _attach(item, big_maps) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_attach(item, big_maps) for item in value)
+    if isinstance(value, list):
+        return [_attach(item, big_maps) for item in value]
+    return value
+
+def _detach(value, contents):
+    """ the Python `value` with its LazyBigMaps swapped for sentinel ids, their Elts put in `contents` """
+    if isinstance(value, LazyBigMap):
+        ptr = _SENTINEL - len(contents)
+        contents[ptr] = value.elts
+        return ptr
+    if isinstance(value, dict):
+        return {key: _detach(item, contents) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return tuple(_detach(item, contents) for item in value)
+    if isinstance(value, list):
+        return [_detach(item, contents) for item in value]
+    return value
+
+
+class LazyBigMap(Mapping):
+    """
+    Read-only big_map of a NativeStorage. Values are decoded the first time
+    they are read, keys when iterated over.
+    """
+    def __init__(self, ty, elts):
+        self.ty = ty
+        self.elts = elts
+        self._index = None
+        self._values = {}
+
+    def _position(self, key):
+        if self._index is None:
+            self._index = {_key(elt["args"][0]): position for position, elt in enumerate(self.elts)}
+        try:
+            expr = self.ty.args[0].from_python_object(key).to_micheline_value()
+        except Exception:
+            # not even of the key type
+            return None
+        return self._index.get(_key(expr))
+
+    def _decode_key(self, position):
+        return self.ty.args[0].from_micheline_value(self.elts[position]["args"][0]).to_python_object(comparable=True)
+
+    def _value(self, position):
+        if position not in self._values:
+            value = self.ty.args[1].from_micheline_value(self.elts[position]["args"][1])
+            self._values[position] = value.to_python_object(lazy_diff=True)
+        return self._values[position]
+
+    def __getitem__(self, key):
+        position = self._position(key)
+        if position is None:
+            raise KeyError(key)
+        return self._value(position)
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+    def __iter__(self):
+        for position in range(len(self.elts)):
+            yield self._decode_key(position)
+
+    def __len__(self):
+        return len(self.elts)
+
+    def items(self):
+        return [(self._decode_key(position), self._value(position)) for position in range(len(self.elts))]
+
+    def values(self):
+        return [self._value(position) for position in range(len(self.elts))]
+
+    def __repr__(self):
+        return f"<LazyBigMap of {len(self.elts)} keys>"
+
+
+class NativeStorage:
+    """ a contract storage as the Micheline the interpreter takes, big_maps inlined """
+    def __init__(self, ty, expr):
+        # the StorageSection type of the contract
+        self.ty = ty
+        self.expr = expr
+        self._python = None
+
+    @classmethod
+    def from_python(cls, ty, storage):
+        """ `storage` as ContractCall.interpret would encode it, LazyBigMaps taken over as they are """
+        contents = {}
+        value = ty.from_python_object(_detach(storage, contents))
+        # big_maps given by id are left as ids, the rest are inlined
+        expr = value.to_micheline_value(lazy_diff=None)
+        return cls(ty, _map_big_maps(ty.args[0], expr, _inline(contents)))
+
+    @classmethod
+    def for_call(cls, call, storage):
+        return cls.from_python(StorageSection.match(call.context.storage_expr), storage)
+
+    def after_run(self, expr, lazy_diff):
+        """ the storage a run returning `expr` and `lazy_diff` leaves """
+        contents = {}
+        for item in lazy_diff:
+            if item["kind"] == "big_map":
+                # big_maps never come from the network here, so the diff lists all of their keys
+                contents[int(item["id"])] = [
+                    {"prim": "Elt", "args": [update["key"], update["value"]]}
+                    for update in item["diff"].get("updates", []) if "value" in update
+                ]
+        return NativeStorage(self.ty, _map_big_maps(self.ty.args[0], expr, _inline(contents)))
+
+    def replace(self, path, value):
+        """ the storage with the field at `path` (field annotations) set to the Micheline `value` """
+        expr = _set_field(self.ty.args[0], self.expr, path, value)
+        if expr is None:
+            raise KeyError(path)
+        return NativeStorage(self.ty, expr)
+
+    def decoded(self):
+        """ the storage fully converted, big_maps as dicts, as ContractCall.interpret returns it """
+        return self.ty.from_micheline_value(self.expr).to_python_object(lazy_diff=True)
+
+    @property
+    def python(self):
+        """ the storage as ContractCallResult has it, with LazyBigMaps for big_maps, converted once """
+        if self._python is None:
+            big_maps = {}
+
+            def replace(ty, expr):
+                ptr = _SENTINEL - len(big_maps)
+                big_maps[ptr] = LazyBigMap(ty, expr)
+                return {"int": str(ptr)}
+
+            expr = _map_big_maps(self.ty.args[0], self.expr, replace)
+            self._python = _attach(self.ty.from_micheline_value(expr).to_python_object(), big_maps)
+        return self._python
+
+class NativeCallResult(ContractCallResult):
+    """
+    ContractCallResult of a call on a NativeStorage, `native` the storage it
+    leaves and `storage` its Python view. `parameters` are left as Micheline.
+    """
+    def __init__(self, native, **props):
+        super().__init__(**props)
+        self.native = native
+
+    @property
+    def storage(self):
+        return self.native.python
+
+def interpret(call, storage, amount, balance, now, sender):
+    """ ContractCall.interpret on a NativeStorage """
+    operations, expr, lazy_diff, stdout, error = Interpreter.run_code(
+        parameter=call.parameters["value"],
+        entrypoint=call.parameters["entrypoint"],
+        storage=storage.expr,
+        script=call.context.script["code"],
+        sender=sender,
+        amount=amount or call.amount,
+        balance=balance,
+        now=now,
+    )
+    if error:
+        raise error
+    return NativeCallResult(
+        storage.after_run(expr, lazy_diff),
+        parameters=call.parameters,
+        lazy_diff=lazy_diff,
+        operations=operations,
+    )
@@ -0,0 +1,101 @@
+# Prices of the pools read off the invariant
+#
+# The marginal price of token i in token j is the slope of the invariant at
+# the current reserves. With D held fixed, differentiating
+#
+#   Ann * sum(x) + D = Ann * D + D**(n+1) / (n**n * prod(x))
+#
+# gives dF/dx_k = Ann + K / x_k where K = D**(n+1) / (n**n * prod(x)), so
+#
+#   -dx_j / dx_i = (Ann * x_i + K) * x_j / ((Ann * x_j + K) * x_i)
+#
+# on the xp scale. `rate_f` turns that into token units, exactly the way
+# perform_swap scales amounts in and out; precision_multiplier_f only enters
+# one coin withdrawals and plays no part here. Everything stays integer up
+# to a single Fraction, so the price is exact for the pool as it is, with A
+# taken from the ramp at `now`.
+
+from collections import namedtuple
+from fractions import Fraction
+
+import numpy as np
+
+from batch_quote import get_dy_batch
+from stable_math import Constants, ContractError, Errors, d_cache, get_dev_fee, get_pool_A, require, sum_all_fee, xp
+from views import _pool
+
+# `dy` are the exact get_dy quotes (None where the view fails), `price` the
+# average price dy / dx and `impact` how far below the marginal price it is
+ImpactCurve = namedtuple("ImpactCurve", ["sizes", "dy", "marginal", "price", "impact", "errors"])
+
+
+def _after_fees(storage, pool):
+    fee_f = sum_all_fee(pool["fee"], get_dev_fee(storage["storage"]))
+    return Fraction(Constants.fee_denominator - fee_f, Constants.fee_denominator)
+
+def pool_marginal_prices(pool, now=0):
+    """ {(i, j): price of token i in token j before fees} for every pair of the pool """
+    tokens_info = pool["tokens_info"]
+    xp_ = xp(pool)
+    require(all(xp_.values()), Errors.div_by_zero)
+    amp_f = get_pool_A(pool, now)
+    n = len(tokens_info)
+    d = d_cache.get_D(tokens_info, amp_f, xp_)
+
+    # scaled by a_precision * n**n * prod(x): Ann * x_k + K
+    prod = 1
+    for value in xp_.values():
+        prod *= value
+    ann_prod = amp_f * n * n ** n * prod
+    k = Constants.a_precision * d ** (n + 1)
+    slopes = {key: ann_prod * value + k for key, value in xp_.items()}
+
+    prices = {}
+    for i in xp_:
+        for j in xp_:
+            if i != j:
+                prices[i, j] = Fraction(
+                    slopes[i] * xp_[j] * tokens_info[i]["rate_f"],
+                    slopes[j] * xp_[i] * tokens_info[j]["rate_f"],
+                )
+    return prices
+
+def marginal_price(storage, pool_id, i, j, now=0, fees=True):
+    """
+    Exact dy/dx of an infinitesimal swap of token i for token j at the
+    current reserves, after the swap fees unless `fees` is False.
+    """
+    pool = _pool(storage, pool_id)
+    tokens_info = pool["tokens_info"]
+    require(i in tokens_info and j in tokens_info, Errors.Dex.wrong_index)
+    require(i != j, Errors.assertion)
+    price = pool_marginal_prices(pool, now)[i, j]
+    return price * _after_fees(storage, pool) if fees else price
+
+def marginal_prices(storage, now=0, fees=True):
+    """
+    {pool_id: {(i, j): price}} for every pair of every pool, as floats.
+    Pools that cannot be priced (empty or failing) are left out.
+    """
+    prices = {}
+    for pool_id, pool in sorted(storage["storage"]["pools"].items()):
+        try:
+            pool_prices = pool_marginal_prices(pool, now)
+        except ContractError:
+            continue
+        scale = _after_fees(storage, pool) if fees else 1
+        prices[pool_id] = {pair: float(price * scale) for pair, price in pool_prices.items()}
+    return prices
+
+def impact_curve(storage, pool_id, i, j, sizes, now=0):
+    """
+    The price impact of selling each of `sizes` of token i for token j,
+    quoted in one get_dy_batch call. Sizes that fail get nan prices.
+    """
+    marginal = marginal_price(storage, pool_id, i, j, now)
+    sizes = [int(size) for size in sizes]
+    count = len(sizes)
+    dy, errors = get_dy_batch(storage, [pool_id] * count, [i] * count, [j] * count, sizes, now=now, return_errors=True)
+    price = np.array([out / size if out is not None and size else np.nan for out, size in zip(dy, sizes)], dtype=float)
+    impact = 1 - price / float(marginal)
+    return ImpactCurve(np.array(sizes, dtype=object), dy, marginal, price, impact, errors)
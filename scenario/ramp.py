@@ -0,0 +1,114 @@
+# Precomputed amplification coefficient over a range of blocks
+#
+# get_A interpolates between initial_A_f and future_A_f on every call. For
+# simulations stepping LocalChain block by block the ramp of a pool is fixed
+# until the next ramp_A / stop_ramp_A, so A can be tabulated once for the
+# whole range and looked up per block. The table matches stable_math.get_A
+# exactly, including the timestamp error for times before the ramp started.
+
+import numpy as np
+
+from helpers import BLOCK_TIME
+from batch_quote import MAX_TOKENS, batch_get_D
+from stable_math import ContractError, Errors, d_cache, get_A, xp_mem
+
+
+class RampSchedule:
+    """
+    A of a single ramp for the blocks at `start + k * block_time`,
+    k in range(blocks). `amps` holds amp_f per block and -1 where get_A fails.
+    """
+    def __init__(self, initial_A_time, initial_A_f, future_A_time, future_A_f, start, blocks, block_time=BLOCK_TIME):
+        self.initial_A_time = initial_A_time
+        self.initial_A_f = initial_A_f
+        self.future_A_time = future_A_time
+        self.future_A_f = future_A_f
+        self.start = start
+        self.block_time = block_time
+        self.times = start + np.arange(blocks, dtype=object) * block_time
+        self.amps = self._tabulate(self.times)
+
+    @classmethod
+    def from_pool(cls, pool, start, blocks, block_time=BLOCK_TIME):
+        """ schedule of the ramp currently stored in `pool` """
+        return cls(
+            pool["initial_A_time"],
+            pool["initial_A_f"],
+            pool["future_A_time"],
+            pool["future_A_f"],
+            start,
+            blocks,
+            block_time,
+        )
+
+    def _tabulate(self, times):
+        t0, a0, t1, a1 = self.initial_A_time, self.initial_A_f, self.future_A_time, self.future_A_f
+        amps = np.full(len(times), a1, dtype=object)
+        ramping = times < t1
+        if not ramping.any():
+            return amps
+        # get_A fails on negative time differences
+        if t1 < t0:
+            amps[ramping] = -1
+            return amps
+        early = ramping & (times < t0)
+        amps[early] = -1
+        ramping &= ~early
+        # with t1 == t0 nothing is left ramping, every later time has a1
+        if t1 > t0 and ramping.any():
+            value = abs(a1 - a0) * (times[ramping] - t0) // (t1 - t0)
+            amps[ramping] = a0 + value if a1 > a0 else abs(a0 - value)
+        return amps
+
+    def __len__(self):
+        return len(self.amps)
+
+    def at_block(self, k):
+        """ amp_f at block `k` of the range """
+        amp_f = self.amps[k]
+        if amp_f < 0:
+            raise ContractError(Errors.Dex.timestamp_error)
+        return amp_f
+
+    def at(self, now):
+        """ amp_f at time `now`, a table lookup when `now` falls on a block of the range """
+        k, offset = divmod(now - self.start, self.block_time)
+        if offset == 0 and 0 <= k < len(self.amps):
+            return self.at_block(k)
+        return get_A(self.initial_A_time, self.initial_A_f, self.future_A_time, self.future_A_f, now)
+
+    def d_series(self, tokens_info, cache=True):
+        """
+        D of the (fixed) `tokens_info` at every block. Each distinct A is
+        solved once, all of them in a single lockstep batch, and stored in
+        `stable_math.d_cache` unless `cache` is off. Blocks where get_A fails
+        hold None.
+        """
+        valid = self.amps >= 0
+        distinct = sorted(set(self.amps[valid]))
+        d_by_amp = {}
+        missing = []
+        for amp_f in distinct:
+            cached = d_cache.lookup(tokens_info, amp_f) if cache else None
+            if cached is None:
+                missing.append(amp_f)
+            else:
+                d_by_amp[amp_f] = cached
+
+        if missing:
+            xps = np.zeros((len(missing), MAX_TOKENS), dtype=object)
+            for idx, value in xp_mem(tokens_info).items():
+                xps[:, idx] = value
+            tokens_count = np.full(len(missing), len(tokens_info), dtype=object)
+            solved, errors = batch_get_D(xps, tokens_count, np.array(missing, dtype=object))
+            for amp_f, d, error in zip(missing, solved, errors):
+                if error is not None:
+                    raise ContractError(error)
+                d_by_amp[amp_f] = d
+                if cache:
+                    d_cache.store(tokens_info, amp_f, d)
+
+        series = np.empty(len(self.amps), dtype=object)
+        for k, amp_f in enumerate(self.amps):
+            series[k] = d_by_amp[amp_f] if amp_f >= 0 else None
+        return series
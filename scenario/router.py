@@ -0,0 +1,309 @@
+# Split routing of a swap across every pool of the dex
+#
+# Several pools may list the same tokens (say token_a in pools 0 and 1), so
+# selling a token can go through one pool, be split over a few of them or hop
+# through an intermediate token. `route` finds the output maximising split:
+#
+# * candidate paths are enumerated from the `tokens` map of the storage, up to
+#   `max_hops` swaps and never visiting a pool twice;
+# * every path is modelled in floating point straight from the invariant: the
+#   output of a hop solves the same quadratic as calc_y and its marginal rate
+#   is the ratio of the partial derivatives of the invariant, so no Newton
+#   iterations and no probe swaps are needed;
+# * the split equalises the marginal rates of the paths in use: the common
+#   rate is bisected until the amounts each path takes at that rate add up to
+#   the amount sold;
+# * the rounded split is quoted again with the exact integer math of the
+#   contract, and the `swap` parameters of every hop are filled in from it.
+
+from collections import namedtuple
+from math import sqrt
+
+from stable_math import (
+    Constants, ContractError, Errors,
+    d_cache, get_dev_fee, get_pool_A, perform_swap, slice_fee, sum_all_fee, token_key, xp,
+)
+
+# a swap of token `i` for token `j` in pool `pool_id`
+Hop = namedtuple("Hop", ["pool_id", "i", "j"])
+
+# `swaps` are the parameters of the `swap` calls making up one leg, to be
+# sent in order, each selling what the previous one bought
+Leg = namedtuple("Leg", ["path", "amount_in", "amount_out", "swaps"])
+
+Route = namedtuple("Route", ["amount_in", "amount_out", "legs"])
+
+
+def token_pools(storage):
+    """ {token_key: [(pool_id, index), ...]} over the listed pools """
+    pools = {}
+    for pool_id, tokens in sorted(storage["storage"]["tokens"].items()):
+        for index, token in sorted(tokens.items()):
+            pools.setdefault(token_key(token), []).append((pool_id, index))
+    return pools
+
+def find_paths(storage, token_in, token_out, max_hops=2):
+    """ every path of at most `max_hops` hops from `token_in` to `token_out` """
+    token_in = token_key(token_in)
+    token_out = token_key(token_out)
+    tokens = storage["storage"]["tokens"]
+    by_token = token_pools(storage)
+    paths = []
+
+    def extend(token, path, seen_tokens):
+        if len(path) == max_hops:
+            return
+        for pool_id, i in by_token.get(token, []):
+            if any(hop.pool_id == pool_id for hop in path):
+                continue
+            for j, other in sorted(tokens[pool_id].items()):
+                other = token_key(other)
+                if j == i or other in seen_tokens:
+                    continue
+                hop_path = path + (Hop(pool_id, i, j),)
+                if other == token_out:
+                    paths.append(hop_path)
+                else:
+                    extend(other, hop_path, seen_tokens | {other})
+
+    if token_in != token_out:
+        extend(token_in, (), {token_in})
+    return paths
+
+
+class _Curve:
+    """ a pool frozen at `now` in floating point, amounts in token units """
+    def __init__(self, pool, now, dev_fee_f):
+        tokens_info = pool["tokens_info"]
+        amp_f = get_pool_A(pool, now)
+        xp_ = xp(pool)
+        self.keys = sorted(tokens_info)
+        self.rates = {key: tokens_info[key]["rate_f"] / Constants.precision for key in self.keys}
+        self.xp = {key: float(value) for key, value in xp_.items()}
+        self.n = len(self.keys)
+        self.ann = amp_f * self.n / Constants.a_precision
+        self.d = float(d_cache.get_D(tokens_info, amp_f, xp_)) if all(xp_.values()) else 0.0
+        self.after_fee = 1 - sum_all_fee(pool["fee"], dev_fee_f) / Constants.fee_denominator
+
+    def _y(self, i, j, x):
+        """ xp[j] once xp[i] is x, the root of y**2 + (b - D) * y = c """
+        d = self.d
+        n = self.n
+        s_ = x
+        c = d * d / (self.ann * n)
+        for key in self.keys:
+            if key == j:
+                continue
+            value = x if key == i else self.xp[key]
+            if key != i:
+                s_ += value
+            c *= d / (value * n)
+        b = s_ + d / self.ann - d
+        # numerically stable root of the quadratic
+        if b > 0:
+            return 2 * c / (b + sqrt(b * b + 4 * c))
+        return (sqrt(b * b + 4 * c) - b) / 2
+
+    def _slope(self, i, j, x_i, x_j):
+        """ -dxp[j] / dxp[i] at a point of the curve """
+        # the invariant differentiates into Ann + K / x_k, K = D**(n+1) / (n**n * prod(xp))
+        k = self.d
+        for key in self.keys:
+            value = x_i if key == i else x_j if key == j else self.xp[key]
+            k *= self.d / (value * self.n)
+        return (self.ann + k / x_i) / (self.ann + k / x_j)
+
+    def sell(self, i, j, dx):
+        """ (bought, marginal rate) after selling `dx` of token i for token j """
+        if self.d == 0:
+            return 0.0, 0.0
+        x = self.xp[i] + dx * self.rates[i]
+        y = self._y(i, j, x)
+        dy = max(self.xp[j] - y, 0.0) / self.rates[j] * self.after_fee
+        rate = self._slope(i, j, x, y) * self.rates[i] / self.rates[j] * self.after_fee
+        return dy, rate
+
+class _Path:
+    def __init__(self, hops, curves):
+        self.hops = hops
+        self.curves = [curves[hop.pool_id] for hop in hops]
+
+    def sell(self, dx):
+        """ (bought, marginal rate) of the whole path after selling `dx` """
+        amount = dx
+        rate = 1.0
+        for hop, curve in zip(self.hops, self.curves):
+            amount, hop_rate = curve.sell(hop.i, hop.j, amount)
+            rate *= hop_rate
+        return amount, rate
+
+    def amount_at(self, rate, guess, cap):
+        """
+        How much to sell until the marginal rate falls to `rate`, and how fast
+        that amount moves with `rate` (dx / drate, 0 once nothing is sold)
+        """
+        if self.sell(0)[1] <= rate:
+            return 0.0, 0.0
+        lo, hi = 0.0, cap
+        x = min(max(guess, 0.0), cap)
+        # Newton on the marginal rate, falling back to bisection of the bracket
+        for _ in range(64):
+            current = self.sell(x)[1]
+            if current > rate:
+                lo = x
+            else:
+                hi = x
+            h = max(1.0, x * 1e-6)
+            derivative = (self.sell(x + h)[1] - current) / h
+            step = x + (rate - current) / derivative if derivative < 0 else -1
+            if not lo < step < hi:
+                step = (lo + hi) / 2
+            if abs(step - x) <= max(0.5, x * 1e-10):
+                x = step
+                break
+            x = step
+        return x, 1 / derivative if derivative < 0 else 0.0
+
+
+def _split(paths, amount, tolerance=1e-9):
+    """ float amounts to sell along each path, all ending at the same marginal rate """
+    if len(paths) == 1:
+        return [float(amount)]
+    cap = float(amount)
+    # nothing finer than a unit matters, the amounts get rounded
+    tolerance = max(0.5, amount * tolerance)
+
+    # the common rate lies between the best rate once everything went down one
+    # path, where the paths take at least `amount`, and the best starting rate,
+    # where they take nothing. Newton steps on the rate, using how fast every
+    # path takes more as the rate drops, are kept inside that bracket and
+    # replaced by bisection when they would leave it. The first guess is the
+    # rate of an even split
+    lo, hi = max(path.sell(amount)[1] for path in paths), max(path.sell(0)[1] for path in paths)
+    amounts = [cap / len(paths)] * len(paths)
+    rate = min(max(max(path.sell(x)[1] for path, x in zip(paths, amounts)), lo), hi)
+    for _ in range(100):
+        solved = [path.amount_at(rate, guess, cap) for path, guess in zip(paths, amounts)]
+        amounts = [x for x, _ in solved]
+        excess = sum(amounts) - amount
+        if abs(excess) <= tolerance:
+            break
+        if excess > 0:
+            lo = rate
+        else:
+            hi = rate
+        if hi - lo <= hi * 1e-15:
+            break
+        slope = sum(dx for _, dx in solved)
+        step = rate - excess / slope if slope < 0 else lo
+        rate = step if lo < step < hi else (lo + hi) / 2
+    total = sum(amounts) or 1.0
+    return [value * amount / total for value in amounts]
+
+
+def _round(shares, amount):
+    """ integer amounts adding up to `amount`, largest remainders first """
+    floors = [int(share) for share in shares]
+    rest = amount - sum(floors)
+    order = sorted(range(len(shares)), key=lambda k: shares[k] - floors[k], reverse=True)
+    for k in order[:max(rest, 0)]:
+        floors[k] += 1
+    return floors
+
+def quote_path(storage, path, amount, now=0):
+    """
+    Exact amounts bought by each hop selling `amount` along `path`, as the
+    chain of swap calls would get them, or raises ContractError. Paths never
+    go through a pool twice so every hop sees the pool as it is in `storage`.
+    """
+    s = storage["storage"]
+    dev_fee_f = get_dev_fee(s)
+    outs = []
+    for hop in path:
+        pool = s["pools"][hop.pool_id]
+        dy = perform_swap(hop.i, hop.j, amount, pool, now)
+        amount = slice_fee(dy, pool["fee"], dev_fee_f, pool["staker_accumulator"]["total_staked"])["dy"]
+        outs.append(amount)
+    return outs
+
+def _swaps(path, amount_in, outs, slippage_f, deadline, receiver, referral):
+    swaps = []
+    for k, (hop, out) in enumerate(zip(path, outs)):
+        min_out = max(1, out * (Constants.fee_denominator - slippage_f) // Constants.fee_denominator)
+        # the sender sells what the previous hops bought, only the last one pays the receiver
+        swaps.append({
+            "pool_id": hop.pool_id, "idx_from": hop.i, "idx_to": hop.j, "amount": amount_in,
+            "min_amount_out": min_out, "deadline": deadline,
+            "receiver": receiver if k == len(path) - 1 else None, "referral": referral,
+        })
+        amount_in = out
+    return swaps
+
+def _legs(storage, paths, amounts, now, slippage_f, deadline, receiver, referral):
+    legs = []
+    for path, amount in zip(paths, amounts):
+        if amount == 0:
+            continue
+        outs = quote_path(storage, path, amount, now)
+        if outs[-1] == 0:
+            return None
+        legs.append(Leg(path, amount, outs[-1], _swaps(path, amount, outs, slippage_f, deadline, receiver, referral)))
+    return legs
+
+def route(storage, token_in, token_out, amount, now=0, max_hops=2, max_legs=4,
+          slippage_f=0, deadline=0, receiver=None, referral=None):
+    """
+    Best way to sell `amount` of `token_in` for `token_out` over the listed
+    pools. Returns a Route whose legs go through distinct pools; `min_amount_out`
+    of every swap is its exact quote less `slippage_f` (in fee_denominator
+    units). Raises ContractError if no path goes through.
+    """
+    if amount <= 0:
+        raise ContractError(Errors.Dex.zero_in)
+    s = storage["storage"]
+    dev_fee_f = get_dev_fee(s)
+    curves = {}
+    candidates = []
+    for hops in find_paths(storage, token_in, token_out, max_hops):
+        for hop in hops:
+            if hop.pool_id not in curves:
+                curves[hop.pool_id] = _Curve(s["pools"][hop.pool_id], now, dev_fee_f)
+        path = _Path(hops, curves)
+        if path.sell(0)[1] > 0:
+            candidates.append(path)
+    if not candidates:
+        raise ContractError(Errors.Dex.pool_not_listed)
+
+    # the best paths going through distinct pools, so that they don't move each other's prices
+    candidates.sort(key=lambda path: path.sell(0)[1], reverse=True)
+    paths = []
+    used = set()
+    for path in candidates:
+        pool_ids = {hop.pool_id for hop in path.hops}
+        if used.isdisjoint(pool_ids):
+            paths.append(path)
+            used |= pool_ids
+        if len(paths) == max_legs:
+            break
+
+    # the float model may misjudge dust sized splits, the single best path is the fallback
+    best_single = max(candidates, key=lambda path: path.sell(amount)[0])
+    options = [
+        ([path.hops for path in paths], _round(_split(paths, amount), amount)),
+        ([best_single.hops], [amount]),
+    ]
+
+    best = None
+    for hops, amounts in options:
+        try:
+            legs = _legs(storage, hops, amounts, now, slippage_f, deadline, receiver, referral)
+        except ContractError:
+            continue
+        if legs is None:
+            continue
+        out = sum(leg.amount_out for leg in legs)
+        if best is None or out > best.amount_out:
+            best = Route(amount, out, legs)
+    if best is None:
+        raise ContractError(Errors.Dex.low_reserves)
+    return best
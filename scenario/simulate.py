@@ -0,0 +1,271 @@
+# Block-stepped simulation of the dex with streaming metrics
+#
+# A schedule decides, block after block, which calls to make (trades from a
+# synthetic order flow, invests, stakes, ramps...). They run on one of two
+# backends: ChainBackend interprets the compiled contract with LocalChain,
+# ModelBackend runs dex_model.DexModel and is orders of magnitude faster.
+# After every block the state of each pool is summed up into a metrics row,
+# which `simulate` yields right away so nothing piles up in memory; the rows
+# can go straight to `write_csv` or `write_parquet`.
+#
+#   python3 scenario/simulate.py --blocks 2880 --reserves 1000000000 1000000000 --csv metrics.csv
+
+import csv
+
+import numpy as np
+
+from constants import *
+from helpers import BLOCK_TIME
+from fuzz import ACTORS, FAR_DEADLINE, ChainRunner, ModelRunner, Step
+from stable_math import Constants, ContractError, d_cache, get_pool_A, xp
+
+MAX_TOKENS = Constants.max_tokens_count
+
+METRIC_COLUMNS = (
+    "block", "now", "pool_id", "amp_f", "total_supply", "d", "virtual_price", "imbalance",
+    *(f"reserves_{i}" for i in range(MAX_TOKENS)),
+    *(f"staker_fees_{i}" for i in range(MAX_TOKENS)),
+    "calls", "failed", "volume",
+)
+
+# columns holding arbitrary precision integers
+AMOUNT_COLUMNS = (
+    "amp_f", "total_supply", "d", "virtual_price",
+    *(f"reserves_{i}" for i in range(MAX_TOKENS)),
+    *(f"staker_fees_{i}" for i in range(MAX_TOKENS)),
+    "volume",
+)
+
+
+class ModelBackend(ModelRunner):
+    """ runs the calls on dex_model.DexModel """
+
+    @property
+    def storage(self):
+        return self.model.storage
+
+    @property
+    def now(self):
+        return self.model.now
+
+    def advance_blocks(self, count=1):
+        self.model.now += count * BLOCK_TIME
+
+class ChainBackend(ChainRunner):
+    """ runs the calls on the compiled contract through LocalChain """
+
+    @property
+    def storage(self):
+        return self.chain.storage
+
+    @property
+    def now(self):
+        return self.chain.now
+
+    def advance_blocks(self, count=1):
+        self.chain.advance_blocks(count)
+
+
+class OrderFlow:
+    """
+    Synthetic swaps on a single pool: a Poisson number of trades per block,
+    each between two random tokens. A trade is worth a log-normally
+    distributed fraction (median `size`) of the reserves of the token bought,
+    so trades draining a token shrink and the pool doesn't wander off.
+    """
+    def __init__(self, pool_id=0, trades_per_block=1.0, size=0.001, sigma=1.0, traders=ACTORS, seed=0):
+        self.pool_id = pool_id
+        self.trades_per_block = trades_per_block
+        self.size = size
+        self.sigma = sigma
+        self.traders = list(traders)
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, block, backend):
+        pool = backend.storage["storage"]["pools"].get(self.pool_id)
+        if pool is None:
+            return []
+        tokens_info = pool["tokens_info"]
+        xp_ = xp(pool)
+        steps = []
+        for _ in range(self.rng.poisson(self.trades_per_block)):
+            i, j = (int(k) for k in self.rng.choice(len(tokens_info), size=2, replace=False))
+            value = int(xp_[j] * self.size * self.rng.lognormal(0, self.sigma))
+            amount = max(1, value * Constants.precision // tokens_info[i]["rate_f"])
+            steps.append(Step("swap", {
+                "pool_id": self.pool_id, "idx_from": i, "idx_to": j, "amount": amount,
+                "min_amount_out": 1, "deadline": FAR_DEADLINE, "receiver": None, "referral": None,
+            }, self.traders[int(self.rng.integers(len(self.traders)))]))
+        return steps
+
+class Scheduled:
+    """ fixed calls at given blocks, `actions` is {block: [Step, ...]} """
+    def __init__(self, actions):
+        self.actions = actions
+
+    def __call__(self, block, backend):
+        return self.actions.get(block, [])
+
+def combine(*schedules):
+    """ a schedule running the calls of every schedule in turn """
+    def schedule(block, backend):
+        steps = []
+        for part in schedules:
+            steps.extend(part(block, backend))
+        return steps
+    return schedule
+
+
+def _pool_of(step):
+    params = step.params
+    if not isinstance(params, dict):
+        return params
+    if "pool_id" in params:
+        return params["pool_id"]
+    # stake wraps its parameters in the action, add_pool has no pool id yet
+    args = next(iter(params.values())) if len(params) == 1 else None
+    return args.get("pool_id") if isinstance(args, dict) else None
+
+def pool_metrics(pool, now):
+    """ the per-pool part of a metrics row """
+    amp_f = get_pool_A(pool, now)
+    tokens_info = pool["tokens_info"]
+    total_supply = pool["total_supply"]
+    xp_ = xp(pool)
+    d = 0
+    if total_supply > 0 and all(xp_.values()):
+        try:
+            d = d_cache.get_D(tokens_info, amp_f, xp_)
+        except ContractError:
+            d = None
+    row = {
+        "amp_f": amp_f,
+        "total_supply": total_supply,
+        "d": d,
+        "virtual_price": d * Constants.precision // total_supply if d and total_supply else None,
+        # 0 for a perfectly balanced pool, 1 once a token is gone
+        "imbalance": 1 - min(xp_.values()) / max(xp_.values()) if xp_ and max(xp_.values()) else None,
+    }
+    total_fees = pool["staker_accumulator"]["total_fees"]
+    for i in range(MAX_TOKENS):
+        row[f"reserves_{i}"] = tokens_info[i]["reserves"] if i in tokens_info else None
+        row[f"staker_fees_{i}"] = total_fees.get(i, 0) if i in tokens_info else None
+    return row
+
+def simulate(backend, schedule, blocks, every=1):
+    """
+    Runs `schedule(block, backend)` for `blocks` blocks and yields a metrics
+    row (a dict with the METRIC_COLUMNS keys) for each pool every `every`
+    blocks and after the last one. `calls`, `failed` and `volume` (amount
+    sold by successful swaps) count everything since the previous row.
+    """
+    counters = {}
+    for block in range(blocks):
+        for step in schedule(block, backend):
+            outcome = backend.run(step)
+            counter = counters.setdefault(_pool_of(step), {"calls": 0, "failed": 0, "volume": 0})
+            counter["calls"] += 1
+            if outcome.error is not None:
+                counter["failed"] += 1
+            elif step.entrypoint == "swap":
+                counter["volume"] += step.params["amount"]
+
+        if block % every == 0 or block == blocks - 1:
+            now = backend.now
+            for pool_id, pool in sorted(backend.storage["storage"]["pools"].items()):
+                row = {"block": block, "now": now, "pool_id": pool_id}
+                row.update(pool_metrics(pool, now))
+                row.update(counters.pop(pool_id, {"calls": 0, "failed": 0, "volume": 0}))
+                yield row
+            counters.clear()
+        backend.advance_blocks()
+
+
+def write_csv(rows, path):
+    """ streams metrics rows into a CSV file, returns the number of rows """
+    count = 0
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=METRIC_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def write_parquet(rows, path, batch_size=10_000):
+    """
+    Streams metrics rows into a Parquet file, one row group per `batch_size`
+    rows, and returns the number of rows. Needs pyarrow. Amounts are stored as
+    decimal strings since they do not fit into 64 bits.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("write_parquet needs pyarrow: python3 -m pip install pyarrow") from e
+
+    types = {"block": pa.int64(), "now": pa.int64(), "pool_id": pa.int64(), "imbalance": pa.float64(),
+             "calls": pa.int64(), "failed": pa.int64()}
+    schema = pa.schema([(name, types.get(name, pa.string())) for name in METRIC_COLUMNS])
+
+    def flush(writer, batch):
+        columns = {
+            name: [None if row[name] is None else str(row[name]) for row in batch] if name in AMOUNT_COLUMNS
+            else [row[name] for row in batch]
+            for name in METRIC_COLUMNS
+        }
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                flush(writer, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            flush(writer, batch)
+            count += len(batch)
+    return count
+
+
+if __name__ == "__main__":
+    import argparse
+    from initial_storage import load_dex, load_storage
+
+    parser = argparse.ArgumentParser(description="simulate a pool block by block")
+    parser.add_argument("--blocks", type=int, default=2880)
+    parser.add_argument("--reserves", nargs="+", type=int, default=[10**9, 10**9])
+    parser.add_argument("--a", type=int, default=A_CONST)
+    parser.add_argument("--trades", type=float, default=1.0, help="mean swaps per block")
+    parser.add_argument("--size", type=float, default=0.001, help="median swap size as a fraction of reserves")
+    parser.add_argument("--backend", choices=["model", "chain"], default="model")
+    parser.add_argument("--every", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv")
+    parser.add_argument("--parquet")
+    args = parser.parse_args()
+
+    storage = load_storage()
+    storage["storage"]["admin"] = admin
+    backend = ChainBackend(load_dex(), storage) if args.backend == "chain" else ModelBackend(storage)
+
+    tokens = [token_a, token_b, token_c, token_d][:len(args.reserves)]
+    add_pool = Step("add_pool", {
+        "a_constant": args.a,
+        "input_tokens": tokens,
+        "tokens_info": {i: {"rate_f": 10**18, "precision_multiplier_f": 1, "reserves": r} for i, r in enumerate(args.reserves)},
+        "fees": fees,
+    }, admin)
+    schedule = combine(Scheduled({0: [add_pool]}), OrderFlow(0, args.trades, args.size, seed=args.seed))
+    rows = simulate(backend, schedule, args.blocks, args.every)
+
+    if args.parquet:
+        print(write_parquet(rows, args.parquet), "rows written")
+    elif args.csv:
+        print(write_csv(rows, args.csv), "rows written")
+    else:
+        for row in rows:
+            print(row)
@@ -0,0 +1,546 @@
+# Pure-Python port of contracts/partials/dex_core/math.ligo
+#
+# Every function here works on the same Python objects PyTezos produces for
+# the contract storage (pools as dicts, tokens_info keyed by token index) and
+# reproduces the integer semantics of the contract exactly: all divisions are
+# Michelson EDIV on naturals, maps are folded in ascending key order and
+# failing branches raise `ContractError` with the same error string the
+# contract would `failwith`.
+
+from collections import OrderedDict
+
+class Constants:
+    """ Mirror of contracts/partials/constants.ligo """
+    precision = 10 ** 18
+    a_precision = 100
+    rate_precision = 100_00000
+    accum_precision = 10_000_000_000
+    fee_denominator = 10_000_000_000
+    max_a = 1_000_000
+    max_a_change = 10
+    min_ramp_time = 86_400
+    max_tokens_count = 4
+    min_tokens_count = 2
+
+
+class Errors:
+    """ Mirror of contracts/partials/errors.ligo """
+    class Dex:
+        a_limit = "a-too-high"
+        balance_overflow = "balance-overflow"
+        dust_out = "dust-output"
+        fee_overflow = "fee-overflow"
+        high_min_out = "high-min-out"
+        insufficient_lp = "insufficient-shares"
+        low_max_shares_in = "low-max-shares-in"
+        low_reserves = "low-reserves"
+        low_total_supply = "low-total-supply"
+        no_liquidity = "no-liquidity"
+        no_token = "token-not-found"
+        no_token_info = "no-token-info"
+        not_contract_admin = "not-contract-admin"
+        not_developer = "not-developer"
+        pool_listed = "pool-exist"
+        pool_not_listed = "not-launched"
+        reserves_drained = "zero-reserves-when-positive-shares"
+        supply_drained = "positive-reserves-when-zero-shares"
+        time_expired = "time-expired"
+        timestamp_error = "timestamp-error"
+        wrong_index = "wrong-index"
+        wrong_precision = "wrong-precision"
+        wrong_shares_out = "wrong-shares-out"
+        wrong_tokens_count = "wrong-tokens-count"
+        zero_burn_amount = "zero-burn-amount"
+        zero_in = "zero-amount-in"
+        zero_min_out = "zero-min-out"
+
+    class FA2:
+        insufficient_balance = "FA2_INSUFFICIENT_BALANCE"
+
+    class Math:
+        nat_error = "value-not-natural"
+        ediv_error = "ediv-error"
+
+    # failwith strings LIGO emits for bare `assert` and nat division by zero
+    assertion = "failed assertion"
+    div_by_zero = "DIV by 0"
+
+
+class ContractError(Exception):
+    """ Raised wherever the contract would `failwith` """
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
+
+
+def require(param, error):
+    if not param:
+        raise ContractError(error)
+
+def nat_or_error(value, err):
+    if value < 0:
+        raise ContractError(err)
+    return value
+
+def ceil_div(numerator, denominator):
+    if denominator == 0:
+        raise ContractError(Errors.Math.ediv_error)
+    result, remainder = divmod(numerator, denominator)
+    return result + 1 if remainder > 0 else result
+
+def sum_all_fee(fee, dev_fee_f):
+    return fee["lp_f"] + fee["stakers_f"] + fee["ref_f"] + dev_fee_f
+
+def divide_fee_for_balance(fee, tokens_count):
+    return fee * tokens_count // (4 * nat_or_error(tokens_count - 1, Errors.Dex.wrong_tokens_count))
+
+def nip_fees_off_reserves(stakers_fee, ref_fee, dev_fee, token_info):
+    reserves = nat_or_error(
+        token_info["reserves"] - stakers_fee - ref_fee - dev_fee,
+        Errors.Dex.low_reserves
+    )
+    return dict(token_info, reserves=reserves)
+
+def slice_fee(dy, fee, dev_fee_f, total_staked):
+    to_ref = dy * fee["ref_f"] // Constants.fee_denominator
+    to_dev = dy * dev_fee_f // Constants.fee_denominator
+    to_providers = dy * fee["lp_f"] // Constants.fee_denominator
+
+    to_stakers = 0
+    if total_staked != 0:
+        to_stakers = dy * fee["stakers_f"] // Constants.fee_denominator
+    else:
+        to_providers += dy * fee["stakers_f"] // Constants.fee_denominator
+
+    return {
+        "dy": nat_or_error(dy - to_providers - to_ref - to_dev - to_stakers, Errors.Dex.fee_overflow),
+        "ref": to_ref,
+        "dev": to_dev,
+        "stakers": to_stakers,
+        "lp": to_providers,
+    }
+
+def get_dev_fee(s):
+    """ dev fee of the standalone dex, `s` is the inner `storage` record """
+    return s["dev_store"]["dev_fee_f"]
+
+def token_key(token):
+    """ converts a token as stored in `tokens` into the form PyTezos uses for big_map keys """
+    if isinstance(token, tuple):
+        return token
+    (kind, value), = token.items()
+    if kind == "fa2":
+        return (kind, (value["token_address"], value["token_id"]))
+    return (kind, value)
+
+
+def xp_mem(tokens_info):
+    return {
+        key: token_info["rate_f"] * token_info["reserves"] // Constants.precision
+        for key, token_info in sorted(tokens_info.items())
+    }
+
+def xp(pool):
+    return xp_mem(pool["tokens_info"])
+
+def get_A(t0, a0, t1, a1, now):
+    """ Handle ramping A up or down, `now` stands for Tezos.now """
+    a = a1
+    if now < t1:
+        t_num = nat_or_error(now - t0, Errors.Dex.timestamp_error)
+        t_den = nat_or_error(t1 - t0, Errors.Dex.timestamp_error)
+        diff = abs(a1 - a0)
+        value = diff * t_num // t_den
+        a = a0 + value if a1 > a0 else abs(a0 - value)
+    return a
+
+def get_pool_A(pool, now):
+    return get_A(
+        pool["initial_A_time"],
+        pool["initial_A_f"],
+        pool["future_A_time"],
+        pool["future_A_f"],
+        now
+    )
+
+class WarmStartMismatch(Exception):
+    """ a warm-started solve landed on a different value than the cold one """
+
+
+class SolverStats:
+    """
+    Iteration counts of Newton solves, split by solver and start kind.
+    solve_D and solve_y count into `solver_stats`, get_D and calc_y into the
+    SolverStats they are given, if any.
+    """
+    def __init__(self):
+        self.solves = {}
+        self.iterations = {}
+        self.histogram = {}
+
+    def record(self, solver, warm, iterations):
+        key = (solver, "warm" if warm else "cold")
+        self.solves[key] = self.solves.get(key, 0) + 1
+        self.iterations[key] = self.iterations.get(key, 0) + iterations
+        counts = self.histogram.setdefault(key, {})
+        counts[iterations] = counts.get(iterations, 0) + 1
+
+    def mean(self, solver, warm=False):
+        key = (solver, "warm" if warm else "cold")
+        solves = self.solves.get(key, 0)
+        return self.iterations.get(key, 0) / solves if solves else 0.0
+
+    def reset(self):
+        self.__init__()
+
+solver_stats = SolverStats()
+
+
+def _newton_D(values, amp_f, d):
+    sum_c = sum(values)
+    tokens_count = len(values)
+    a_nn_f = amp_f * tokens_count
+    prev_d = 0
+    iterations = 0
+
+    while abs(d - prev_d) > 1:
+        d_p_num = d
+        d_p_den = 1
+        for value in values:
+            d_p_num *= d
+            d_p_den *= value * tokens_count
+        require(d_p_den != 0, Errors.div_by_zero)
+        d_p = d_p_num // d_p_den
+        prev_d = d
+        denominator = (
+            nat_or_error(a_nn_f - Constants.a_precision, Errors.Dex.wrong_precision) * d // Constants.a_precision
+            + (tokens_count + 1) * d_p
+        )
+        require(denominator != 0, Errors.div_by_zero)
+        d = (a_nn_f * sum_c // Constants.a_precision + d_p * tokens_count) * d // denominator
+        iterations += 1
+    return d, iterations
+
+def _warm(solver, cold, warm, start, strict):
+    """
+    Runs `warm(start)` falling back to `cold()` whenever the warm start is
+    unusable. In strict mode the cold solve always runs and has to agree.
+    """
+    if start is None or start < 2:
+        value, iterations = cold()
+        solver_stats.record(solver, False, iterations)
+        return value, iterations
+
+    try:
+        value, iterations = warm(start)
+    except ContractError:
+        value = None
+    if value is None:
+        value, iterations = cold()
+        solver_stats.record(solver, False, iterations)
+        return value, iterations
+    solver_stats.record(solver, True, iterations)
+
+    if strict:
+        expected, _ = cold()
+        if expected != value:
+            raise WarmStartMismatch(f"{solver}: warm start {start} gave {value}, cold start gives {expected}")
+    return value, iterations
+
+def solve_D(xp, amp_f, start=None, strict=False):
+    """
+    get_D returning (d, iterations). `start` replaces the contract's initial
+    guess sum(xp); Newton stops within 1 of the root, so a warm start may land
+    one unit away from the contract's answer - `strict` re-solves cold and
+    raises WarmStartMismatch if it does.
+    """
+    values = [value for _, value in sorted(xp.items())]
+    cold = lambda: _newton_D(values, amp_f, sum(values))
+    warm = lambda d: _newton_D(values, amp_f, d)
+    return _warm("get_D", cold, warm, start, strict)
+
+def get_D(xp, amp_f, stats=None):
+    """
+    D invariant calculation in non-overflowing integer operations iteratively
+
+    A * sum(x_i) * n**n + D = A * D * n**n + D**(n+1) / (n**n * prod(x_i))
+    """
+    values = [value for _, value in sorted(xp.items())]
+    d, iterations = _newton_D(values, amp_f, sum(values))
+    if stats is not None:
+        stats.record("get_D", False, iterations)
+    return d
+
+def get_D_mem(tokens_info, amp_f):
+    return get_D(xp_mem(tokens_info), amp_f)
+
+
+class DCache:
+    """
+    LRU memo of the invariant D keyed on (reserves, rates, amp_f) of a pool.
+
+    An entry stays right for as long as anything quotes the pool state it
+    was computed for, so entries are only ever evicted as least recently used.
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def state_key(tokens_info):
+        return tuple(
+            (idx, info["reserves"], info["rate_f"])
+            for idx, info in sorted(tokens_info.items())
+        )
+
+    def lookup(self, tokens_info, amp_f):
+        """ cached D or None, counts a hit or a miss """
+        key = (self.state_key(tokens_info), amp_f)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def store(self, tokens_info, amp_f, d):
+        if self.maxsize <= 0:
+            return
+        self.entries[(self.state_key(tokens_info), amp_f)] = d
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_D(self, tokens_info, amp_f, xp=None, stats=None):
+        """ D of `tokens_info`; `xp` may be passed if already computed """
+        d = self.lookup(tokens_info, amp_f)
+        if d is None:
+            d = get_D(xp if xp is not None else xp_mem(tokens_info), amp_f, stats)
+            self.store(tokens_info, amp_f, d)
+        return d
+
+    def invalidate(self):
+        """ drops every entry """
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+        }
+
+# shared by get_y and calc_withdraw_one_coin
+d_cache = DCache()
+
+def _newton_y(c, b, d, y):
+    prev_y = 0
+    iterations = 0
+    while abs(y - prev_y) > 1:
+        prev_y = y
+        y = ceil_div(y * y + c, nat_or_error(2 * y + b - d, Errors.Math.nat_error))
+        iterations += 1
+    return y, iterations
+
+def solve_y(c, a_nn_f, s_, d, pool, start=None, strict=False):
+    """ calc_y returning (y, iterations), see solve_D for `start` and `strict` """
+    tokens_count = len(pool["tokens_info"])
+    c = ceil_div(c * d * Constants.a_precision, a_nn_f * tokens_count)
+    b = s_ + d * Constants.a_precision // a_nn_f
+    cold = lambda: _newton_y(c, b, d, d)
+    warm = lambda y: _newton_y(c, b, d, y)
+    return _warm("calc_y", cold, warm, start, strict)
+
+def calc_y(c, a_nn_f, s_, d, pool, stats=None):
+    """
+    Solves x_1**2 + b*x_1 = c iteratively:
+    x_1 = (x_1**2 + c) / (2*x_1 + b)
+    """
+    tokens_count = len(pool["tokens_info"])
+    c = ceil_div(c * d * Constants.a_precision, a_nn_f * tokens_count)
+    b = s_ + d * Constants.a_precision // a_nn_f
+    y, iterations = _newton_y(c, b, d, d)
+    if stats is not None:
+        stats.record("calc_y", False, iterations)
+    return y
+
+def _prepare_params(xp, skip, d, tokens_count, i=None, x=None):
+    s_ = 0
+    c_num = d
+    c_den = 1
+    for key, value in sorted(xp.items()):
+        if key == skip:
+            continue
+        _x = x if key == i else value
+        s_ += _x
+        c_num *= d
+        c_den *= _x * tokens_count
+    return s_, ceil_div(c_num, c_den)
+
+class WarmStart:
+    """
+    Last solutions of a stream of quotes against one pool. Passed to get_y /
+    perform_swap they become the starting points of the next solves instead of
+    sum(xp) and D. Warm results only enter the shared D cache in strict mode,
+    when they are known to equal the contract's.
+    """
+    def __init__(self, strict=False):
+        self.strict = strict
+        self.d = None
+        self.y = {}
+        self.last_iterations = {}
+
+def get_y(i, j, x, xp, pool, now, warm=None, stats=None):
+    """ Calculate x[j] if one makes x[i] = x """
+    tokens_count = len(pool["tokens_info"])
+
+    require(i != j, Errors.assertion)
+    require(j < tokens_count, Errors.assertion)
+    require(i < tokens_count, Errors.assertion)
+
+    amp_f = get_pool_A(pool, now)
+    a_nn_f = amp_f * tokens_count
+    # the cache is keyed by the pool state, only the D of xp(pool) can go through it
+    cached = xp == xp_mem(pool["tokens_info"])
+    if warm is None:
+        d = d_cache.get_D(pool["tokens_info"], amp_f, xp, stats) if cached else get_D(xp, amp_f, stats)
+        s_, c = _prepare_params(xp, j, d, tokens_count, i=i, x=x)
+        return calc_y(c, a_nn_f, s_, d, pool, stats)
+
+    d = d_cache.lookup(pool["tokens_info"], amp_f) if cached else None
+    if d is None:
+        d, warm.last_iterations["get_D"] = solve_D(xp, amp_f, start=warm.d, strict=warm.strict)
+        if warm.strict and cached:
+            d_cache.store(pool["tokens_info"], amp_f, d)
+    else:
+        warm.last_iterations["get_D"] = 0
+    warm.d = d
+
+    s_, c = _prepare_params(xp, j, d, tokens_count, i=i, x=x)
+    y, warm.last_iterations["calc_y"] = solve_y(c, a_nn_f, s_, d, pool, start=warm.y.get(j), strict=warm.strict)
+    warm.y[j] = y
+    return y
+
+def get_y_D(amp_f, i, xp, d, pool, stats=None):
+    """ Calculate x[i] if one reduces D from being calculated for xp to D """
+    tokens_count = len(pool["tokens_info"])
+
+    require(i < tokens_count, Errors.Dex.wrong_index)
+
+    a_nn_f = amp_f * tokens_count
+
+    s_, c = _prepare_params(xp, i, d, tokens_count)
+    return calc_y(c, a_nn_f, s_, d, pool, stats)
+
+def _unwrap(mapping, key, error):
+    if key not in mapping:
+        raise ContractError(error)
+    return mapping[key]
+
+def calc_withdraw_one_coin(amp_f, token_amount, i, dev_fee_f, pool, stats=None):
+    tokens_count = len(pool["tokens_info"])
+    xp_ = xp(pool)
+    d0 = d_cache.get_D(pool["tokens_info"], amp_f, xp_, stats)
+    total_supply = pool["total_supply"]
+    require(total_supply != 0, Errors.div_by_zero)
+    d1 = nat_or_error(d0 - (token_amount * d0 // total_supply), Errors.Math.nat_error)
+    require(d1 < d0, Errors.Dex.zero_in)
+    new_y = get_y_D(amp_f, i, xp_, d1, pool, stats)
+    base_fee_f = sum_all_fee(pool["fee"], dev_fee_f)
+
+    xp_reduced = {}
+    for key, value in xp_.items():
+        if key == i:
+            dx_expected = nat_or_error((value * d1 // d0) - new_y, Errors.Math.nat_error)
+        else:
+            dx_expected = nat_or_error(value - (value * d1 // d0), Errors.Math.nat_error)
+        xp_reduced[key] = nat_or_error(
+            value - dx_expected * divide_fee_for_balance(base_fee_f, tokens_count) // Constants.fee_denominator,
+            Errors.Math.nat_error
+        )
+
+    xp_red_i = _unwrap(xp_reduced, i, Errors.Dex.wrong_index)
+    dy = nat_or_error(xp_red_i - get_y_D(amp_f, i, xp_reduced, d1, pool, stats), Errors.Math.nat_error)
+    t_i = _unwrap(pool["tokens_info"], i, Errors.Dex.wrong_index)
+    require(dy < t_i["reserves"], Errors.Dex.low_reserves)
+    precisions_i = t_i["precision_multiplier_f"]
+    xp_i = _unwrap(xp_, i, Errors.Dex.wrong_index)
+    dy = dy // precisions_i
+
+    dy_0 = nat_or_error(xp_i - new_y, Errors.Math.nat_error) // precisions_i
+
+    total_supply = nat_or_error(pool["total_supply"] - token_amount, Errors.Dex.low_total_supply)
+
+    fee = nat_or_error(dy_0 - dy, Errors.Math.nat_error)
+    return {"dy": dy, "dy_fee": fee, "ts": total_supply}
+
+def balance_inputs(init_tokens_info, d0, new_tokens_info, d1, tokens, fees, dev_fee_f, referral, accumulator):
+    """
+    Balance pool when imbalanced request.
+    `accumulator` holds dev_rewards, referral_rewards, staker_accumulator, tokens_info
+    and tokens_info_without_lp. A new accumulator is returned, the input is left intact.
+    """
+    tokens_count = len(tokens)
+
+    staker_accumulator = accumulator["staker_accumulator"]
+    accum = {
+        "dev_rewards": dict(accumulator["dev_rewards"]),
+        "referral_rewards": dict(accumulator["referral_rewards"]),
+        "staker_accumulator": dict(
+            staker_accumulator,
+            total_fees=dict(staker_accumulator["total_fees"]),
+            accumulator_f=dict(staker_accumulator["accumulator_f"]),
+        ),
+        "tokens_info": dict(accumulator["tokens_info"]),
+        "tokens_info_without_lp": dict(accumulator["tokens_info_without_lp"]),
+    }
+    staker_accumulator = accum["staker_accumulator"]
+
+    for i, token_info in sorted(new_tokens_info.items()):
+        old_info = _unwrap(init_tokens_info, i, Errors.Dex.wrong_index)
+        ideal_balance = d1 * old_info["reserves"] // d0
+        diff = abs(ideal_balance - token_info["reserves"])
+        to_dev = diff * divide_fee_for_balance(dev_fee_f, tokens_count) // Constants.fee_denominator
+        to_ref = diff * divide_fee_for_balance(fees["ref_f"], tokens_count) // Constants.fee_denominator
+        to_lp = diff * divide_fee_for_balance(fees["lp_f"], tokens_count) // Constants.fee_denominator
+        to_stakers = 0
+
+        total_staked = staker_accumulator["total_staked"]
+        if total_staked != 0:
+            to_stakers = diff * divide_fee_for_balance(fees["stakers_f"], tokens_count) // Constants.fee_denominator
+            staker_accumulator["total_fees"][i] = staker_accumulator["total_fees"].get(i, 0) + to_stakers
+            staker_accumulator["accumulator_f"][i] = staker_accumulator["accumulator_f"].get(i, 0) \
+                + to_stakers * Constants.accum_precision // total_staked
+        else:
+            to_lp += diff * divide_fee_for_balance(fees["stakers_f"], tokens_count) // Constants.fee_denominator
+
+        token = token_key(_unwrap(tokens, i, Errors.Dex.wrong_index))
+        ref_key = (referral, token)
+
+        accum["dev_rewards"][token] = accum["dev_rewards"].get(token, 0) + to_dev
+        accum["referral_rewards"][ref_key] = accum["referral_rewards"].get(ref_key, 0) + to_ref
+        token_info = nip_fees_off_reserves(to_stakers, to_ref, to_dev, token_info)
+        accum["tokens_info"][i] = token_info
+        token_info = dict(token_info, reserves=nat_or_error(token_info["reserves"] - to_lp, Errors.Dex.low_reserves))
+        accum["tokens_info_without_lp"][i] = token_info
+
+    return accum
+
+def perform_swap(i, j, dx, pool, now, warm=None, stats=None):
+    xp_ = xp(pool)
+    xp_i = _unwrap(xp_, i, Errors.Dex.wrong_index)
+    xp_j = _unwrap(xp_, j, Errors.Dex.wrong_index)
+    t_i = _unwrap(pool["tokens_info"], i, Errors.Dex.wrong_index)
+    t_j = _unwrap(pool["tokens_info"], j, Errors.Dex.wrong_index)
+    rate_i_f = t_i["rate_f"]
+    rate_j_f = t_j["rate_f"]
+    x = xp_i + (dx * rate_i_f // Constants.precision)
+    y = get_y(i, j, x, xp_, pool, now, warm, stats)
+    dy = nat_or_error(xp_j - y, Errors.Math.nat_error)
+    dy = dy * Constants.precision // rate_j_f
+    require(dy < t_j["reserves"], Errors.Dex.low_reserves)
+    return dy
@@ -0,0 +1,167 @@
+# Incremental replay of the staker reward accounting
+#
+# Follows only the part of the dex state the staking rewards depend on: each
+# pool's staker_accumulator and stakers_balance, in the same python form
+# PyTezos gives for the storage. Events come from an indexer (or a scenario)
+# and cost O(tokens of the touched pool) each, no pool math is redone: swaps
+# carry the output amount before fees and the other fee-bearing operations
+# carry the staker fee the contract computed.
+#
+#   replay = StakingReplay.from_storage(chain.storage)
+#   for event, payout in replay.replay(events):
+#       ...
+#   checkpoint = replay.checkpoint()
+#   ...
+#   replay = StakingReplay.resume(checkpoint)
+
+from collections import namedtuple
+
+from stable_math import Constants, Errors, nat_or_error
+
+# swap with `dy` the output in token `token_index` before fees, as perform_swap returns it
+Swap = namedtuple("Swap", ["pool_id", "token_index", "dy"])
+# staker part of the fee of invest, divest_imbalanced or divest_one_coin
+StakerFee = namedtuple("StakerFee", ["pool_id", "token_index", "amount"])
+# the stake entrypoint, `action` is "add" or "remove"
+Stake = namedtuple("Stake", ["user", "pool_id", "action", "amount"])
+SetFees = namedtuple("SetFees", ["pool_id", "fee"])
+
+def _new_pool(stakers_f=0):
+    return {"accumulator_f": {}, "total_fees": {}, "total_staked": 0, "stakers_f": stakers_f}
+
+def _copy_pool(pool):
+    return dict(pool, accumulator_f=dict(pool["accumulator_f"]), total_fees=dict(pool["total_fees"]))
+
+def _copy_staker(info):
+    return {"balance": info["balance"], "earnings": {i: dict(reward) for i, reward in info["earnings"].items()}}
+
+
+class StakingReplay:
+    def __init__(self, pools=None, stakers=None, position=0):
+        # pool_id -> staker_accumulator fields plus the pool's stakers_f
+        self.pools = pools if pools is not None else {}
+        # (user, pool_id) -> {"balance", "earnings": {i: {"reward_f", "former_f"}}}
+        self.stakers = stakers if stakers is not None else {}
+        # number of events applied so far
+        self.position = position
+
+    @classmethod
+    def from_storage(cls, storage):
+        """ starts from the current state of a LocalChain or DexModel storage """
+        s = storage["storage"]
+        pools = {
+            pool_id: dict(_copy_pool(pool["staker_accumulator"]), stakers_f=pool["fee"]["stakers_f"])
+            for pool_id, pool in s["pools"].items()
+        }
+        stakers = {key: _copy_staker(info) for key, info in s["stakers_balance"].items()}
+        return cls(pools, stakers)
+
+    def checkpoint(self):
+        """ a self-contained (and picklable) copy of the state to `resume` from """
+        return {
+            "position": self.position,
+            "pools": {pool_id: _copy_pool(pool) for pool_id, pool in self.pools.items()},
+            "stakers": {key: _copy_staker(info) for key, info in self.stakers.items()},
+        }
+
+    @classmethod
+    def resume(cls, checkpoint):
+        return cls(
+            {pool_id: _copy_pool(pool) for pool_id, pool in checkpoint["pools"].items()},
+            {key: _copy_staker(info) for key, info in checkpoint["stakers"].items()},
+            checkpoint["position"],
+        )
+
+    def _pool(self, pool_id):
+        return self.pools.setdefault(pool_id, _new_pool())
+
+    def apply(self, event):
+        """
+        Applies a single event and returns the rewards it paid out as
+        {token_index: amount}. A failing stake raises ContractError and
+        leaves the state as it was.
+        """
+        handler = getattr(self, f"_{type(event).__name__.lower()}", None)
+        if handler is None:
+            raise ValueError(f"unknown event {event!r}")
+        payout = handler(event)
+        self.position += 1
+        return payout
+
+    def replay(self, events):
+        """ applies `events` in order, yielding (event, payout) for each """
+        for event in events:
+            yield event, self.apply(event)
+
+    def _setfees(self, event):
+        self._pool(event.pool_id)["stakers_f"] = event.fee["stakers_f"]
+        return {}
+
+    def _accrue(self, pool, i, to_stakers):
+        pool["total_fees"][i] = pool["total_fees"].get(i, 0) + to_stakers
+        pool["accumulator_f"][i] = pool["accumulator_f"].get(i, 0) \
+            + to_stakers * Constants.accum_precision // pool["total_staked"]
+
+    def _swap(self, event):
+        pool = self._pool(event.pool_id)
+        i = event.token_index
+        if pool["total_staked"] > 0:
+            self._accrue(pool, i, event.dy * pool["stakers_f"] // Constants.fee_denominator)
+        else:
+            # the swap lambda writes the accumulator entry even when nothing is staked
+            pool["accumulator_f"][i] = pool["accumulator_f"].get(i, 0)
+        return {}
+
+    def _stakerfee(self, event):
+        pool = self._pool(event.pool_id)
+        if pool["total_staked"] > 0:
+            self._accrue(pool, event.token_index, event.amount)
+        return {}
+
+    def _stake(self, event):
+        pool = self._pool(event.pool_id)
+        key = (event.user, event.pool_id)
+        info = self.stakers.get(key, {"balance": 0, "earnings": {}})
+        shares = event.amount
+
+        balance = info["balance"]
+        total_staked = pool["total_staked"]
+        if shares > 0:
+            if event.action == "add":
+                balance += shares
+                total_staked += shares
+            else:
+                balance = nat_or_error(balance - shares, Errors.Dex.wrong_shares_out)
+                total_staked = nat_or_error(total_staked - shares, Errors.Dex.wrong_shares_out)
+
+        # harvest
+        payout = {}
+        earnings = dict(info["earnings"])
+        for i, pool_accum_f in sorted(pool["accumulator_f"].items()):
+            reward = earnings.get(i, {"former_f": 0, "reward_f": 0})
+            new_former_f = info["balance"] * pool_accum_f
+            reward_amt, reward_change = divmod(reward["reward_f"] + abs(new_former_f - reward["former_f"]), Constants.accum_precision)
+            if reward_amt > 0:
+                payout[i] = reward_amt
+            earnings[i] = {"reward_f": reward_change, "former_f": new_former_f}
+
+        if shares > 0:
+            earnings = {
+                i: dict(reward, former_f=balance * pool["accumulator_f"].get(i, 0))
+                for i, reward in earnings.items()
+            }
+            pool["total_staked"] = total_staked
+        self.stakers[key] = {"balance": balance, "earnings": earnings}
+        return payout
+
+    def pending(self, user, pool_id):
+        """ what a stake call of `user` would pay out right now """
+        pool = self.pools.get(pool_id, _new_pool())
+        info = self.stakers.get((user, pool_id), {"balance": 0, "earnings": {}})
+        payout = {}
+        for i, pool_accum_f in pool["accumulator_f"].items():
+            reward = info["earnings"].get(i, {"former_f": 0, "reward_f": 0})
+            amount = (reward["reward_f"] + abs(info["balance"] * pool_accum_f - reward["former_f"])) // Constants.accum_precision
+            if amount > 0:
+                payout[i] = amount
+        return payout
@@ -0,0 +1,57 @@
+# Runs independent scenarios over a parameter grid on all cores
+#
+# A scenario is a module-level function taking the grid parameters as keyword
+# arguments. It gets the contract through initial_storage.load_dex() and
+# load_storage(), which are built once per worker process and then reused by
+# every point the worker runs.
+
+import itertools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+SweepResult = namedtuple("SweepResult", ["params", "result", "error"])
+
+def param_grid(grid):
+    """ {"fee": [1, 2], "a": [10]} -> [{"fee": 1, "a": 10}, {"fee": 2, "a": 10}] """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def _preload():
+    from initial_storage import load_dex, load_storage
+    load_dex()
+    load_storage()
+
+def _run_point(scenario, params):
+    try:
+        return SweepResult(params, scenario(**params), None)
+    except Exception as e:
+        # keep the message only, not every exception survives pickling
+        return SweepResult(params, None, f"{type(e).__name__}: {e}")
+
+def run_sweep(scenario, grid, max_workers=None, preload=True):
+    """
+    Yields a SweepResult for every point of `grid` as soon as it finishes.
+
+    `grid` is either a dict of parameter lists (expanded with `param_grid`) or
+    an iterable of ready parameter dicts. A failing point yields its error
+    instead of stopping the sweep. `max_workers=1` runs everything inline,
+    which is handy under a debugger. With `preload` each worker loads the
+    contract before taking its first point.
+    """
+    points = param_grid(grid) if isinstance(grid, dict) else list(grid)
+
+    if max_workers == 1:
+        if preload:
+            _preload()
+        for params in points:
+            yield _run_point(scenario, params)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_preload if preload else None)
+    try:
+        futures = [executor.submit(_run_point, scenario, params) for params in points]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # the consumer may stop early, don't keep computing for nobody
+        executor.shutdown(wait=True, cancel_futures=True)
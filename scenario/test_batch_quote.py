@@ -0,0 +1,71 @@
+from unittest import TestCase
+import random
+from constants import *
+
+from helpers import *
+
+import stable_math
+from batch_quote import get_dy_batch
+
+class BatchQuoteTest(TestCase):
+
+    def pool(self, reserves, a_constant=A_CONST):
+        return {
+            "initial_A_f": a_constant * stable_math.Constants.a_precision,
+            "future_A_f": a_constant * stable_math.Constants.a_precision,
+            "initial_A_time": 0,
+            "future_A_time": 0,
+            "tokens_info": equal_pool_rates(reserves),
+            "fee": fees,
+            "staker_accumulator": { "accumulator_f": {}, "total_fees": {}, "total_staked": 0 },
+            "total_supply": sum(reserves),
+        }
+
+    def storage(self, pools):
+        return {
+            "storage": {
+                "pools": pools,
+                "dev_store": { "dev_fee_f": 500_000 },
+            }
+        }
+
+    def scalar_get_dy(self, storage, pool_id, i, j, dx):
+        pool = storage["storage"]["pools"][pool_id]
+        dy = stable_math.perform_swap(i, j, dx, pool, 0)
+        fee = stable_math.sum_all_fee(pool["fee"], 500_000) * dy // stable_math.Constants.fee_denominator
+        return dy - fee
+
+    def test_matches_scalar_quotes(self):
+        random.seed(42)
+        storage = self.storage({
+            0: self.pool([100_000_000, 100_000]),
+            1: self.pool([10**12, 10**9, 10**15], a_constant=100),
+            2: self.pool([10, 10, 10, 10], a_constant=1),
+        })
+        lanes = []
+        for _ in range(300):
+            pool_id = random.randint(0, 2)
+            count = len(storage["storage"]["pools"][pool_id]["tokens_info"])
+            i, j = random.sample(range(count), 2)
+            lanes.append((pool_id, i, j, random.randint(1, 10**random.randint(1, 14))))
+
+        dy, errors = get_dy_batch(storage, *zip(*lanes), return_errors=True)
+
+        for k, (pool_id, i, j, dx) in enumerate(lanes):
+            try:
+                expected = self.scalar_get_dy(storage, pool_id, i, j, dx)
+            except stable_math.ContractError as e:
+                self.assertEqual(errors[k], e.error)
+                self.assertIsNone(dy[k])
+                continue
+            self.assertIsNone(errors[k])
+            self.assertEqual(dy[k], expected)
+
+    def test_failing_lanes(self):
+        storage = self.storage({ 0: self.pool([100, 100]) })
+        dy, errors = get_dy_batch(storage, [0, 1, 0, 0], [0, 0, 0, 1], [1, 1, 2, 1], [10, 10, 10, 10], return_errors=True)
+
+        self.assertIsNotNone(dy[0])
+        self.assertEqual(errors[1], stable_math.Errors.Dex.pool_not_listed)
+        self.assertEqual(errors[2], stable_math.Errors.Dex.wrong_index)
+        self.assertEqual(errors[3], stable_math.Errors.assertion)
@@ -0,0 +1,74 @@
+from unittest import TestCase
+from constants import *
+
+from helpers import *
+
+from dex_model import DexModel
+from stable_math import Constants
+from model_fixtures import model_storage, swap
+from batch_rewards import (
+    REFERRAL_COLUMNS, STAKER_COLUMNS, concat_batches, referral_reward_batches, staker_reward_batches,
+)
+import views
+
+fees = {"lp_f": 1_000_000, "stakers_f": 2_000_000, "ref_f": 500_000}
+
+class BatchRewardsTest(TestCase):
+
+    def staked_storage(self):
+        model = DexModel(model_storage())
+        for tokens in ([token_a, token_b], [token_a, token_b, token_c]):
+            model.execute("add_pool", dict(a_constant=A_CONST, input_tokens=tokens, tokens_info=equal_pool_rates([10**9] * len(tokens)), fees=fees), sender=admin)
+        for pool_id in (0, 1):
+            model.execute("stake", {"add": {"pool_id": pool_id, "amount": 50}}, sender=admin)
+            for n, user in enumerate([alice, bob, carol]):
+                model.execute("swap", dict(swap(n % 2, 1 - n % 2, 10**7), pool_id=pool_id, referral=user), sender=admin)
+                model.execute("stake", {"add": {"pool_id": pool_id, "amount": 100 * (n + 1)}}, sender=user)
+            model.execute("swap", dict(swap(0, 1, 10**7), pool_id=pool_id), sender=admin)
+        return model.storage
+
+    def test_matches_view(self):
+        storage = self.staked_storage()
+        batches = list(staker_reward_batches(storage, batch_size=4))
+        self.assertTrue(all(len(batch["reward"]) <= 4 for batch in batches))
+        self.assertGreater(len(batches), 1)
+        result = concat_batches(batches, STAKER_COLUMNS)
+
+        requests = [{"user": user, "pool_id": pool_id} for user, pool_id in storage["storage"]["stakers_balance"]]
+        expected = {}
+        for response in views.get_staker_info(storage, requests):
+            for i, reward in response["info"]["rewards"].items():
+                expected[(response["request"]["user"], response["request"]["pool_id"], i)] = (response["info"]["balance"], reward)
+
+        got = {
+            (user, int(pool_id), int(i)): (balance, reward)
+            for user, pool_id, i, balance, reward in zip(*(result[name] for name in STAKER_COLUMNS))
+        }
+        self.assertEqual(got, expected)
+        self.assertGreater(sum(reward for _, reward in got.values()), 0)
+
+    def test_pool_filter(self):
+        storage = self.staked_storage()
+        result = concat_batches(staker_reward_batches(storage, pool_ids=[1]), STAKER_COLUMNS)
+        self.assertEqual(set(result["pool_id"]), {1})
+        empty = concat_batches(staker_reward_batches(storage, pool_ids=[7]), STAKER_COLUMNS)
+        self.assertEqual(len(empty["reward"]), 0)
+
+    def test_exact_beyond_int64(self):
+        balance = 10**30
+        accumulator_f = 3 * 10**25 + 7
+        storage = {"storage": {
+            "pools": {0: {"staker_accumulator": {"accumulator_f": {0: accumulator_f}}}},
+            "stakers_balance": {(alice, 0): {"balance": balance, "earnings": {0: {"reward_f": 123, "former_f": 10**40}}}},
+        }}
+        batch, = staker_reward_batches(storage)
+        self.assertEqual(batch["reward"][0], (123 + abs(balance * accumulator_f - 10**40)) // Constants.accum_precision)
+
+    def test_referral_rewards(self):
+        storage = self.staked_storage()
+        result = concat_batches(referral_reward_batches(storage, batch_size=2), REFERRAL_COLUMNS)
+        rewards = storage["storage"]["referral_rewards"]
+        self.assertEqual(len(result["reward"]), len(rewards))
+        for user, token, reward in zip(result["user"], result["token"], result["reward"]):
+            self.assertIsInstance(token, tuple)
+            self.assertEqual(rewards[(user, token)], reward)
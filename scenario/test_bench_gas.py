@@ -0,0 +1,114 @@
+from unittest import TestCase, skipUnless
+import json
+import os
+import tempfile
+
+from pytezos import ContractInterface
+
+from constants import *
+from helpers import *
+
+from initial_storage import BUILD_DIR, load_dex, load_storage
+from dex_model import DexModel
+from stable_math import Constants, d_cache
+from model_fixtures import model_storage
+from chain_profile import ChainProfiler
+from bench_gas import METRICS, compare, diff_bytes, load_baseline, model_iterations, run, save_baseline, scenario
+
+# writes its parameter under key 1 of a big_map
+BIG_MAP_SET = """
+parameter nat;
+storage (big_map nat nat);
+code { UNPAIR; SOME; PUSH nat 1; UPDATE; NIL operation; PAIR }
+"""
+
+class BenchGasTest(TestCase):
+
+    def test_diff_bytes(self):
+        contract = ContractInterface.from_michelson(BIG_MAP_SET)
+        profiler = ChainProfiler()
+        profiler.interpret(contract.default(5), {}, 0, 0, 0, None)
+        # key and value both forge to a tag and a single byte
+        self.assertEqual(diff_bytes(profiler.last_run["lazy_diff"]), 4)
+        profiler.interpret(contract.default(10**30), {}, 0, 0, 0, None)
+        self.assertGreater(diff_bytes(profiler.last_run["lazy_diff"]), 4)
+        self.assertEqual(diff_bytes([]), 0)
+
+    def test_model_iterations(self):
+        maxsize = d_cache.maxsize
+        model = DexModel(model_storage())
+        counts = {}
+        for make in scenario(3, 10**12):
+            step = make(model.storage)
+            if step.entrypoint == "ramp_A":
+                model.now = Constants.min_ramp_time
+            counts.setdefault(step.entrypoint, model_iterations(model, step))
+
+        # swaps solve D once and then y, admin entrypoints solve nothing
+        self.assertGreater(counts["swap"]["get_D"], 0)
+        self.assertGreater(counts["swap"]["calc_y"], 0)
+        self.assertEqual(counts["invest"]["calc_y"], 0)
+        for entrypoint in ("stake", "set_fees", "ramp_A", "stop_ramp_A"):
+            self.assertEqual(counts[entrypoint], {"get_D": 0, "calc_y": 0})
+        self.assertEqual(d_cache.maxsize, maxsize)
+
+    def test_model_iterations_ignore_the_cache(self):
+        model = DexModel(model_storage())
+        steps = scenario(2, 10**9)
+        for make in steps[:2]:
+            model_iterations(model, make(model.storage))
+        swap = steps[3](model.storage)
+        first = model_iterations(DexModel(model.storage), swap)
+        # a warm D cache would answer the second time without iterating
+        self.assertEqual(model_iterations(DexModel(model.storage), swap), first)
+
+    def test_compare(self):
+        baseline = {
+            "thresholds": {"steps": 0.1},
+            "results": {"swap/2/1e6": {"steps": 100, "get_D": 2, "calc_y": 6, "diff_bytes": 50, "storage_bytes": 10}},
+        }
+        same = {"swap/2/1e6": dict(baseline["results"]["swap/2/1e6"])}
+        self.assertEqual(compare(same, baseline), ([], []))
+
+        worse = {
+            "swap/2/1e6": dict(same["swap/2/1e6"], steps=110, calc_y=7, diff_bytes=40),
+            "swap/3/1e6": same["swap/2/1e6"],
+        }
+        regressions, missing = compare(worse, baseline)
+        # 10% more steps is within the threshold, one more iteration is not
+        self.assertEqual(regressions, [("swap/2/1e6", "calc_y", 6, 7)])
+        self.assertEqual(missing, ["swap/3/1e6"])
+
+        worse["swap/2/1e6"]["steps"] = 111
+        regressions, _ = compare(worse, baseline)
+        self.assertIn(("swap/2/1e6", "steps", 100, 111), regressions)
+
+    def test_baseline_roundtrip(self):
+        results = {"invest/2/1e6": {metric: 1 for metric in METRICS}}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            save_baseline(results, path)
+            baseline = load_baseline(path)
+            with open(path) as f:
+                self.assertEqual(json.load(f), baseline)
+        self.assertEqual(baseline["results"], results)
+        self.assertEqual(compare(results, baseline), ([], []))
+
+@skipUnless(os.path.exists(os.path.join(BUILD_DIR, "dex.json")), "needs the contract compiled into build/")
+class BenchGasChainTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dex = load_dex()
+        cls.storage = load_storage()
+        cls.storage["storage"]["admin"] = admin
+
+    def test_run(self):
+        results = run(self.dex, self.storage, widths=(2, 3), magnitudes=(12,))
+        for width in (2, 3):
+            for entrypoint in ("add_pool", "invest", "swap", "swap_2", "divest_imbalanced", "divest_one_coin", "stake", "divest", "ramp_A"):
+                self.assertEqual(set(results[f"{entrypoint}/{width}/1e12"]), set(METRICS))
+            self.assertGreater(results[f"swap/{width}/1e12"]["steps"], 0)
+        # a wider pool costs more to swap in
+        self.assertGreater(results["swap/3/1e12"]["steps"], results["swap/2/1e12"]["steps"])
+        self.assertGreater(results["add_pool/3/1e12"]["diff_bytes"], results["add_pool/2/1e12"]["diff_bytes"])
@@ -0,0 +1,99 @@
+from unittest import TestCase
+import os
+import pstats
+import tempfile
+
+from pytezos import ContractInterface
+from pytezos.michelson.micheline import MichelsonRuntimeError
+
+from helpers import *
+
+from chain_profile import PHASES, ChainProfiler
+
+# a counter with the storage laid out the way LocalChain expects the dex's
+COUNTER = """
+parameter (or (nat %add) (or (unit %reset) (unit %fail)));
+storage (pair (pair %storage (map %pools nat nat) (nat %total)) (nat %version));
+code { UNPAIR;
+       IF_LEFT { SWAP; UNPAIR; UNPAIR; DIG 3; DIG 2; ADD; SWAP; PAIR; PAIR }
+               { IF_LEFT { DROP; UNPAIR; CAR; PUSH nat 0; SWAP; PAIR; PAIR } { PUSH string "nope"; FAILWITH } };
+       NIL operation; PAIR }
+"""
+
+def counter(total):
+    return {"storage": {"pools": {}, "total": total}, "version": 0}
+
+def total(storage):
+    return storage["storage"]["total"]
+
+class ChainProfileTest(TestCase):
+
+    def setUp(self):
+        self.contract = ContractInterface.from_michelson(COUNTER)
+        self.profiler = ChainProfiler()
+
+    def test_same_results(self):
+        plain = LocalChain(storage=counter(1))
+        profiled = LocalChain(storage=counter(1), profiler=self.profiler)
+        for chain in (plain, profiled):
+            chain.execute(self.contract.add(5))
+            chain.execute(self.contract.add(7))
+        self.assertEqual(plain.storage, counter(13))
+        self.assertEqual(profiled.storage, counter(13))
+        self.assertEqual(total(profiled.interpret(self.contract.reset()).storage), 0)
+        self.assertEqual(total(profiled.storage), 13)
+
+    def test_phases(self):
+        dex = self.profiler.wrap(self.contract)
+        chain = LocalChain(storage=counter(1), profiler=self.profiler)
+        for _ in range(3):
+            chain.execute(dex.add(1))
+        chain.interpret(dex.reset())
+
+        stats = {(row.entrypoint, row.phase): row for row in self.profiler.summary()}
+        self.assertEqual({phase for entrypoint, phase in stats if entrypoint == "add"}, set(PHASES))
+        self.assertEqual({phase for entrypoint, phase in stats if entrypoint == "reset"}, set(PHASES) - {"bookkeeping"})
+        for phase in PHASES:
+            self.assertEqual(stats["add", phase].calls, 3)
+            self.assertGreater(stats["add", phase].seconds, 0)
+        self.assertIn("bookkeeping", self.profiler.table())
+
+        self.profiler.reset()
+        self.assertEqual(self.profiler.summary(), [])
+
+    def test_fork_keeps_profiler(self):
+        chain = LocalChain(storage=counter(1), profiler=self.profiler)
+        fork = chain.fork()
+        fork.execute(self.contract.add(1))
+        self.assertEqual(total(fork.storage), 2)
+        self.assertEqual(total(chain.storage), 1)
+        self.assertTrue(self.profiler.summary())
+
+    def test_errors(self):
+        chain = LocalChain(storage=counter(1), profiler=self.profiler)
+        with self.assertRaises(MichelsonRuntimeError):
+            chain.execute(self.contract.fail())
+        self.assertEqual(total(chain.storage), 1)
+
+    def test_exports(self):
+        profiler = ChainProfiler(cprofile=True, trace_memory=True)
+        chain = LocalChain(storage=counter(1), profiler=profiler)
+        chain.execute(self.contract.add(1))
+        chain.execute(self.contract.reset())
+        self.assertTrue(all(row.peak >= 0 for row in profiler.summary()))
+        with tempfile.TemporaryDirectory() as tmp:
+            folded = os.path.join(tmp, "chain.folded")
+            profiler.write_collapsed(folded)
+            with open(folded) as f:
+                lines = f.read().splitlines()
+            self.assertIn("chain;add;run", [line.rsplit(" ", 1)[0] for line in lines])
+            for line in lines:
+                self.assertTrue(line.rsplit(" ", 1)[1].isdigit())
+
+            for entrypoint in ("add", None):
+                path = os.path.join(tmp, "chain.prof")
+                profiler.dump_stats(path, entrypoint)
+                self.assertTrue(pstats.Stats(path).total_calls > 0)
+
+        with self.assertRaises(RuntimeError):
+            self.profiler.dump_stats("unused.prof")
@@ -0,0 +1,102 @@
+from unittest import TestCase
+from constants import *
+
+from helpers import *
+
+from dex_model import DexModel, pack_tokens, token_value
+from model_fixtures import model_storage, no_fees, swap
+from stable_math import ContractError, Errors
+
+# the expected numbers are the ones the interpreter tests assert for the same scenarios
+class DexModelTest(TestCase):
+
+    def add_pool(self, reserves, tokens=(token_a, token_b, token_c)):
+        model = DexModel(model_storage())
+        model.execute("add_pool", dict(a_constant=A_CONST, input_tokens=list(tokens[:len(reserves)]), tokens_info=equal_pool_rates(reserves), fees=no_fees), sender=admin)
+        return model
+
+    def test_add_pool(self):
+        model = self.add_pool([100_000, 100_000])
+        s = model.storage["storage"]
+        self.assertEqual(s["pools_count"], 1)
+        self.assertEqual(s["tokens"][0], {0: token_value(token_a), 1: token_value(token_b)})
+        self.assertEqual(s["pool_to_id"], {pack_tokens(s["tokens"][0]): 0})
+        self.assertEqual(s["ledger"][(admin, 0)], 200_000)
+
+        with self.assertRaises(ContractError) as ctx:
+            model.execute("add_pool", dict(a_constant=A_CONST, input_tokens=[token_b, token_a], tokens_info=equal_pool_rates([1, 1]), fees=no_fees), sender=admin)
+        self.assertEqual(ctx.exception.error, Errors.Dex.pool_listed)
+
+    def test_storage_untouched_on_failure(self):
+        model = self.add_pool([100, 100])
+        storage = model.storage
+        with self.assertRaises(ContractError):
+            model.execute("swap", dict(swap(0, 1, 10), min_amount_out=10**6))
+        self.assertIs(model.storage, storage)
+
+    def test_threeway_pool_one_coin_divest(self):
+        model = self.add_pool([100_000, 100_000, 100_000])
+        model.execute("set_fees", dict(pool_id=0, fee=fees), sender=admin)
+        all_shares = model.storage["storage"]["ledger"][(admin, 0)]
+
+        with self.assertRaises(ContractError):
+            model.execute("divest_one_coin", dict(pool_id=0, shares=all_shares, token_index=0, min_amount_out=1, deadline=1, receiver=None, referral=None), sender=admin)
+
+        transfers = model.execute("divest_one_coin", dict(pool_id=0, shares=all_shares - 3, token_index=0, min_amount_out=1, deadline=1, receiver=None, referral=None), sender=admin)
+        self.assertEqual(len(transfers), 1)
+        self.assertAlmostEqual(transfers[0][4], 100_000, delta=1)
+        self.assertEqual(model.storage["storage"]["ledger"][(admin, 0)], 3)
+
+        transfers = model.execute("swap", swap(0, 2, 100))
+        self.assertEqual(transfers[0][4], 100)
+        self.assertAlmostEqual(transfers[1][4], 1900, delta=300)
+
+    def test_staking_rewards(self):
+        model = self.add_pool([100_000_000, 100_000_000])
+        model.execute("set_fees", dict(pool_id=0, fee=fees), sender=admin)
+        model.execute("stake", {"add": {"pool_id": 0, "amount": 20}})
+        model.execute("swap", swap(0, 1, 1_000_000))
+
+        transfers = model.execute("stake", {"remove": {"pool_id": 0, "amount": 10}})
+        self.assertEqual(transfers, [
+            (quipu_token, 0, contract_self_address, me, 10),
+            (token_b_address, None, contract_self_address, me, 19),
+        ])
+
+        # unstaking the rest produces no more rewards
+        transfers = model.execute("stake", {"remove": {"pool_id": 0, "amount": 10}})
+        self.assertEqual(transfers, [(quipu_token, 0, contract_self_address, me, 10)])
+
+    def test_multiple_small_invests(self):
+        for ratio in [1, 0.01, 100]:
+            token_b_amount = int(100 * ratio)
+            model = self.add_pool([100, token_b_amount])
+            for i in range(3):
+                model.execute("invest", dict(pool_id=0, shares=1, in_amounts={0: 100, 1: token_b_amount}, deadline=1, receiver=None, referral=None))
+
+            all_shares = model.storage["storage"]["ledger"][(me, 0)]
+            transfers = model.execute("divest", dict(pool_id=0, min_amounts_out={0: 1, 1: 1}, shares=all_shares - 1, deadline=1, receiver=None))
+            self.assertAlmostEqual(transfers[0][4], int(300 * ratio), delta=1)
+            self.assertAlmostEqual(transfers[1][4], 300, delta=1)
+
+    def test_ramp_a(self):
+        model = self.add_pool([1_000_000, 1_000_000])
+        model.now += MIN_RAMP_TIME
+        quote = lambda: model.interpret("swap", dict(swap(1, 0, 1_000_000), deadline=FAR_FUTURE))[1][4]
+        pre_ramp_amount = quote()
+
+        with self.assertRaises(ContractError) as ctx:
+            model.execute("ramp_A", dict(pool_id=0, future_A=A_CONST // 100, future_time=MIN_RAMP_TIME * 2 + 1), sender=alice)
+        self.assertEqual(ctx.exception.error, Errors.Dex.not_contract_admin)
+        with self.assertRaises(ContractError) as ctx:
+            model.execute("ramp_A", dict(pool_id=0, future_A=A_CONST // 100, future_time=MIN_RAMP_TIME + 1), sender=admin)
+        self.assertEqual(ctx.exception.error, Errors.Dex.timestamp_error)
+
+        model.execute("ramp_A", dict(pool_id=0, future_A=A_CONST // 10, future_time=MIN_RAMP_TIME * 2 + 1), sender=admin)
+        model.now += MIN_RAMP_TIME // 2
+        half_ramp_amount = quote()
+        self.assertGreater(pre_ramp_amount, half_ramp_amount)
+
+        model.execute("stop_ramp_A", 0, sender=admin)
+        model.now += MIN_RAMP_TIME
+        self.assertEqual(quote(), half_ramp_amount)
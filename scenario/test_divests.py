@@ -8,7 +8,7 @@ from constants import *
 from helpers import *
 
 from pytezos import ContractInterface, MichelsonRuntimeError
-from initial_storage import admin_lambdas, dex_lambdas, token_lambdas
+from initial_storage import load_dex, load_storage
 
 class DivestsTest(TestCase):
 
@@ -16,15 +16,9 @@ class DivestsTest(TestCase):
     def setUpClass(cls):
         cls.maxDiff = None
 
-        text = open("./build/dex.json").read()
-        code = json.loads(text)
+        cls.dex = load_dex()
 
-        cls.dex = ContractInterface.from_micheline(code["michelson"])
-
-        storage = cls.dex.storage.dummy()
-        storage["token_lambdas"] = token_lambdas
-        storage["dex_lambdas"] = dex_lambdas
-        storage["admin_lambdas"] = admin_lambdas
+        storage = load_storage()
         storage["storage"]["admin"] = admin 
 
         cls.init_storage = storage
@@ -0,0 +1,78 @@
+from unittest import TestCase
+import random
+from constants import *
+
+from helpers import *
+
+from dex_model import DexModel
+from exact_out import get_dx
+from stable_math import ContractError, Errors
+from model_fixtures import model_storage, priced_model
+from views import get_dy
+
+class ExactOutTest(TestCase):
+
+    def check(self, storage, i, j, dy, now=0):
+        dx, steps = get_dx(storage, 0, i, j, dy, now=now, return_steps=True)
+        self.assertGreaterEqual(get_dy(storage, 0, i, j, dx, now), dy)
+        if dx > 1:
+            self.assertLess(get_dy(storage, 0, i, j, dx - 1, now), dy)
+        return dx, steps
+
+    def test_minimal(self):
+        rng = random.Random(7)
+        models = [
+            priced_model([10**9, 10**9]),
+            priced_model([10**9, 3 * 10**9], a_constant=10),
+            # token 1 is worth 10**12 units of the others
+            priced_model([3 * 10**20, 10**8, 2 * 10**20], rates={1: 10**30}, a_constant=100),
+        ]
+        for model in models:
+            pool = model.storage["storage"]["pools"][0]
+            tokens_count = len(pool["tokens_info"])
+            for _ in range(50):
+                i, j = rng.sample(range(tokens_count), 2)
+                reserves = pool["tokens_info"][j]["reserves"]
+                _, steps = self.check(model.storage, i, j, rng.randint(1, reserves * 9 // 10))
+                self.assertLessEqual(steps, 4)
+
+    def test_small(self):
+        model = priced_model([10**9, 10**9])
+        for dy in range(1, 20):
+            self.check(model.storage, 0, 1, dy)
+
+    def test_swap(self):
+        model = priced_model([10**9, 2 * 10**9])
+        dy = 10**8
+        dx = get_dx(model.storage, 0, 0, 1, dy)
+        transfers = model.execute("swap", dict(pool_id=0, idx_from=0, idx_to=1, amount=dx, min_amount_out=dy, deadline=0, receiver=None, referral=None), alice)
+        self.assertGreaterEqual(transfers[1][4], dy)
+
+    def test_ramp(self):
+        model = priced_model([10**9, 3 * 10**9], a_constant=10)
+        model.now = MIN_RAMP_TIME
+        model.execute("ramp_A", dict(pool_id=0, future_A=100, future_time=3 * MIN_RAMP_TIME), admin)
+        dx_now, _ = self.check(model.storage, 0, 1, 10**8, now=MIN_RAMP_TIME)
+        dx_later, _ = self.check(model.storage, 0, 1, 10**8, now=2 * MIN_RAMP_TIME)
+        # token 0 is the scarce one, a flatter curve sells it for less
+        self.assertGreater(dx_later, dx_now)
+
+    def test_unreachable(self):
+        model = priced_model([10**9, 10**9])
+        reserves = model.storage["storage"]["pools"][0]["tokens_info"][1]["reserves"]
+        for dy in [reserves, reserves - 1]:
+            with self.assertRaises(ContractError) as ctx:
+                get_dx(model.storage, 0, 0, 1, dy)
+            self.assertEqual(ctx.exception.error, Errors.Dex.low_reserves)
+        self.check(model.storage, 0, 1, reserves * 99 // 100)
+
+    def test_errors(self):
+        model = priced_model([10**9, 10**9])
+        for pool_id, i, j, dy, error in [
+            (1, 0, 1, 10, Errors.Dex.pool_not_listed),
+            (0, 0, 2, 10, Errors.Dex.wrong_index),
+            (0, 0, 1, 0, Errors.Dex.zero_min_out),
+        ]:
+            with self.assertRaises(ContractError) as ctx:
+                get_dx(model.storage, pool_id, i, j, dy)
+            self.assertEqual(ctx.exception.error, error)
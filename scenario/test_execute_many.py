@@ -0,0 +1,136 @@
+from unittest import TestCase
+
+from pytezos import ContractInterface
+from pytezos.michelson.micheline import MichelsonRuntimeError
+
+from helpers import *
+
+from chain_profile import ChainProfiler
+from native_storage import LazyBigMap
+from test_native_storage import CLOSING, POOLS, closing_storage, plain, plain_closing, pools_storage
+
+# keeps the balance it saw on deposits, pays withdrawals back to the sender
+BANK = """
+parameter (or (unit %deposit) (or (mutez %withdraw) (unit %fail)));
+storage (pair (pair %storage (map %pools nat nat) (mutez %seen)) (nat %version));
+code { UNPAIR;
+       IF_LEFT { DROP; UNPAIR; CAR; BALANCE; SWAP; PAIR; PAIR; NIL operation; PAIR }
+               { IF_LEFT { SENDER; CONTRACT unit; IF_NONE { PUSH string "no-contract"; FAILWITH } {};
+                           SWAP; UNIT; TRANSFER_TOKENS; NIL operation; SWAP; CONS; PAIR }
+                         { PUSH string "nope"; FAILWITH } } }
+"""
+
+def bank_storage():
+    return {"storage": {"pools": {}, "seen": 0}, "version": 0}
+
+class ExecuteManyTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bank = ContractInterface.from_michelson(BANK)
+        cls.pools = ContractInterface.from_michelson(POOLS)
+
+    def bank_calls(self):
+        return [
+            (self.bank.deposit(), 100, alice),
+            (self.bank.withdraw(30), 0, bob),
+            (self.bank.deposit(), 5, carol),
+            (self.bank.withdraw(20), 0, alice),
+        ]
+
+    def pools_calls(self):
+        return [(self.pools.default((key % 4, key)), 0, [alice, bob][key % 2]) for key in range(8)]
+
+    def one_by_one(self, chain, calls):
+        for call, amount, sender in calls:
+            chain.execute(call, amount=amount, sender=sender)
+        return chain
+
+    def test_same_as_execute(self):
+        for native in (False, True):
+            expected = self.one_by_one(LocalChain(bank_storage()), self.bank_calls())
+            chain = LocalChain(bank_storage(), native=native)
+            executed = chain.execute_many(self.bank_calls())
+            self.assertEqual([e.error for e in executed], [None] * 4)
+            self.assertEqual(chain.storage, expected.storage)
+            # the second deposit saw the 30 the withdrawal took out
+            self.assertEqual(chain.storage["storage"]["seen"], 75)
+            self.assertEqual(chain.balance, expected.balance)
+            self.assertEqual(chain.ledger.balances, expected.ledger.balances)
+            self.assertEqual(chain.payouts, expected.payouts)
+            self.assertEqual(chain.last_res.operations, expected.last_res.operations)
+            self.assertEqual(parse_ops(executed[1].res), [{"type": "tez", "destination": bob, "amount": 30, "source": contract_self_address}])
+
+    def test_big_maps(self):
+        expected = self.one_by_one(LocalChain(pools_storage()), self.pools_calls())
+
+        chain = LocalChain(pools_storage())
+        # calls are taken from a generator as they come
+        chain.execute_many(call for call in self.pools_calls())
+        self.assertEqual(chain.storage, expected.storage)
+        self.assertIsInstance(chain.storage["storage"]["pools"], dict)
+        # and the chain carries on with plain execute
+        self.one_by_one(chain, self.pools_calls()[:2])
+        self.one_by_one(expected, self.pools_calls()[:2])
+        self.assertEqual(chain.storage, expected.storage)
+
+        native = LocalChain(pools_storage(), native=True)
+        native.execute_many(self.pools_calls())
+        native.execute_many(self.pools_calls()[:2])
+        self.assertIsInstance(native.storage["storage"]["pools"], LazyBigMap)
+        self.assertEqual(plain(native.storage), expected.storage)
+
+    def test_close(self):
+        closing = ContractInterface.from_michelson(CLOSING)
+        calls = [(closing.enter(), 0, sender) for sender in (alice, bob, carol)]
+        expected = self.one_by_one(LocalChain(closing_storage()), calls)
+        chain = LocalChain(closing_storage(), native=True)
+        # every enter finds the flag the previous call's callback cleared
+        executed = chain.execute_many(calls)
+        self.assertEqual([e.error for e in executed], [None] * 3)
+        self.assertIsNone(chain._storage)
+        self.assertEqual(plain_closing(chain.storage), expected.storage)
+        self.assertEqual(chain.storage["storage"]["calls"], 3)
+
+    def test_stop_on_error(self):
+        calls = self.bank_calls()
+        calls.insert(2, (self.bank.fail(), 50, bob))
+        chain = LocalChain(bank_storage())
+        executed = chain.execute_many(calls)
+        self.assertEqual(len(executed), 3)
+        self.assertIsNone(executed[2].res)
+        self.assertIsInstance(executed[2].error, MichelsonRuntimeError)
+        self.assertIn("nope", str(executed[2].error))
+        expected = self.one_by_one(LocalChain(bank_storage()), calls[:2])
+        self.assertEqual(chain.storage, expected.storage)
+        self.assertEqual(chain.balance, 70)
+        self.assertEqual(chain.ledger.balances, expected.ledger.balances)
+
+    def test_continue_on_error(self):
+        calls = self.bank_calls()
+        calls.insert(2, (self.bank.fail(), 50, bob))
+        chain = LocalChain(bank_storage(), native=True)
+        executed = chain.execute_many(calls, stop_on_error=False)
+        self.assertEqual([e.error is None for e in executed], [True, True, False, True, True])
+        # the failed call moved no tez
+        expected = self.one_by_one(LocalChain(bank_storage()), self.bank_calls())
+        self.assertEqual(chain.storage, expected.storage)
+        self.assertEqual(chain.balance, expected.balance)
+        self.assertEqual(chain.ledger.balances, expected.ledger.balances)
+
+    def test_nothing_run(self):
+        chain = LocalChain(bank_storage())
+        self.assertEqual(chain.execute_many([]), [])
+        executed = chain.execute_many([(self.bank.fail(), 10, alice)])
+        self.assertEqual(len(executed), 1)
+        self.assertEqual(chain.storage, bank_storage())
+        self.assertEqual((chain.balance, chain.last_res), (0, None))
+
+    def test_profiled(self):
+        profiler = ChainProfiler()
+        chain = LocalChain(bank_storage(), profiler=profiler)
+        chain.execute_many(self.bank_calls())
+        calls = {(row.entrypoint, row.phase): row.calls for row in profiler.summary()}
+        self.assertEqual(calls[("deposit", "run")], 2)
+        self.assertEqual(calls[("withdraw", "bookkeeping")], 2)
+        self.assertEqual(chain.storage["storage"]["seen"], 75)
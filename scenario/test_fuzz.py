@@ -0,0 +1,55 @@
+import os
+from unittest import TestCase, skipUnless
+from constants import *
+
+from helpers import *
+
+from initial_storage import BUILD_DIR, load_dex, load_storage
+from dex_model import DexModel
+from fuzz import ChainRunner, ModelRunner, differential, fuzz, random_sequence
+from model_fixtures import model_storage
+
+import random
+
+class LeakyModel(DexModel):
+    """ credits an extra share on big one coin divests while someone is staking """
+    def _divest_one_coin(self, s, params, sender, transfers):
+        super()._divest_one_coin(s, params, sender, transfers)
+        if params["shares"] > 1000 and s["pools"][params["pool_id"]]["staker_accumulator"]["total_staked"] > 0:
+            self._add(s, "ledger", (sender, params["pool_id"]), 1)
+
+class FuzzPureTest(TestCase):
+
+    def test_model_agrees_with_itself(self):
+        storage = model_storage()
+        steps = random_sequence(random.Random(1), storage, 50)
+        self.assertIsNone(differential(steps, lambda: ModelRunner(storage), lambda: ModelRunner(storage)))
+
+    def test_finds_and_shrinks(self):
+        storage = model_storage()
+        found = next(fuzz(storage, lambda: ModelRunner(storage), lambda: ModelRunner(storage, LeakyModel), iterations=300, length=25, seed=3))
+
+        self.assertEqual(found.what, "ledger")
+        self.assertEqual(found.index, len(found.steps) - 1)
+        self.assertEqual(found.steps[-1].entrypoint, "divest_one_coin")
+        self.assertIn("stake", [step.entrypoint for step in found.steps])
+        self.assertLessEqual(len(found.steps), 5)
+
+@skipUnless(os.path.exists(os.path.join(BUILD_DIR, "dex.json")), "needs the contract compiled into build/")
+class FuzzTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.maxDiff = None
+
+        cls.dex = load_dex()
+
+        storage = load_storage()
+        storage["storage"]["admin"] = admin
+
+        cls.init_storage = storage
+
+    def test_model_matches_interpreter(self):
+        storage = self.init_storage
+        found = list(fuzz(storage, lambda: ChainRunner(self.dex, storage), iterations=30, length=15, seed=7))
+        self.assertEqual(found, [])
@@ -0,0 +1,84 @@
+from unittest import TestCase
+import json
+import os
+import tempfile
+from constants import *
+
+from helpers import *
+
+from dex_model import DexModel
+from generate_graphs import (
+    Chart, RenderPool, fee_accrual, invest_vs_divest, price_impact,
+    slippage_point, slippage_vs_a,
+)
+from simulate import ModelBackend, simulate
+from sweep import SweepResult, run_sweep
+from model_fixtures import model_storage, schedule
+
+def dump_chart(chart, path):
+    with open(path, "w") as f:
+        json.dump(chart._asdict(), f)
+    return path
+
+class GraphsTest(TestCase):
+
+    def test_slippage_point(self):
+        reserves = [10**9, 10**9]
+        small = slippage_point(reserves, 100, 10**6)
+        large = slippage_point(reserves, 100, 10**8)
+        self.assertGreaterEqual(small, 0)
+        self.assertGreater(large, small)
+        # a higher A flattens the curve
+        self.assertLess(slippage_point(reserves, 10_000, 10**8), large)
+
+    def test_slippage_vs_a(self):
+        grid = {"reserves": [[10**9, 10**9]], "a_constant": [10, 100, 1_000], "amount": [10**7, 10**8]}
+        chart = slippage_vs_a(run_sweep(slippage_point, grid, max_workers=1, preload=False))
+        self.assertTrue(chart.log_x)
+        self.assertEqual(len(chart.series), 2)
+        for label, xs, ys in chart.series:
+            self.assertEqual(xs, [10, 100, 1_000])
+            self.assertEqual(ys, sorted(ys, reverse=True))
+
+    def test_invest_vs_divest(self):
+        results = [SweepResult({"invested_a": x}, x - 10, None) for x in (300, 100, 200)]
+        chart = invest_vs_divest(results)
+        label, xs, ys = chart.series[0]
+        self.assertEqual(xs, [100, 200, 300])
+        self.assertEqual(ys, [90, 190, 290])
+        self.assertEqual(chart.xlim, chart.ylim)
+
+        results.append(SweepResult({"invested_a": 400}, None, "ContractError: 'boom'"))
+        with self.assertRaises(RuntimeError):
+            invest_vs_divest(results)
+
+    def test_price_impact(self):
+        model = DexModel(model_storage())
+        model.execute("add_pool", dict(a_constant=A_CONST, input_tokens=[token_a, token_b], tokens_info=equal_pool_rates([10**9, 10**9]), fees=fees), admin)
+        chart = price_impact(model.storage)
+        label, xs, ys = chart.series[0]
+        self.assertGreater(len(xs), 10)
+        self.assertEqual(ys, sorted(ys))
+        # fees alone take something off the smallest trade
+        self.assertGreater(ys[0], 0)
+
+    def test_fee_accrual(self):
+        rows = list(simulate(ModelBackend(model_storage()), schedule(), 50, every=10))
+        chart = fee_accrual(rows)
+        series = dict((label, (xs, ys)) for label, xs, ys in chart.series)
+        self.assertEqual(set(series), {"virtual price", "staker fees 0", "staker fees 1"})
+        xs, ys = series["virtual price"]
+        self.assertEqual(xs, [0, 10, 20, 30, 40, 49])
+        self.assertEqual(ys[0], 0)
+        self.assertGreater(ys[-1], 0)
+        self.assertEqual(fee_accrual(rows, pool_id=1).series, [])
+
+    def test_render_pool(self):
+        chart = Chart("title", "x", "y", [("line", [1, 2], [3, 4])])
+        with tempfile.TemporaryDirectory() as tmp:
+            with RenderPool(tmp, max_workers=2, renderer=dump_chart) as pool:
+                paths = [pool.submit(chart, f"chart_{k}") for k in range(3)]
+                self.assertEqual(pool.wait(), paths)
+            for path in paths:
+                with open(path) as f:
+                    self.assertEqual(json.load(f)["series"], [["line", [1, 2], [3, 4]]])
@@ -0,0 +1,85 @@
+from unittest import TestCase
+from types import SimpleNamespace
+
+from helpers import *
+
+token_address = "KT1RJ6PbjHpwc3M5rw5s2Nbmefwbuwbdxton"
+
+def tez_op(destination, amount):
+    return {
+        "kind": "transaction",
+        "source": contract_self_address,
+        "destination": destination,
+        "amount": str(amount),
+        "parameters": { "entrypoint": "default", "value": {"prim": "Unit"} },
+    }
+
+def fa12_op(destination, amount):
+    return {
+        "kind": "transaction",
+        "source": contract_self_address,
+        "destination": token_address,
+        "amount": "0",
+        "parameters": {
+            "entrypoint": "transfer",
+            "value": { "prim": "Pair", "args": [{"string": contract_self_address}, {"string": destination}, {"int": str(amount)}] },
+        },
+    }
+
+def fa2_op(transfers, source=contract_self_address):
+    return {
+        "kind": "transaction",
+        "source": contract_self_address,
+        "destination": token_address,
+        "amount": "0",
+        "parameters": {
+            "entrypoint": "transfer",
+            "value": [{ "prim": "Pair", "args": [
+                {"string": source},
+                [{ "prim": "Pair", "args": [{"string": dest}, {"int": str(token_id)}, {"int": str(amount)}] } for dest, token_id, amount in transfers],
+            ]}],
+        },
+    }
+
+def close_op():
+    return {
+        "kind": "transaction",
+        "source": contract_self_address,
+        "destination": contract_self_address,
+        "amount": "0",
+        "parameters": { "entrypoint": "close", "value": {"prim": "Unit"} },
+    }
+
+class ParseOpsTest(TestCase):
+
+    def setUp(self):
+        self.res = SimpleNamespace(operations=[
+            tez_op(alice, 5),
+            fa12_op(bob, 7),
+            fa2_op([(alice, 1, 10), (bob, 2, 20)]),
+            close_op(),
+        ])
+
+    def test_reads_like_dicts(self):
+        ops = parse_ops(self.res)
+        self.assertEqual(len(ops), 5)
+        self.assertEqual(ops[0], {"type": "tez", "destination": alice, "amount": 5, "source": contract_self_address})
+        self.assertEqual(ops[1]["amount"], 7)
+        self.assertNotIn("token_id", ops[1])
+        self.assertEqual(ops[3]["token_id"], 2)
+        self.assertEqual(ops[3]["token_address"], token_address)
+        self.assertEqual(ops[4]["type"], "close")
+
+        transfers = parse_transfers(self.res)
+        self.assertEqual(sum(tx["amount"] for tx in transfers), 37)
+        self.assertEqual(next(tx for tx in transfers if tx["destination"] == bob)["amount"], 7)
+
+    def test_decoded_on_access(self):
+        ops = parse_ops(SimpleNamespace(operations=[{"kind": "transaction"}]))
+        with self.assertRaises(KeyError):
+            len(ops)
+
+    def test_scan_matches_records(self):
+        scanned = list(scan_balance_changes(self.res.operations))
+        records = [(op.type, op.get("token_address"), op.get("token_id"), op.get("source"), op.get("destination"), op.get("amount")) for op in parse_ops(self.res)]
+        self.assertEqual(scanned, records)
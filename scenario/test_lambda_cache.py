@@ -0,0 +1,117 @@
+from unittest import TestCase
+
+from pytezos import ContractInterface
+from pytezos.michelson.micheline import MichelsonRuntimeError
+from pytezos.michelson.parse import michelson_to_micheline
+from pytezos.michelson.types import MichelsonType
+from pytezos.michelson.types.domain import LambdaType
+
+from helpers import *
+
+from lambda_cache import LambdaCache
+
+# runs the packed lambda stored under the parameter's key on the parameter,
+# adding the result to the version, the way the dex dispatches its entrypoints
+DISPATCH = """
+parameter nat;
+storage (pair (pair %storage (map %pools nat nat) (big_map %lambdas nat bytes)) (nat %version));
+code { UNPAIR; SWAP; UNPAIR; DUP; CDR; DUP 4; GET; IF_NONE { PUSH string "no-lambda"; FAILWITH } {};
+       UNPACK (lambda nat nat); IF_NONE { PUSH string "not-a-lambda"; FAILWITH } {};
+       DIG 3; EXEC; DIG 2; ADD; SWAP; PAIR; NIL operation; PAIR }
+"""
+
+LAMBDA_TYPE = MichelsonType.match(michelson_to_micheline("lambda nat nat"))
+
+def pack(code):
+    return LAMBDA_TYPE.from_python_object(code).pack().hex()
+
+def dispatch_storage():
+    lambdas = {
+        0: pack("{ PUSH nat 1; ADD }"),
+        1: pack("{ PUSH nat 10; MUL }"),
+        # the bytes of a nat, not of a lambda
+        2: "0500" + "2a",
+    }
+    return {"storage": {"pools": {}, "lambdas": lambdas}, "version": 0}
+
+class LambdaCacheTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.contract = ContractInterface.from_michelson(DISPATCH)
+
+    def setUp(self):
+        self.cache = LambdaCache()
+
+    def run_calls(self, chain, calls):
+        for key in calls:
+            chain.execute(self.contract.default(key))
+        return chain.storage["version"]
+
+    def test_same_results(self):
+        calls = [0, 1, 0, 1, 1, 0]
+        plain = self.run_calls(LocalChain(dispatch_storage(), lambda_cache=None), calls)
+        cached = self.run_calls(LocalChain(dispatch_storage(), lambda_cache=self.cache), calls)
+        self.assertEqual(cached, plain)
+        self.assertEqual(cached, 1 + 10 + 1 + 10 + 10 + 1)
+
+    def test_decodes_once(self):
+        chain = LocalChain(dispatch_storage(), lambda_cache=self.cache)
+        self.run_calls(chain, [0, 0, 1, 0, 1])
+        self.assertEqual(len(self.cache.entries), 2)
+        self.assertEqual((self.cache.misses, self.cache.hits), (2, 3))
+        self.assertGreater(self.cache.decode_seconds, 0)
+        self.assertGreater(self.cache.saved_seconds, 0)
+        self.assertIn("2 lambdas decoded", self.cache.report())
+
+        # other chains and forks share what was decoded
+        self.run_calls(chain.fork(), [1])
+        self.run_calls(LocalChain(dispatch_storage(), lambda_cache=self.cache), [0])
+        self.assertEqual((self.cache.misses, self.cache.hits), (2, 5))
+
+        self.cache.clear()
+        self.run_calls(chain, [0])
+        self.assertEqual((self.cache.misses, self.cache.hits), (1, 0))
+
+    def test_not_a_lambda(self):
+        chain = LocalChain(dispatch_storage(), lambda_cache=self.cache)
+        with self.assertRaises(MichelsonRuntimeError) as error:
+            chain.execute(self.contract.default(2))
+        self.assertIn("not-a-lambda", str(error.exception))
+        self.assertEqual(self.cache.entries, {})
+
+    def test_uninstalled_after_calls(self):
+        chain = LocalChain(dispatch_storage(), lambda_cache=self.cache)
+        self.run_calls(chain, [0])
+        with self.assertRaises(MichelsonRuntimeError):
+            chain.execute(self.contract.default(2))
+        self.assertNotIn("unpack", LambdaType.__dict__)
+
+        with self.cache.installed():
+            with self.cache.installed():
+                pass
+            self.assertIn("unpack", LambdaType.__dict__)
+        self.assertNotIn("unpack", LambdaType.__dict__)
+
+    def test_keyed_by_type(self):
+        data = bytes.fromhex(pack("{ PUSH nat 1; ADD }"))
+        int_type = MichelsonType.match(michelson_to_micheline("lambda int int"))
+        self.cache.unpack(LAMBDA_TYPE, data)
+        self.cache.unpack(int_type, data)
+        self.cache.unpack(LAMBDA_TYPE, data)
+        self.assertEqual(len(self.cache.entries), 2)
+        self.assertEqual((self.cache.misses, self.cache.hits), (2, 1))
+
+    def test_nested_caches(self):
+        other = LambdaCache()
+        outer = self.cache.installed()
+        outer.__enter__()
+        with other.installed():
+            self.run_calls(LocalChain(dispatch_storage(), lambda_cache=None), [0])
+            # the outer block is left first, the inner one keeps the patch in place
+            outer.__exit__(None, None, None)
+            self.assertIn("unpack", LambdaType.__dict__)
+            self.run_calls(LocalChain(dispatch_storage(), lambda_cache=None), [1])
+        self.assertNotIn("unpack", LambdaType.__dict__)
+        self.assertEqual((other.misses, self.cache.misses), (2, 0))
+
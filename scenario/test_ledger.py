@@ -0,0 +1,69 @@
+from unittest import TestCase
+from types import SimpleNamespace
+
+from helpers import *
+from ledger import TEZ, BalanceLedger
+from test_helpers import fa2_op, fa12_op, tez_op, token_address
+
+class FakeCall:
+    """ stands in for a pytezos call, returns fixed operations """
+    def __init__(self, operations):
+        self.operations = operations
+
+    def interpret(self, storage, **kwargs):
+        return SimpleNamespace(storage=storage, operations=self.operations)
+
+class LedgerTest(TestCase):
+
+    def test_credit_debit_transfer(self):
+        ledger = BalanceLedger()
+        ledger.credit(token_address, 0, alice, 100)
+        ledger.transfer(token_address, 0, alice, bob, 30)
+        ledger.debit(token_address, 0, bob, 10)
+
+        self.assertEqual(ledger.balance(token_address, 0, alice), 70)
+        self.assertEqual(ledger.balance(token_address, 0, bob), 20)
+        self.assertEqual(ledger.balance(token_address, 1, bob), 0)
+        self.assertEqual(ledger.total(token_address, 0), 90)
+        self.assertEqual(ledger.holders(token_address, 0), {alice: 70, bob: 20})
+        ledger.check_conservation()
+
+        ledger.balances[(token_address, 0, bob)] += 1
+        with self.assertRaises(AssertionError):
+            ledger.check_conservation()
+
+    def test_to_numpy(self):
+        ledger = BalanceLedger()
+        ledger.transfer(token_address, None, alice, bob, 10**30)
+        array = ledger.to_numpy()
+        self.assertEqual(len(array), 2)
+        self.assertEqual(array[array["holder"] == bob]["balance"][0], 10**30)
+        self.assertEqual(array["balance"].sum(), 0)
+
+    def test_copy_is_independent(self):
+        ledger = BalanceLedger()
+        ledger.credit(TEZ, None, alice, 5)
+        copy = ledger.copy()
+        copy.transfer(TEZ, None, alice, bob, 5)
+        self.assertEqual(ledger.holders(TEZ), {alice: 5})
+        copy.check_conservation()
+
+    def test_local_chain_moves_balances(self):
+        chain = LocalChain(storage={"storage": {"pools": {}}})
+        chain.execute(FakeCall([fa2_op([(contract_self_address, 1, 50)], source=alice)]), sender=alice)
+        chain.execute(FakeCall([fa2_op([(alice, 1, 20)]), fa12_op(bob, 3), tez_op(bob, 4)]), amount=10)
+
+        # the contract is debited for what it sends out
+        self.assertEqual(chain.ledger.balance(token_address, 1, contract_self_address), 30)
+        self.assertEqual(chain.ledger.balance(token_address, None, contract_self_address), -3)
+        self.assertEqual(chain.ledger.balance(TEZ, None, contract_self_address), 6)
+        self.assertEqual(chain.balance, 6)
+        # only what was paid out, while the ledger has the net flows
+        self.assertEqual(chain.payouts, {bob: 4})
+        self.assertEqual(chain.contract_balances, {token_address: {contract_self_address: 50, alice: 20, bob: 3}})
+        self.assertEqual(chain.ledger.net_tez(exclude={contract_self_address}), {me: -10, bob: 4})
+        self.assertEqual(chain.ledger.token_balances(), {
+            (token_address, 1): {alice: -30, contract_self_address: 30},
+            (token_address, None): {contract_self_address: -3, bob: 3},
+        })
+        chain.ledger.check_conservation()
@@ -0,0 +1,154 @@
+from unittest import TestCase
+
+from pytezos import ContractInterface
+from pytezos.michelson.micheline import MichelsonRuntimeError
+from pytezos.michelson.parse import michelson_to_micheline
+from pytezos.michelson.types import MichelsonType
+
+from helpers import *
+
+from chain_profile import ChainProfiler
+from native_storage import LazyBigMap, NativeStorage
+
+# sets pools[key] to a pool of lambda 0 applied to the amount, counts the
+# calls of the sender in the ledger and adds the amount to the total
+POOLS = """
+parameter (pair nat nat);
+storage (pair (pair %storage (big_map %pools nat (pair (nat %total) (map %tokens_info nat (pair (nat %reserves) (nat %rate_f)))))
+                             (big_map %ledger address nat)
+                             (nat %total))
+              (big_map %lambdas nat bytes));
+code { UNPAIR; UNPAIR; DIG 2; UNPAIR;
+       DUP 2; PUSH nat 0; GET; IF_NONE { PUSH string "no-lambda"; FAILWITH } {};
+       UNPACK (lambda nat nat); IF_NONE { PUSH string "not-a-lambda"; FAILWITH } {};
+       DUP 5; EXEC;
+       EMPTY_MAP nat (pair nat nat); PUSH nat 1; DUP 3; PAIR; SOME; PUSH nat 0; UPDATE; SWAP; PAIR;
+       SWAP; UNPAIR 3;
+       DIG 3; SOME; DIG 5; UPDATE;
+       SWAP; DUP; SENDER; GET; IF_NONE { PUSH nat 1 } { PUSH nat 1; ADD }; SOME; SENDER; UPDATE;
+       SWAP; DIG 2; DIG 4; ADD; DUG 2;
+       PAIR 3; PAIR; NIL operation; PAIR }
+"""
+
+# enter fails while entered and sets it, calling back %close as the dex does
+CLOSING = """
+parameter (or (unit %enter) (unit %close));
+storage (pair (pair %storage (nat %calls) (bool %entered) (big_map %pools nat nat)) (nat %version));
+code { UNPAIR;
+       IF_LEFT { DROP; UNPAIR; UNPAIR 3; SWAP; IF { PUSH string "reentered"; FAILWITH } {};
+                 PUSH nat 1; ADD; PUSH bool True; SWAP; PAIR 3; PAIR;
+                 SELF %close; PUSH mutez 0; UNIT; TRANSFER_TOKENS; NIL operation; SWAP; CONS; PAIR }
+               { PUSH string "closing"; FAILWITH } }
+"""
+
+def closing_storage():
+    return {"storage": {"calls": 0, "entered": False, "pools": {1: 2}}, "version": 0}
+
+LAMBDA_TYPE = MichelsonType.match(michelson_to_micheline("lambda nat nat"))
+
+def pool(total):
+    return {"total": total, "tokens_info": {0: {"reserves": total, "rate_f": 1}}}
+
+def pools_storage(count=5):
+    lambdas = {key: LAMBDA_TYPE.from_python_object(f"{{ PUSH nat {key + 2}; MUL }}").pack().hex() for key in range(3)}
+    return {"storage": {"pools": {key: pool(key) for key in range(count)}, "ledger": {}, "total": 0}, "lambdas": lambdas}
+
+def plain(storage):
+    """ the storage with every big_map a dict """
+    inner = storage["storage"]
+    return {
+        "storage": {"pools": dict(inner["pools"]), "ledger": dict(inner["ledger"]), "total": inner["total"]},
+        "lambdas": dict(storage["lambdas"]),
+    }
+
+def plain_closing(storage):
+    return dict(storage, storage=dict(storage["storage"], pools=dict(storage["storage"]["pools"])))
+
+CALLS = [(0, 5, alice), (3, 7, bob), (7, 1, alice), (0, 2, carol)]
+
+class NativeStorageTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.contract = ContractInterface.from_michelson(POOLS)
+
+    def run_calls(self, chain, calls=CALLS):
+        for key, amount, sender in calls:
+            chain.execute(self.contract.default((key, amount)), sender=sender)
+        return chain
+
+    def test_same_storage(self):
+        converted = self.run_calls(LocalChain(pools_storage()))
+        native = self.run_calls(LocalChain(pools_storage(), native=True))
+        self.assertEqual(plain(native.storage), converted.storage)
+        self.assertEqual(native.storage["storage"]["total"], 15)
+        self.assertEqual(native.storage["storage"]["pools"][0], pool(4))
+        self.assertEqual(native.storage["storage"]["pools"][7], pool(2))
+        self.assertEqual(native.storage["storage"]["ledger"][alice], 2)
+        self.assertEqual(plain(native.last_res.storage), converted.last_res.storage)
+
+    def test_lazy_big_maps(self):
+        chain = self.run_calls(LocalChain(pools_storage(), native=True))
+        pools = chain.storage["storage"]["pools"]
+        self.assertIsInstance(pools, LazyBigMap)
+        self.assertIsInstance(chain.storage["lambdas"], LazyBigMap)
+        self.assertEqual(len(pools), 6)
+        self.assertEqual(sorted(pools), [0, 1, 2, 3, 4, 7])
+        self.assertIn(3, pools)
+        self.assertNotIn(5, pools)
+        self.assertNotIn("not a nat", pools)
+        self.assertIsNone(pools.get(5))
+        with self.assertRaises(KeyError):
+            pools[5]
+        self.assertEqual(dict(pools.items()), dict(zip(pools, pools.values())))
+        self.assertIsInstance(chain.storage["storage"]["ledger"][bob], int)
+
+    def test_assign_storage(self):
+        chain = self.run_calls(LocalChain(pools_storage(), native=True), CALLS[:2])
+        # views of the big_maps can be put back into a storage
+        chain.storage = dict(chain.storage, storage=dict(chain.storage["storage"], total=100))
+        self.run_calls(chain, CALLS[2:])
+        converted = self.run_calls(LocalChain(pools_storage()))
+        self.assertEqual(chain.storage["storage"]["total"], 103)
+        self.assertEqual(plain(chain.storage)["storage"]["pools"], converted.storage["storage"]["pools"])
+        self.assertEqual(plain(chain.storage)["lambdas"], converted.storage["lambdas"])
+
+    def test_snapshot_and_fork(self):
+        chain = self.run_calls(LocalChain(pools_storage(), native=True), CALLS[:2])
+        snapshot = chain.snapshot()
+        self.assertIsInstance(snapshot["storage"], NativeStorage)
+        fork = chain.fork()
+        self.run_calls(chain, CALLS[2:])
+        self.assertEqual(fork.storage["storage"]["total"], 12)
+        chain.restore(snapshot)
+        self.assertEqual(chain.storage["storage"]["total"], 12)
+        self.assertEqual(plain(self.run_calls(fork, CALLS[2:]).storage), plain(self.run_calls(chain, CALLS[2:]).storage))
+
+    def test_close(self):
+        contract = ContractInterface.from_michelson(CLOSING)
+        converted = LocalChain(closing_storage())
+        native = LocalChain(closing_storage(), native=True)
+        for chain in (converted, native):
+            chain.execute(contract.enter(), sender=alice)
+            chain.execute(contract.enter(), sender=bob)
+        # cleared without decoding the storage
+        self.assertIsNone(native._storage)
+        self.assertEqual(native.storage["storage"]["entered"], False)
+        self.assertEqual(plain_closing(native.storage), converted.storage)
+        self.assertEqual(converted.storage["storage"]["calls"], 2)
+
+    def test_failure_keeps_storage(self):
+        storage = pools_storage()
+        del storage["lambdas"][0]
+        chain = LocalChain(storage, native=True)
+        with self.assertRaises(MichelsonRuntimeError):
+            self.run_calls(chain, CALLS[:1])
+        self.assertEqual(plain(chain.storage), storage)
+
+    def test_profiled(self):
+        profiler = ChainProfiler()
+        chain = self.run_calls(LocalChain(pools_storage(), profiler=profiler, native=True))
+        converted = self.run_calls(LocalChain(pools_storage()))
+        self.assertEqual(plain(chain.storage), converted.storage)
+        self.assertEqual({row.phase for row in profiler.summary()}, {"encode_storage", "run", "decode_storage", "bookkeeping"})
+        self.assertGreater(profiler.last_run["steps"], 0)
@@ -0,0 +1,96 @@
+from unittest import TestCase
+from fractions import Fraction
+import math
+from constants import *
+
+from helpers import *
+
+from model_fixtures import no_fees, priced_model
+from prices import impact_curve, marginal_price, marginal_prices
+from stable_math import Constants, ContractError, Errors, perform_swap, sum_all_fee
+from views import get_dy
+
+class PricesTest(TestCase):
+
+    def test_balanced(self):
+        model = priced_model([10**9, 10**9], pool_fees=no_fees)
+        self.assertEqual(marginal_price(model.storage, 0, 0, 1), Fraction(1))
+
+    def test_matches_small_swaps(self):
+        model = priced_model([3 * 10**20, 10**8, 2 * 10**20], rates={1: 10**30}, a_constant=100)
+        pool = model.storage["storage"]["pools"][0]
+        # token 1 is worth 10**12 of the others, buying it in small amounts only gets rounding
+        for i, j in [(1, 0), (0, 2), (2, 0), (1, 2)]:
+            dx = pool["tokens_info"][i]["reserves"] // 10**7
+            price = marginal_price(model.storage, 0, i, j, fees=False)
+            probe = Fraction(perform_swap(i, j, dx, pool, 0), dx)
+            self.assertLess(abs(probe / price - 1), 1e-6)
+            # the curve only gets worse along the way
+            self.assertLess(probe, price)
+
+    def test_reciprocal(self):
+        model = priced_model([10**9, 4 * 10**9, 2 * 10**9], a_constant=10)
+        for i, j in [(0, 1), (0, 2), (1, 2)]:
+            forward = marginal_price(model.storage, 0, i, j, fees=False)
+            backward = marginal_price(model.storage, 0, j, i, fees=False)
+            self.assertEqual(forward * backward, 1)
+
+    def test_fees(self):
+        model = priced_model([10**9, 3 * 10**9])
+        fee_f = sum_all_fee(fees, 0)
+        self.assertEqual(
+            marginal_price(model.storage, 0, 0, 1),
+            marginal_price(model.storage, 0, 0, 1, fees=False) * Fraction(Constants.fee_denominator - fee_f, Constants.fee_denominator),
+        )
+
+    def test_rates(self):
+        plain = marginal_price(priced_model([10**9, 3 * 10**9], pool_fees=no_fees).storage, 0, 0, 1)
+        # same xp, token 0 worth twice as much per unit
+        scaled = marginal_price(priced_model([5 * 10**8, 3 * 10**9], rates={0: 2 * 10**18}, pool_fees=no_fees).storage, 0, 0, 1)
+        self.assertEqual(scaled, 2 * plain)
+
+    def test_ramp(self):
+        model = priced_model([10**9, 3 * 10**9], a_constant=10, pool_fees=no_fees)
+        model.now = MIN_RAMP_TIME
+        model.execute("ramp_A", dict(pool_id=0, future_A=100, future_time=3 * MIN_RAMP_TIME), admin)
+        before = marginal_price(model.storage, 0, 0, 1, now=MIN_RAMP_TIME)
+        after = marginal_price(model.storage, 0, 0, 1, now=3 * MIN_RAMP_TIME)
+        flat = marginal_price(priced_model([10**9, 3 * 10**9], a_constant=100, pool_fees=no_fees).storage, 0, 0, 1)
+        self.assertEqual(after, flat)
+        # a higher A pulls the price towards 1
+        self.assertGreater(before, after)
+        self.assertGreater(after, 1)
+
+    def test_all_pools(self):
+        model = priced_model([10**9, 2 * 10**9])
+        model.execute("add_pool", dict(a_constant=A_CONST, input_tokens=[token_c, token_d], tokens_info=equal_pool_rates([10**9, 10**9]), fees=fees), admin)
+        model.execute("divest", dict(pool_id=1, min_amounts_out={0: 1, 1: 1}, shares=2 * 10**9, deadline=0, receiver=None), admin)
+        prices = marginal_prices(model.storage)
+        self.assertEqual(list(prices), [0])
+        self.assertEqual(set(prices[0]), {(0, 1), (1, 0)})
+        self.assertEqual(prices[0][0, 1], float(marginal_price(model.storage, 0, 0, 1)))
+
+    def test_impact_curve(self):
+        model = priced_model([10**9, 10**9], a_constant=100)
+        sizes = [10**6, 10**7, 10**8, 5 * 10**8, 10**12]
+        curve = impact_curve(model.storage, 0, 0, 1, sizes)
+        for size, dy in zip(sizes[:-1], curve.dy):
+            self.assertEqual(dy, get_dy(model.storage, 0, 0, 1, size))
+        impact = list(curve.impact)
+        self.assertEqual(impact, sorted(impact))
+        self.assertGreater(impact[0], 0)
+        # selling a thousand times the reserves empties the pool
+        self.assertGreater(impact[-1], 0.99)
+        self.assertEqual(curve.errors, [None] * 5)
+
+        curve = impact_curve(model.storage, 0, 0, 1, [0, 10**6])
+        self.assertIsNotNone(curve.errors[0])
+        self.assertTrue(math.isnan(curve.price[0]))
+        self.assertFalse(math.isnan(curve.price[1]))
+
+    def test_errors(self):
+        model = priced_model([10**9, 10**9])
+        for pool_id, i, j, error in [(1, 0, 1, Errors.Dex.pool_not_listed), (0, 0, 2, Errors.Dex.wrong_index)]:
+            with self.assertRaises(ContractError) as ctx:
+                marginal_price(model.storage, pool_id, i, j)
+            self.assertEqual(ctx.exception.error, error)
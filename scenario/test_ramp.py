@@ -0,0 +1,78 @@
+from unittest import TestCase
+from constants import *
+
+from helpers import *
+
+import stable_math
+from stable_math import Constants, ContractError, Errors, get_A, get_D_mem
+from batch_quote import get_dy_batch
+from ramp import RampSchedule
+
+def ramp_pool(reserves, initial_A, future_A, initial_time, future_time):
+    return {
+        "initial_A_f": initial_A * Constants.a_precision,
+        "future_A_f": future_A * Constants.a_precision,
+        "initial_A_time": initial_time,
+        "future_A_time": future_time,
+        "tokens_info": equal_pool_rates(reserves),
+        "fee": fees,
+        "staker_accumulator": { "accumulator_f": {}, "total_fees": {}, "total_staked": 0 },
+        "total_supply": sum(reserves),
+    }
+
+class RampScheduleTest(TestCase):
+
+    def test_matches_get_A(self):
+        for initial_A, future_A in ((100, 1000), (1000, 100), (500, 500)):
+            pool = ramp_pool([10**6, 10**6], initial_A, future_A, 1_000, 1_000 + 86_400)
+            schedule = RampSchedule.from_pool(pool, 1_000 - 10 * BLOCK_TIME, 3_000)
+            for k, now in enumerate(schedule.times):
+                try:
+                    expected = stable_math.get_pool_A(pool, now)
+                except ContractError as e:
+                    self.assertEqual(e.error, Errors.Dex.timestamp_error)
+                    with self.assertRaises(ContractError):
+                        schedule.at_block(k)
+                    continue
+                self.assertEqual(schedule.at_block(k), expected)
+                self.assertEqual(schedule.at(now), expected)
+
+    def test_fresh_pool(self):
+        # right after add_pool or stop_ramp_A both times are the same
+        for initial_A, future_A in ((100, 100), (100, 300)):
+            pool = ramp_pool([10**6, 10**6], initial_A, future_A, 60, 60)
+            schedule = RampSchedule.from_pool(pool, 0, 5)
+            self.assertEqual(list(schedule.amps), [-1, -1] + [future_A * Constants.a_precision] * 3)
+            for k, now in enumerate(schedule.times):
+                if now < 60:
+                    with self.assertRaises(ContractError):
+                        stable_math.get_pool_A(pool, now)
+                    with self.assertRaises(ContractError):
+                        schedule.at_block(k)
+                else:
+                    self.assertEqual(schedule.at_block(k), stable_math.get_pool_A(pool, now))
+
+    def test_lookup_outside_range(self):
+        pool = ramp_pool([10**6, 10**6], 100, 200, 0, 86_400)
+        schedule = RampSchedule.from_pool(pool, 0, 10)
+        for now in (7, 10 * BLOCK_TIME, 50_000, 10**6):
+            self.assertEqual(schedule.at(now), get_A(0, 100_00, 86_400, 200_00, now))
+
+    def test_d_series(self):
+        pool = ramp_pool([10**9, 3 * 10**9, 10**8], 100, 300, 0, 86_400)
+        schedule = RampSchedule.from_pool(pool, 0, 3_000)
+        stable_math.d_cache.invalidate()
+        series = schedule.d_series(pool["tokens_info"])
+        for k in range(0, len(schedule), 97):
+            self.assertEqual(series[k], get_D_mem(pool["tokens_info"], schedule.at_block(k)))
+        # every A the ramp passes through is now cached
+        self.assertIsNotNone(stable_math.d_cache.lookup(pool["tokens_info"], schedule.at_block(1234)))
+
+    def test_batch_quotes_on_ramp(self):
+        pool = ramp_pool([10**9, 10**9], 100, 1000, 0, 86_400)
+        storage = {"storage": {"pools": {0: pool}, "dev_store": {"dev_fee_f": 0}}}
+        schedule = RampSchedule.from_pool(pool, 0, 2_880)
+        for block in (0, 100, 2_000, 2_879):
+            now = block * BLOCK_TIME
+            with_schedule = get_dy_batch(storage, [0], [0], [1], [10**7], now=now, ramps={0: schedule})
+            self.assertEqual(list(with_schedule), list(get_dy_batch(storage, [0], [0], [1], [10**7], now=now)))
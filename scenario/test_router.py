@@ -0,0 +1,137 @@
+from unittest import TestCase
+from constants import *
+
+from helpers import *
+
+from dex_model import DexModel
+from router import Hop, find_paths, quote_path, route, token_pools
+from stable_math import Constants, ContractError, Errors, token_key
+from model_fixtures import model_storage
+from views import get_dy
+
+POOLS = [
+    ([token_a, token_b], [10**9, 10**9]),
+    ([token_a, token_c], [10**9, 10**9]),
+    ([token_b, token_c], [10**9, 10**9]),
+    ([token_a, token_b, token_c], [5 * 10**8] * 3),
+    ([token_c, token_d], [10**9, 10**9]),
+]
+
+def routed_model():
+    model = DexModel(model_storage())
+    for tokens, reserves in POOLS:
+        model.execute("add_pool", dict(a_constant=A_CONST // 10, input_tokens=tokens, tokens_info=equal_pool_rates(reserves), fees=fees), admin)
+    return model
+
+def index_of(storage, pool_id, token):
+    tokens = storage["storage"]["tokens"][pool_id]
+    return next(i for i, value in tokens.items() if token_key(value) == token_key(token))
+
+class RouterTest(TestCase):
+
+    def setUp(self):
+        self.model = routed_model()
+        self.storage = self.model.storage
+
+    def run_route(self, result):
+        """ sends the swaps of every leg and returns what they bought """
+        model = DexModel(self.storage)
+        bought = 0
+        for leg in result.legs:
+            for swap in leg.swaps:
+                transfers = model.execute("swap", swap, alice)
+            # transfers come newest first, the bought token goes out before the sold one comes in
+            bought += transfers[1][4]
+        return bought
+
+    def test_token_pools(self):
+        pools = token_pools(self.storage)
+        self.assertEqual([pool_id for pool_id, _ in pools[token_key(token_a)]], [0, 1, 3])
+        self.assertEqual([pool_id for pool_id, _ in pools[token_key(token_d)]], [4])
+
+    def test_find_paths(self):
+        paths = find_paths(self.storage, token_a, token_b)
+        direct = [path for path in paths if len(path) == 1]
+        self.assertEqual(sorted(path[0].pool_id for path in direct), [0, 3])
+        for path in paths:
+            pool_ids = [hop.pool_id for hop in path]
+            self.assertEqual(len(pool_ids), len(set(pool_ids)))
+        self.assertEqual(find_paths(self.storage, token_a, token_d, max_hops=1), [])
+        self.assertEqual(find_paths(self.storage, token_a, token_a), [])
+
+    def test_single_pool_matches_view(self):
+        storage = DexModel(model_storage()).storage
+        model = DexModel(storage)
+        model.execute("add_pool", dict(a_constant=A_CONST, input_tokens=[token_a, token_b], tokens_info=equal_pool_rates([10**9, 10**9]), fees=fees), admin)
+        result = route(model.storage, token_a, token_b, 10**7)
+        i = index_of(model.storage, 0, token_a)
+        self.assertEqual(len(result.legs), 1)
+        self.assertEqual(result.legs[0].path, (Hop(0, i, 1 - i),))
+        swap = dict(pool_id=0, idx_from=i, idx_to=1 - i, amount=10**7, min_amount_out=1, deadline=0, receiver=None, referral=None)
+        self.assertEqual(result.amount_out, model.interpret("swap", swap)[1][4])
+        # the view takes the fees off in one go and may round a unit or two lower
+        self.assertLessEqual(get_dy(model.storage, 0, i, 1 - i, 10**7), result.amount_out)
+
+    def test_exact(self):
+        for amount in [1_000, 10**6, 10**8, 5 * 10**8]:
+            result = route(self.storage, token_a, token_b, amount)
+            self.assertEqual(result.amount_in, amount)
+            self.assertEqual(sum(leg.amount_in for leg in result.legs), amount)
+            self.assertEqual(self.run_route(result), result.amount_out)
+            for leg in result.legs:
+                self.assertEqual(leg.swaps[-1]["min_amount_out"], leg.amount_out)
+
+    def test_split_beats_single_paths(self):
+        amount = 5 * 10**8
+        result = route(self.storage, token_a, token_b, amount)
+        self.assertGreater(len(result.legs), 1)
+        pool_ids = [hop.pool_id for leg in result.legs for hop in leg.path]
+        self.assertEqual(len(pool_ids), len(set(pool_ids)))
+        for path in find_paths(self.storage, token_a, token_b):
+            try:
+                single = quote_path(self.storage, path, amount)[-1]
+            except ContractError:
+                continue
+            self.assertGreater(result.amount_out, single)
+
+    def test_multi_hop(self):
+        result = route(self.storage, token_a, token_d, 10**7)
+        self.assertTrue(all(leg.path[-1].pool_id == 4 for leg in result.legs))
+        swaps = result.legs[0].swaps
+        self.assertEqual(len(swaps), 2)
+        # the second hop sells what the first one bought
+        self.assertEqual(swaps[1]["amount"], swaps[0]["min_amount_out"])
+        self.assertEqual(self.run_route(result), result.amount_out)
+
+    def test_multi_hop_receiver(self):
+        result = route(self.storage, token_a, token_d, 10**7, receiver=bob)
+        model = DexModel(self.storage)
+        held = {}
+        for leg in result.legs:
+            self.assertEqual([swap["receiver"] for swap in leg.swaps], [None] * (len(leg.swaps) - 1) + [bob])
+            for swap in leg.swaps:
+                for address, _, source, destination, amount in model.execute("swap", swap, alice):
+                    held[address, source] = held.get((address, source), 0) - amount
+                    held[address, destination] = held.get((address, destination), 0) + amount
+        # alice kept none of the tokens in between, bob got all that was bought
+        for token in [token_b, token_c]:
+            self.assertEqual(held.get((token[1], alice), 0), 0)
+        self.assertEqual(held[token_a[1], alice], -10**7)
+        self.assertEqual(held[token_d[1], bob], result.amount_out)
+        self.assertNotIn((token_d[1], alice), held)
+
+    def test_slippage(self):
+        exact = route(self.storage, token_a, token_b, 10**6)
+        loose = route(self.storage, token_a, token_b, 10**6, slippage_f=Constants.fee_denominator // 100, deadline=FAR_FUTURE, receiver=bob)
+        self.assertEqual(loose.amount_out, exact.amount_out)
+        swap = loose.legs[0].swaps[-1]
+        self.assertEqual(swap["min_amount_out"], loose.legs[0].amount_out * 99 // 100)
+        self.assertEqual((swap["deadline"], swap["receiver"]), (FAR_FUTURE, bob))
+
+    def test_errors(self):
+        with self.assertRaises(ContractError) as ctx:
+            route(self.storage, token_a, ("fa12", alice), 1_000)
+        self.assertEqual(ctx.exception.error, Errors.Dex.pool_not_listed)
+        with self.assertRaises(ContractError) as ctx:
+            route(self.storage, token_a, token_b, 0)
+        self.assertEqual(ctx.exception.error, Errors.Dex.zero_in)
@@ -0,0 +1,103 @@
+from unittest import TestCase, skipUnless
+import csv
+import importlib.util
+import os
+import tempfile
+from constants import *
+
+from helpers import *
+
+from fuzz import Step
+from initial_storage import BUILD_DIR, load_dex, load_storage
+from simulate import METRIC_COLUMNS, ChainBackend, ModelBackend, simulate, write_csv, write_parquet
+from stable_math import Constants
+from model_fixtures import model_storage, schedule
+
+class SimulateTest(TestCase):
+
+    def test_rows(self):
+        rows = list(simulate(ModelBackend(model_storage()), schedule(), 50))
+        self.assertEqual(len(rows), 50)
+        self.assertEqual([row["block"] for row in rows], list(range(50)))
+        self.assertEqual([row["now"] for row in rows], [block * BLOCK_TIME for block in range(50)])
+        for row in rows:
+            self.assertEqual(set(row), set(METRIC_COLUMNS))
+            self.assertIsNone(row["reserves_2"])
+            self.assertGreaterEqual(row["imbalance"], 0)
+
+        # fees only ever add to the pool
+        prices = [row["virtual_price"] for row in rows]
+        self.assertEqual(prices, sorted(prices))
+        self.assertGreater(prices[-1], prices[0])
+        self.assertGreater(sum(row["calls"] for row in rows), 50)
+        self.assertEqual(sum(row["failed"] for row in rows), 0)
+        self.assertGreater(rows[0]["d"], 0)
+        self.assertEqual(rows[-1]["virtual_price"], rows[-1]["d"] * Constants.precision // rows[-1]["total_supply"])
+
+    def test_streams_lazily(self):
+        rows = simulate(ModelBackend(model_storage()), schedule(), 10**9)
+        first = next(rows)
+        self.assertEqual(first["block"], 0)
+        rows.close()
+
+    def test_every(self):
+        rows = list(simulate(ModelBackend(model_storage()), schedule(), 25, every=10))
+        self.assertEqual([row["block"] for row in rows], [0, 10, 20, 24])
+        everything = list(simulate(ModelBackend(model_storage()), schedule(), 25))
+        self.assertEqual(sum(row["calls"] for row in rows), sum(row["calls"] for row in everything))
+        self.assertEqual(rows[-1]["reserves_0"], everything[-1]["reserves_0"])
+
+    def test_ramp_and_stake(self):
+        ramp_block = MIN_RAMP_TIME // BLOCK_TIME
+        steps = {
+            1: [Step("stake", {"add": {"pool_id": 0, "amount": 1_000}}, admin)],
+            ramp_block: [Step("ramp_A", dict(pool_id=0, future_A=A_CONST // 2, future_time=MIN_RAMP_TIME * 3), admin)],
+        }
+        rows = list(simulate(ModelBackend(model_storage()), schedule(extra=steps), ramp_block + 200, every=100))
+        self.assertEqual(rows[0]["amp_f"], A_CONST * Constants.a_precision)
+        self.assertLess(rows[-1]["amp_f"], A_CONST * Constants.a_precision)
+        self.assertEqual(sum(row["failed"] for row in rows), 0)
+        self.assertGreater(rows[-1]["staker_fees_0"] + rows[-1]["staker_fees_1"], 0)
+
+    def test_failed_calls(self):
+        steps = {3: [Step("swap", dict(pool_id=0, idx_from=0, idx_to=1, amount=10, min_amount_out=10**9, deadline=0, receiver=None, referral=None), alice)]}
+        rows = list(simulate(ModelBackend(model_storage()), schedule(trades_per_block=0, extra=steps), 5))
+        self.assertEqual([row["failed"] for row in rows], [0, 0, 0, 1, 0])
+
+    def test_csv(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "metrics.csv")
+            count = write_csv(simulate(ModelBackend(model_storage()), schedule(), 20), path)
+            with open(path) as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual(count, 20)
+        self.assertEqual(len(rows), 20)
+        self.assertEqual(tuple(rows[0]), METRIC_COLUMNS)
+        self.assertEqual(int(rows[-1]["block"]), 19)
+
+    @skipUnless(importlib.util.find_spec("pyarrow"), "needs pyarrow")
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "metrics.parquet")
+            count = write_parquet(simulate(ModelBackend(model_storage()), schedule(), 20), path, batch_size=7)
+            table = pq.read_table(path)
+        self.assertEqual(count, 20)
+        self.assertEqual(table.num_rows, 20)
+        self.assertEqual(tuple(table.column_names), METRIC_COLUMNS)
+
+
+@skipUnless(os.path.exists(os.path.join(BUILD_DIR, "dex.json")), "needs the contract compiled into build/")
+class SimulateChainTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dex = load_dex()
+        storage = load_storage()
+        storage["storage"]["admin"] = admin
+        cls.init_storage = storage
+
+    def test_backends_agree(self):
+        chain_rows = list(simulate(ChainBackend(self.dex, self.init_storage), schedule(), 10))
+        model_rows = list(simulate(ModelBackend(self.init_storage), schedule(), 10))
+        self.assertEqual(chain_rows, model_rows)
@@ -0,0 +1,212 @@
+from unittest import TestCase
+import json
+from constants import *
+
+from helpers import *
+
+from pytezos import ContractInterface, MichelsonRuntimeError
+from initial_storage import load_dex, load_storage
+
+import stable_math
+
+class StableMathTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.maxDiff = None
+
+        cls.dex = load_dex()
+
+        storage = load_storage()
+        storage["storage"]["admin"] = admin
+
+        cls.init_storage = storage
+
+    def test_swap_matches_interpreter(self):
+        for reserves in [(10, 10), (100_000, 100_000), (100_000_000, 100_000), (10**12, 10**9, 10**15)]:
+            chain = LocalChain(storage=self.init_storage)
+            tokens = [token_a, token_b, token_c][:len(reserves)]
+            chain.execute(self.dex.add_pool(A_CONST, tokens, equal_pool_rates(reserves), fees), sender=admin)
+
+            pool = chain.storage["storage"]["pools"][0]
+            for amount in [1, 7, 1_000, reserves[0] // 3, 10**11]:
+                swap = self.dex.swap(pool_id=0, idx_from=0, idx_to=1, amount=amount, min_amount_out=1, deadline=0, receiver=None, referral=None)
+                try:
+                    dy = stable_math.perform_swap(0, 1, amount, pool, chain.now)
+                    expected = stable_math.slice_fee(dy, pool["fee"], 0, 0)["dy"]
+                except stable_math.ContractError:
+                    expected = None
+
+                if expected is None or expected == 0:
+                    with self.assertRaises(MichelsonRuntimeError):
+                        chain.interpret(swap)
+                    continue
+
+                res = chain.interpret(swap)
+                transfers = parse_transfers(res)
+                self.assertEqual(transfers[1]["amount"], expected)
+
+    def test_invariant_matches_invest(self):
+        chain = LocalChain(storage=self.init_storage)
+        chain.execute(self.dex.add_pool(A_CONST, [token_a, token_b, token_c], equal_pool_rates([10**9, 10**6, 10**12]), fees), sender=admin)
+        pool = chain.storage["storage"]["pools"][0]
+
+        amp_f = stable_math.get_pool_A(pool, chain.now)
+        d = stable_math.get_D_mem(pool["tokens_info"], amp_f)
+        # the very first invest mints exactly D shares
+        self.assertEqual(pool["total_supply"], d)
+
+    def test_divest_one_coin_matches_interpreter(self):
+        chain = LocalChain(storage=self.init_storage)
+        chain.execute(self.dex.add_pool(A_CONST, [token_a, token_b], form_pool_rates(100_000_000, 50_000_000), fees), sender=admin)
+        pool = chain.storage["storage"]["pools"][0]
+        amp_f = stable_math.get_pool_A(pool, chain.now)
+
+        for shares in [1_000, 1_000_000, 10_000_000]:
+            for i in [0, 1]:
+                result = stable_math.calc_withdraw_one_coin(amp_f, shares, i, 0, pool)
+                res = chain.interpret(self.dex.divest_one_coin(pool_id=0, shares=shares, token_index=i, min_amount_out=1, deadline=0, receiver=None, referral=None), sender=admin)
+                transfers = parse_transfers(res)
+                self.assertEqual(transfers[0]["amount"], result["dy"])
+
+    def test_d_cache_follows_pool_state(self):
+        chain = LocalChain(storage=self.init_storage)
+        chain.execute(self.dex.add_pool(A_CONST, [token_a, token_b], form_pool_rates(100_000_000, 100_000_000), fees), sender=admin)
+        snapshot = chain.snapshot()
+        pool = chain.storage["storage"]["pools"][0]
+        amp_f = stable_math.get_pool_A(pool, chain.now)
+        dy = stable_math.perform_swap(0, 1, 1_000, pool, chain.now)
+
+        chain.execute(self.dex.swap(pool_id=0, idx_from=0, idx_to=1, amount=1_000, min_amount_out=1, deadline=0, receiver=None, referral=None))
+        swapped = chain.storage["storage"]["pools"][0]
+        # entries are keyed by the reserves, the swapped pool gets its own
+        stable_math.perform_swap(0, 1, 1_000, swapped, chain.now)
+        self.assertEqual(stable_math.d_cache.lookup(swapped["tokens_info"], amp_f), stable_math.get_D(stable_math.xp(swapped), amp_f))
+
+        # and what was cached for the old state still serves a restored snapshot
+        chain.restore(snapshot)
+        self.assertIsNotNone(stable_math.d_cache.lookup(pool["tokens_info"], amp_f))
+        self.assertEqual(stable_math.perform_swap(0, 1, 1_000, chain.storage["storage"]["pools"][0], chain.now), dy)
+
+
+class StableMathPureTest(TestCase):
+
+    def pool(self, reserves, a_constant=A_CONST):
+        return {
+            "initial_A_f": a_constant * stable_math.Constants.a_precision,
+            "future_A_f": a_constant * stable_math.Constants.a_precision,
+            "initial_A_time": 0,
+            "future_A_time": 0,
+            "tokens_info": equal_pool_rates(reserves),
+            "fee": { "lp_f": 0, "stakers_f": 0, "ref_f": 0},
+            "staker_accumulator": { "accumulator_f": {}, "total_fees": {}, "total_staked": 0 },
+            "total_supply": sum(reserves),
+        }
+
+    def test_ceil_div(self):
+        self.assertEqual(stable_math.ceil_div(10, 5), 2)
+        self.assertEqual(stable_math.ceil_div(11, 5), 3)
+        with self.assertRaises(stable_math.ContractError):
+            stable_math.ceil_div(1, 0)
+
+    def test_get_A_ramps(self):
+        self.assertEqual(stable_math.get_A(0, 100, 100, 200, 50), 150)
+        self.assertEqual(stable_math.get_A(0, 200, 100, 100, 50), 150)
+        self.assertEqual(stable_math.get_A(0, 100, 100, 200, 500), 200)
+
+    def test_small_and_huge_swaps(self):
+        self.assertEqual(stable_math.perform_swap(0, 1, 2, self.pool([10, 10]), 0), 1)
+
+        dy = stable_math.perform_swap(0, 1, 100_000_000_000, self.pool([100_000_000_000, 100_000_000_000]), 0)
+        self.assertLess(dy, 100_000_000_000)
+        self.assertGreater(dy, 99_900_000_000)
+
+    def test_swap_wrong_indexes(self):
+        with self.assertRaises(stable_math.ContractError) as ctx:
+            stable_math.perform_swap(0, 2, 10, self.pool([100, 100]), 0)
+        self.assertEqual(ctx.exception.error, stable_math.Errors.Dex.wrong_index)
+
+        with self.assertRaises(stable_math.ContractError) as ctx:
+            stable_math.perform_swap(1, 1, 10, self.pool([100, 100]), 0)
+        self.assertEqual(ctx.exception.error, stable_math.Errors.assertion)
+
+    def test_d_cache(self):
+        cache = stable_math.DCache(maxsize=2)
+        pool = self.pool([100_000, 100_000])
+        amp_f = pool["initial_A_f"]
+
+        d = cache.get_D(pool["tokens_info"], amp_f)
+        self.assertEqual(d, stable_math.get_D_mem(pool["tokens_info"], amp_f))
+        self.assertEqual(cache.get_D(pool["tokens_info"], amp_f), d)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+        # least recently used entry goes first
+        cache.get_D(pool["tokens_info"], amp_f * 2)
+        cache.get_D(pool["tokens_info"], amp_f)
+        cache.get_D(self.pool([1, 2])["tokens_info"], amp_f)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertIsNone(cache.lookup(pool["tokens_info"], amp_f * 2))
+
+        cache.invalidate()
+        self.assertIsNone(cache.lookup(pool["tokens_info"], amp_f))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_d_cache_only_takes_pool_xp(self):
+        pool = self.pool([10**9, 10**9])
+        amp_f = pool["initial_A_f"]
+        stable_math.d_cache.invalidate()
+        other = {0: 2 * 10**9 * stable_math.Constants.precision, 1: 10**9 * stable_math.Constants.precision}
+        y = stable_math.get_y(0, 1, other[0] + 10**6, other, pool, 0)
+        self.assertIsNone(stable_math.d_cache.lookup(pool["tokens_info"], amp_f))
+        d = stable_math.get_D(other, amp_f)
+        s_, c = stable_math._prepare_params(other, 1, d, 2, i=0, x=other[0] + 10**6)
+        self.assertEqual(y, stable_math.calc_y(c, amp_f * 2, s_, d, pool))
+
+        # the pool's own xp is cached as before
+        xp = stable_math.xp(pool)
+        stable_math.get_y(0, 1, xp[0] + 10**6, xp, pool, 0, stable_math.WarmStart(strict=True))
+        self.assertEqual(stable_math.d_cache.lookup(pool["tokens_info"], amp_f), stable_math.get_D(xp, amp_f))
+
+    def test_warm_start(self):
+        stable_math.solver_stats.reset()
+        reserves = [10**15, 10**15, 10**15]
+        warm = stable_math.WarmStart(strict=True)
+        for step in range(50):
+            reserves[0] += 10**10
+            pool = self.pool(reserves)
+            warm_dy = stable_math.perform_swap(0, 1, 10**12, pool, 0, warm)
+            self.assertEqual(warm_dy, stable_math.perform_swap(0, 1, 10**12, pool, 0))
+            self.assertIn("calc_y", warm.last_iterations)
+
+        self.assertLess(stable_math.solver_stats.mean("calc_y", warm=True), stable_math.solver_stats.mean("calc_y"))
+
+    def test_solve_reports_iterations(self):
+        xp = stable_math.xp(self.pool([10**9, 10**12]))
+        d, iterations = stable_math.solve_D(xp, 100 * stable_math.Constants.a_precision)
+        self.assertEqual(d, stable_math.get_D(xp, 100 * stable_math.Constants.a_precision))
+        self.assertGreater(iterations, 0)
+
+        # a good guess converges at once
+        _, warm_iterations = stable_math.solve_D(xp, 100 * stable_math.Constants.a_precision, start=d, strict=True)
+        self.assertLessEqual(warm_iterations, 2)
+
+    def test_solves_counted_into_given_stats(self):
+        pool = self.pool([10**9, 10**12])
+        xp = stable_math.xp(pool)
+        amp_f = 100 * stable_math.Constants.a_precision
+        stable_math.solver_stats.reset()
+        d = stable_math.get_D(xp, amp_f)
+        self.assertEqual(stable_math.solver_stats.solves, {})
+
+        stats = stable_math.SolverStats()
+        self.assertEqual(stable_math.get_D(xp, amp_f, stats), d)
+        self.assertEqual(stats.solves, {("get_D", "cold"): 1})
+        self.assertEqual(stats.iterations[("get_D", "cold")], stable_math.solve_D(xp, amp_f)[1])
+
+        stable_math.d_cache.invalidate()
+        stable_math.perform_swap(0, 1, 10**6, pool, 0, stats=stats)
+        self.assertEqual(stats.solves, {("get_D", "cold"): 2, ("calc_y", "cold"): 1})
+        # a cached D takes no iterations
+        stable_math.perform_swap(0, 1, 10**6, pool, 0, stats=stats)
+        self.assertEqual(stats.solves, {("get_D", "cold"): 2, ("calc_y", "cold"): 2})
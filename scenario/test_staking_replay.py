@@ -0,0 +1,175 @@
+from unittest import TestCase
+import pickle
+import random
+from constants import *
+
+from helpers import *
+
+from dex_model import DexModel, DEFAULT_SENDER
+from stable_math import ContractError, Errors, perform_swap
+from staking_replay import SetFees, Stake, StakerFee, StakingReplay, Swap
+from model_fixtures import model_storage, no_fees, swap
+
+class Recorder:
+    """ runs calls on the model and turns each successful one into replay events """
+
+    def __init__(self, model):
+        self.model = model
+        self.events = []
+        # reward amounts the model paid out for every Stake event
+        self.harvests = []
+
+    def call(self, entrypoint, params, sender=DEFAULT_SENDER):
+        before = self.model.storage["storage"]["pools"]
+        if entrypoint == "swap":
+            pool = before[params["pool_id"]]
+            dy = perform_swap(params["idx_from"], params["idx_to"], params["amount"], pool, 0)
+        transfers = self.model.execute(entrypoint, params, sender)
+
+        if entrypoint == "swap":
+            self.events.append(Swap(params["pool_id"], params["idx_to"], dy))
+        elif entrypoint == "set_fees":
+            self.events.append(SetFees(params["pool_id"], params["fee"]))
+        elif entrypoint == "stake":
+            (action, args), = params.items()
+            self.events.append(Stake(sender, args["pool_id"], action, args["amount"]))
+            self.harvests.append(sorted(rewards(transfers, sender).values()))
+        elif entrypoint in ("invest", "divest_imbalanced", "divest_one_coin"):
+            pool_id = params["pool_id"]
+            old = before[pool_id]["staker_accumulator"]["total_fees"]
+            new = self.model.storage["storage"]["pools"][pool_id]["staker_accumulator"]["total_fees"]
+            for i in sorted(new):
+                if new[i] != old.get(i, 0):
+                    self.events.append(StakerFee(pool_id, i, new[i] - old.get(i, 0)))
+        return transfers
+
+def rewards(transfers, receiver):
+    """ non-quipu transfers to `receiver` by token address """
+    return {address: amount for address, _, _, dest, amount in transfers if dest == receiver and address != quipu_token}
+
+class StakingReplayTest(TestCase):
+
+    def setUp(self):
+        self.recorder = Recorder(DexModel(model_storage()))
+
+    def add_pool(self, reserves, pool_fees=fees):
+        tokens = [token_a, token_b, token_c][:len(reserves)]
+        self.recorder.call("add_pool", dict(a_constant=A_CONST, input_tokens=tokens, tokens_info=equal_pool_rates(reserves), fees=no_fees), sender=admin)
+        self.recorder.call("set_fees", dict(pool_id=0, fee=pool_fees), sender=admin)
+
+    def replay(self):
+        replay = StakingReplay()
+        return replay, [payout for _, payout in replay.replay(self.recorder.events)]
+
+    # the same scenarios and amounts test_staking.py checks on the interpreter
+
+    def test_get_staking_reward(self):
+        self.add_pool([100_000_000, 100_000_000])
+        self.recorder.call("stake", {"add": {"pool_id": 0, "amount": 20}})
+        self.recorder.call("swap", swap(0, 1, 1_000_000))
+        self.recorder.call("stake", {"remove": {"pool_id": 0, "amount": 10}})
+        self.recorder.call("stake", {"remove": {"pool_id": 0, "amount": 10}})
+
+        _, payouts = self.replay()
+        self.assertEqual(payouts[-2], {1: 19})
+        self.assertEqual(payouts[-1], {})
+
+    def test_staking_proportions(self):
+        self.add_pool([100_000_000, 100_000_000])
+        self.recorder.call("stake", {"add": {"pool_id": 0, "amount": 77}}, sender=alice)
+        self.recorder.call("stake", {"add": {"pool_id": 0, "amount": 77}}, sender=bob)
+        self.recorder.call("swap", swap(0, 1, 10_000_000))
+        self.recorder.call("stake", {"remove": {"pool_id": 0, "amount": 77}}, sender=alice)
+        self.recorder.call("stake", {"remove": {"pool_id": 0, "amount": 77}}, sender=bob)
+
+        _, payouts = self.replay()
+        self.assertEqual(payouts[-2], {1: 99})
+        self.assertEqual(payouts[-1], {1: 99})
+
+    def test_stake_in_between_swaps(self):
+        self.add_pool([100_000_000, 100_000_000])
+        self.recorder.call("stake", {"add": {"pool_id": 0, "amount": 333_333}}, sender=alice)
+        self.recorder.call("swap", swap(0, 1, 10_000_000))
+        self.recorder.call("stake", {"add": {"pool_id": 0, "amount": 333_333}}, sender=bob)
+        self.recorder.call("swap", swap(0, 1, 10_000_000))
+        self.recorder.call("stake", {"remove": {"pool_id": 0, "amount": 0}}, sender=alice)
+        self.recorder.call("stake", {"remove": {"pool_id": 0, "amount": 0}}, sender=bob)
+
+        _, payouts = self.replay()
+        self.assertAlmostEqual(payouts[-2][1], 300, delta=2)
+        self.assertAlmostEqual(payouts[-1][1], 100, delta=2)
+
+    def test_get_staking_reward_all(self):
+        self.add_pool([100_000_000, 100_000_000, 100_000_000])
+        self.recorder.call("stake", {"add": {"pool_id": 0, "amount": 20}})
+        for i, j in ((0, 1), (1, 2), (2, 0)):
+            self.recorder.call("swap", swap(i, j, 1_000_000))
+        self.recorder.call("stake", {"remove": {"pool_id": 0, "amount": 0}})
+
+        replay, payouts = self.replay()
+        self.assertEqual(len(payouts[-1]), 3)
+        for amount in payouts[-1].values():
+            self.assertAlmostEqual(amount, 20, delta=1)
+        self.assertEqual(replay.pending(DEFAULT_SENDER, 0), {})
+
+    def test_failed_unstake(self):
+        self.add_pool([100_000_000, 100_000_000])
+        self.recorder.call("stake", {"add": {"pool_id": 0, "amount": 20}})
+        self.recorder.call("swap", swap(0, 1, 1_000_000))
+        replay, _ = self.replay()
+        state = replay.checkpoint()
+        with self.assertRaises(ContractError) as ctx:
+            replay.apply(Stake(DEFAULT_SENDER, 0, "remove", 21))
+        self.assertEqual(ctx.exception.error, Errors.Dex.wrong_shares_out)
+        self.assertEqual(replay.checkpoint(), state)
+
+    def test_matches_model(self):
+        rng = random.Random(7)
+        self.add_pool([10**9, 10**9, 10**9], {"lp_f": 1_000_000, "stakers_f": 3_000_000, "ref_f": 500_000})
+        users = [alice, bob, carol]
+        for _ in range(300):
+            user = rng.choice(users)
+            roll = rng.random()
+            try:
+                if roll < 0.4:
+                    i, j = rng.sample(range(3), 2)
+                    self.recorder.call("swap", swap(i, j, rng.randint(1, 10**7)), sender=user)
+                elif roll < 0.55:
+                    in_amounts = {rng.randrange(3): rng.randint(1, 10**7)}
+                    self.recorder.call("invest", dict(pool_id=0, shares=1, in_amounts=in_amounts, deadline=0, receiver=None, referral=None), sender=user)
+                elif roll < 0.65:
+                    self.recorder.call("divest_one_coin", dict(pool_id=0, shares=rng.randint(1, 10**6), token_index=rng.randrange(3), min_amount_out=1, deadline=0, receiver=None, referral=None), sender=admin)
+                else:
+                    action = rng.choice(["add", "remove"])
+                    self.recorder.call("stake", {action: {"pool_id": 0, "amount": rng.randint(0, 1000)}}, sender=user)
+            except ContractError:
+                pass
+
+        # stop half way, resume from a pickled checkpoint and finish
+        events = self.recorder.events
+        half = len(events) // 2
+        first = StakingReplay()
+        list(first.replay(events[:half]))
+        resumed = StakingReplay.resume(pickle.loads(pickle.dumps(first.checkpoint())))
+        self.assertEqual(resumed.position, half)
+        list(resumed.replay(events[half:]))
+
+        s = self.recorder.model.storage["storage"]
+        accumulator = dict(resumed.pools[0])
+        del accumulator["stakers_f"]
+        self.assertEqual(accumulator, s["pools"][0]["staker_accumulator"])
+        self.assertEqual(resumed.stakers, s["stakers_balance"])
+
+        payouts = [sorted(payout.values()) for event, payout in StakingReplay().replay(events) if isinstance(event, Stake)]
+        self.assertEqual(payouts, self.recorder.harvests)
+        self.assertGreater(sum(map(sum, payouts)), 0)
+
+    def test_from_storage(self):
+        self.add_pool([10**9, 10**9])
+        self.recorder.call("stake", {"add": {"pool_id": 0, "amount": 100}}, sender=alice)
+        self.recorder.call("swap", swap(0, 1, 10**7))
+        replay = StakingReplay.from_storage(self.recorder.model.storage)
+
+        transfers = self.recorder.call("stake", {"remove": {"pool_id": 0, "amount": 0}}, sender=alice)
+        self.assertEqual(replay.pending(alice, 0), {1: rewards(transfers, alice)[token_b_address]})
+        self.assertEqual(replay.apply(self.recorder.events[-1]), {1: rewards(transfers, alice)[token_b_address]})
@@ -7,7 +7,7 @@ from constants import *
 from helpers import *
 
 from pytezos import ContractInterface, MichelsonRuntimeError
-from initial_storage import admin_lambdas, dex_lambdas, token_lambdas
+from initial_storage import load_dex, load_storage
 
 class StableSwapTest(TestCase):
 
@@ -15,15 +15,9 @@ class StableSwapTest(TestCase):
     def setUpClass(cls):
         cls.maxDiff = None
 
-        text = open("./build/dex.json").read()
-        code = json.loads(text)
+        cls.dex = load_dex()
 
-        cls.dex = ContractInterface.from_micheline(code["michelson"])
-
-        storage = cls.dex.storage.dummy()
-        storage["token_lambdas"] = token_lambdas
-        storage["dex_lambdas"] = dex_lambdas
-        storage["admin_lambdas"] = admin_lambdas
+        storage = load_storage()
         storage["storage"]["admin"] = admin 
 
         cls.init_storage = storage
@@ -511,6 +505,24 @@ class StableSwapTest(TestCase):
                 for i in range(n_coins):
                     self.assertAlmostEqual(transfers[i]["amount"], 100_000)
 
+    def test_forks_dont_interfere(self):
+        chain = LocalChain(storage=self.init_storage)
+        chain.execute(self.dex.add_pool(A_CONST, [token_a, token_b], form_pool_rates(100_000, 100_000), { "lp_f": 0, "stakers_f": 0, "ref_f": 0}), sender=admin)
+        snapshot = chain.snapshot()
+        reserves_before = chain.storage["storage"]["pools"][0]["tokens_info"][0]["reserves"]
+
+        fork = chain.fork()
+        res = fork.execute(self.dex.swap(0, 0, 1, 10_000, 1, 0, None, None))
+        self.assertEqual(res.storage["storage"]["pools"][0]["tokens_info"][0]["reserves"], reserves_before + 10_000)
+        self.assertEqual(chain.storage["storage"]["pools"][0]["tokens_info"][0]["reserves"], reserves_before)
+
+        # the same swap on the original chain gives the same result
+        res = chain.execute(self.dex.swap(0, 0, 1, 10_000, 1, 0, None, None))
+        self.assertEqual(res.storage["storage"]["pools"][0], fork.storage["storage"]["pools"][0])
+
+        chain.restore(snapshot)
+        self.assertEqual(chain.storage["storage"]["pools"][0]["tokens_info"][0]["reserves"], reserves_before)
+
     def test_no_more_than_four_coins_per_pool(self):
         chain = LocalChain(storage=self.init_storage)
 
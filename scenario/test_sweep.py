@@ -0,0 +1,76 @@
+import os
+from unittest import TestCase, skipUnless
+from constants import *
+
+from helpers import *
+
+import stable_math
+from initial_storage import BUILD_DIR, load_dex, load_storage
+from sweep import param_grid, run_sweep
+
+def swap_point(reserves, dx):
+    pool = {
+        "initial_A_f": A_CONST * stable_math.Constants.a_precision,
+        "future_A_f": A_CONST * stable_math.Constants.a_precision,
+        "initial_A_time": 0,
+        "future_A_time": 0,
+        "tokens_info": equal_pool_rates(reserves),
+    }
+    return stable_math.perform_swap(0, 1, dx, pool, 0)
+
+def small_invests_scenario(ratio):
+    """ three tiny invests into a 100:100*ratio pool, then divests all shares but one """
+    dex = load_dex()
+    storage = load_storage()
+    storage["storage"]["admin"] = admin
+
+    token_b_amount = int(100 * ratio)
+    chain = LocalChain(storage=storage)
+    res = chain.execute(dex.add_pool(A_CONST, [token_a, token_b], form_pool_rates(100, token_b_amount), { "lp_f": 0, "stakers_f": 0, "ref_f": 0}), sender=admin)
+    invest = dex.invest(pool_id=0, shares=1, in_amounts={0: 100, 1: token_b_amount}, deadline=1, receiver=None, referral=None)
+
+    for i in range(3):
+        res = chain.execute(invest)
+
+    all_shares = get_shares(res, 0, me)
+    res = chain.execute(dex.divest(pool_id=0, min_amounts_out={0: 1, 1: 1}, shares=all_shares - 1, deadline=1, receiver=None))
+
+    transfers = parse_transfers(res)
+    return transfers[0]["amount"], transfers[1]["amount"]
+
+class SweepTest(TestCase):
+
+    def test_param_grid(self):
+        self.assertEqual(param_grid({"a": [1, 2], "b": [3]}), [{"a": 1, "b": 3}, {"a": 2, "b": 3}])
+        self.assertEqual(param_grid({}), [{}])
+
+    def test_matches_sequential_run(self):
+        grid = {"reserves": [(100, 100), (10**9, 10**6)], "dx": [1, 50, 10**5]}
+        results = list(run_sweep(swap_point, grid, max_workers=2, preload=False))
+
+        self.assertEqual(len(results), 6)
+        for point in results:
+            try:
+                expected, error = swap_point(**point.params), None
+            except stable_math.ContractError as e:
+                expected, error = None, e.error
+            self.assertEqual(point.result, expected)
+            if error is None:
+                self.assertIsNone(point.error)
+            else:
+                self.assertIn(error, point.error)
+
+    def test_inline(self):
+        results = list(run_sweep(swap_point, [{"reserves": (100, 100), "dx": 10}], max_workers=1, preload=False))
+        self.assertEqual(results[0].result, swap_point((100, 100), 10))
+
+@skipUnless(os.path.exists(os.path.join(BUILD_DIR, "dex.json")), "needs the contract compiled into build/")
+class SmallInvestsSweepTest(TestCase):
+
+    def test_small_invests(self):
+        for point in run_sweep(small_invests_scenario, {"ratio": [1, 0.01, 100]}):
+            self.assertIsNone(point.error)
+            ratio = point.params["ratio"]
+            amount_0, amount_1 = point.result
+            self.assertAlmostEqual(amount_0, int(300 * ratio), delta=1)
+            self.assertAlmostEqual(amount_1, 300, delta=1)
@@ -8,7 +8,7 @@ from constants import *
 
 from pytezos import ContractInterface, pytezos, MichelsonRuntimeError
 from pytezos.context.mixin import ExecutionContext
-from initial_storage import admin_lambdas, dex_lambdas, token_lambdas
+from initial_storage import load_dex, load_storage
 
 pair = {
     "token_a_type" : {
@@ -31,15 +31,9 @@ class TokenToTokenTransferTest(TestCase):
     def setUpClass(cls):
         cls.maxDiff = None
 
-        text = open("./build/dex.json").read()
-        code = json.loads(text)
+        cls.dex = load_dex()
 
-        cls.dex = ContractInterface.from_micheline(code["michelson"])
-
-        storage = cls.dex.storage.dummy()
-        storage["token_lambdas"] = token_lambdas
-        storage["dex_lambdas"] = dex_lambdas
-        storage["admin_lambdas"] = admin_lambdas
+        storage = load_storage()
         storage["storage"]["admin"] = admin
         cls.init_storage = storage
 
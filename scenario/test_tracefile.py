@@ -0,0 +1,82 @@
+from unittest import TestCase
+import os
+import tempfile
+
+import numpy as np
+from constants import *
+
+from helpers import *
+
+from simulate import ModelBackend, simulate
+from model_fixtures import model_storage, schedule
+from tracefile import Trace, TraceWriter, decode_ints, encode_int
+
+class TraceFileTest(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "run.trace")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def rows(self, blocks=30):
+        return list(simulate(ModelBackend(model_storage()), schedule(), blocks))
+
+    def test_round_trip(self):
+        rows = self.rows()
+        with TraceWriter(self.path, chunk=7) as writer:
+            self.assertEqual(writer.extend(rows), len(rows))
+
+        trace = Trace(self.path)
+        self.assertEqual(len(trace), len(rows))
+        self.assertEqual(list(trace), rows)
+        self.assertIsInstance(trace["block"], np.memmap)
+        self.assertEqual(list(trace["block"]), [row["block"] for row in rows])
+        self.assertEqual(list(trace.ints("d")), [row["d"] for row in rows])
+        self.assertEqual(list(trace.ints("reserves")[:, 1]), [row["reserves_1"] for row in rows])
+        self.assertTrue(trace.null("reserves_3").all())
+        self.assertFalse(trace.null("reserves_0").any())
+
+    def test_append_and_torn_record(self):
+        rows = self.rows()
+        with TraceWriter(self.path) as writer:
+            writer.extend(rows[:10])
+        # an interrupted writer leaves half a record behind
+        with open(self.path, "ab") as f:
+            f.write(b"\x01" * 13)
+        self.assertEqual(len(Trace(self.path)), 10)
+
+        with TraceWriter(self.path) as writer:
+            writer.extend(rows[10:])
+        self.assertEqual(list(Trace(self.path)), rows)
+
+    def test_readers_see_flushed_chunks(self):
+        rows = self.rows()
+        writer = TraceWriter(self.path, chunk=8)
+        writer.extend(rows[:20])
+        self.assertEqual(len(Trace(self.path)), 16)
+        writer.close()
+        self.assertEqual(len(Trace(self.path)), 20)
+
+    def test_big_ints(self):
+        for value in (0, 1, 2**64 - 1, 2**64, 10**70, 2**256 - 1):
+            self.assertEqual(decode_ints(encode_int(value, 4)[None, :])[0], value)
+        with self.assertRaises(OverflowError):
+            encode_int(2**256, 4)
+
+        row = dict(self.rows(1)[0], d=2**200 + 5, volume=10**60)
+        with TraceWriter(self.path, limbs=4) as writer:
+            writer.append(row)
+        self.assertEqual(Trace(self.path).row(0), row)
+
+    def test_empty_and_foreign_files(self):
+        TraceWriter(self.path).close()
+        self.assertEqual(len(Trace(self.path)), 0)
+        self.assertEqual(list(Trace(self.path)), [])
+
+        other = os.path.join(self.tmp.name, "other")
+        with open(other, "wb") as f:
+            f.write(b"not a trace at all")
+        with self.assertRaises(ValueError):
+            Trace(other)
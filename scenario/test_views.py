@@ -0,0 +1,181 @@
+import os
+from unittest import TestCase, skipUnless
+from constants import *
+
+from helpers import *
+
+from pytezos import MichelsonRuntimeError
+from initial_storage import BUILD_DIR, load_dex, load_storage
+
+from dex_model import DexModel
+from stable_math import Constants, ContractError, Errors
+from model_fixtures import model_storage, no_fees, swap
+import views
+
+fees = {"lp_f": 1_000_000, "stakers_f": 2_000_000, "ref_f": 500_000}
+
+# quotes from the views have to match what the model pays out for the same call
+class ViewsTest(TestCase):
+
+    def add_pool(self, reserves, fees=no_fees):
+        model = DexModel(model_storage())
+        tokens = [token_a, token_b, token_c][:len(reserves)]
+        model.execute("add_pool", dict(a_constant=A_CONST, input_tokens=tokens, tokens_info=equal_pool_rates(reserves), fees=fees), sender=admin)
+        return model
+
+    def received(self, transfers, receiver):
+        return sum(amount for *_, dest, amount in transfers if dest == receiver)
+
+    def test_pool_info(self):
+        model = self.add_pool([100_000, 200_000])
+        storage = model.storage
+
+        self.assertEqual(views.get_reserves(storage, 0), {0: 100_000, 1: 200_000})
+        self.assertEqual(views.get_token_map(storage, 0), storage["storage"]["tokens"][0])
+        total_supply = storage["storage"]["pools"][0]["total_supply"]
+        self.assertEqual(views.get_tok_per_share(storage, 0), {
+            0: 100_000 * Constants.precision // total_supply,
+            1: 200_000 * Constants.precision // total_supply,
+        })
+        self.assertEqual(views.view_A(storage, 0), A_CONST)
+        self.assertEqual(views.get_fees(storage, 0), no_fees)
+
+        for view in (views.get_reserves, views.get_token_map, views.get_tok_per_share, views.view_A, views.get_fees):
+            with self.assertRaises(ContractError) as ctx:
+                view(storage, 1)
+            self.assertEqual(ctx.exception.error, Errors.Dex.pool_not_listed)
+
+    def test_get_dy(self):
+        for pool_fees in (no_fees, fees):
+            model = self.add_pool([10**9, 10**9, 10**9], pool_fees)
+            quote = views.get_dy(model.storage, 0, 0, 2, 10**6)
+            transfers = model.execute("swap", swap(0, 2, 10**6), sender=alice)
+            received = self.received(transfers, alice)
+            if pool_fees is no_fees:
+                self.assertEqual(quote, received)
+            else:
+                # the contract takes every fee part separately, each rounding down
+                self.assertLessEqual(quote, received)
+                self.assertLessEqual(received - quote, 3)
+
+        with self.assertRaises(ContractError) as ctx:
+            views.get_dy(model.storage, 0, 0, 3, 10)
+        self.assertEqual(ctx.exception.error, Errors.Dex.wrong_index)
+
+    def test_calc_divest_one_coin(self):
+        model = self.add_pool([10**9, 10**9, 10**9], fees)
+        quote = views.calc_divest_one_coin(model.storage, 0, 10**7, 1)
+        transfers = model.execute("divest_one_coin", dict(pool_id=0, shares=10**7, token_index=1, min_amount_out=1, deadline=0, receiver=None, referral=None), sender=admin)
+        self.assertEqual(quote, self.received(transfers, admin))
+
+    def test_calc_token_amount(self):
+        model = self.add_pool([10**9, 3 * 10**9])
+        in_amounts = {0: 10**6, 1: 5 * 10**5}
+        quote = views.calc_token_amount(model.storage, 0, in_amounts, True)
+        before = model.storage["storage"]["ledger"][(admin, 0)]
+        model.execute("invest", dict(pool_id=0, shares=1, in_amounts=in_amounts, deadline=0, receiver=None, referral=None), sender=admin)
+        self.assertEqual(model.storage["storage"]["ledger"][(admin, 0)] - before, quote)
+
+        out = views.calc_token_amount(model.storage, 0, {1: 10**6}, False)
+        self.assertGreater(out, 0)
+        with self.assertRaises(ContractError) as ctx:
+            views.calc_token_amount(model.storage, 0, {1: 10**12}, False)
+        self.assertEqual(ctx.exception.error, Errors.Math.nat_error)
+
+    def test_get_staker_info(self):
+        model = self.add_pool([10**9, 10**9], fees)
+        model.execute("stake", {"add": {"pool_id": 0, "amount": 100}}, sender=bob)
+        model.execute("swap", swap(0, 1, 10**7), sender=alice)
+        # alice joins once the accumulator has entries, so she has earnings to report
+        model.execute("stake", {"add": {"pool_id": 0, "amount": 300}}, sender=alice)
+        model.execute("swap", swap(0, 1, 10**7), sender=bob)
+        model.execute("swap", swap(1, 0, 10**7), sender=bob)
+
+        requests = [{"user": alice, "pool_id": 0}, {"user": carol, "pool_id": 0}]
+        alice_info, carol_info = views.get_staker_info(model.storage, requests)
+        self.assertEqual(alice_info["request"], requests[0])
+        self.assertEqual(alice_info["info"]["balance"], 300)
+        self.assertEqual(carol_info["info"], {"balance": 0, "rewards": {}})
+
+        transfers = model.execute("stake", {"add": {"pool_id": 0, "amount": 0}}, sender=alice)
+        harvested = {}
+        for address, _, _, dest, amount in transfers:
+            if dest == alice:
+                harvested[address] = amount
+        rewards = alice_info["info"]["rewards"]
+        # like the contract view, only tokens already in alice's earnings are
+        # reported; the first token 0 fees came after she staked
+        self.assertEqual(rewards, {1: harvested[token_b_address]})
+        self.assertGreater(rewards[1], 0)
+        self.assertGreater(harvested[token_a_address], 0)
+
+    def test_get_referral_rewards(self):
+        model = self.add_pool([10**9, 10**9], fees)
+        model.execute("swap", dict(swap(0, 1, 10**7), referral=carol), sender=alice)
+        requests = [
+            {"user": carol, "token": token_b},
+            {"user": carol, "token": token_a},
+            {"user": bob, "token": token_a},
+        ]
+        result = views.get_referral_rewards(model.storage, requests)
+        self.assertEqual([r["request"] for r in result], requests)
+        self.assertGreater(result[0]["reward"], 0)
+        self.assertEqual(result[1]["reward"], 0)
+        self.assertEqual(result[2]["reward"], 0)
+
+# the same views run by the interpreter on the compiled contract
+@skipUnless(os.path.exists(os.path.join(BUILD_DIR, "dex.json")), "needs the contract compiled into build/")
+class ViewsOnChainTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.maxDiff = None
+        cls.dex = load_dex()
+
+        storage = load_storage()
+        storage["storage"]["admin"] = admin
+        chain = LocalChain(storage=storage)
+        chain.execute(cls.dex.add_pool(A_CONST, [token_a, token_b, token_c], equal_pool_rates([10**9, 2 * 10**9, 3 * 10**9]), fees), sender=admin)
+        # the second stake finds fees in the accumulator, so admin has earnings to report
+        for i in range(2):
+            chain.execute(cls.dex.stake(add=dict(pool_id=0, amount=10**8)), sender=admin)
+            chain.execute(cls.dex.swap(pool_id=0, idx_from=i, idx_to=2, amount=10**7, min_amount_out=1, deadline=0, receiver=None, referral=bob), sender=alice)
+        cls.storage = chain.storage
+
+    def on_chain(self, view, *args, **kwargs):
+        return getattr(self.dex.view, view)(*args, **kwargs).onchain_view(storage=self.storage)
+
+    def test_pool_info(self):
+        for view in ("get_reserves", "get_token_map", "get_tok_per_share", "view_A", "get_fees"):
+            self.assertEqual(getattr(views, view)(self.storage, 0), self.on_chain(view, 0), view)
+
+            with self.assertRaises(MichelsonRuntimeError) as ctx:
+                self.on_chain(view, 1)
+            self.assertIn(Errors.Dex.pool_not_listed, str(ctx.exception))
+
+    def test_get_dy(self):
+        for i, j, dx in [(0, 2, 10**6), (2, 1, 1), (1, 0, 10**9)]:
+            self.assertEqual(views.get_dy(self.storage, 0, i, j, dx), self.on_chain("get_dy", pool_id=0, i=i, j=j, dx=dx))
+
+    def test_calc_divest_one_coin(self):
+        for i in range(3):
+            quote = views.calc_divest_one_coin(self.storage, 0, 10**7, i)
+            self.assertEqual(quote, self.on_chain("calc_divest_one_coin", pool_id=0, token_amount=10**7, i=i))
+
+    def test_calc_token_amount(self):
+        for amounts, is_deposit in [({0: 10**6, 2: 5 * 10**5}, True), ({1: 10**6}, False)]:
+            quote = views.calc_token_amount(self.storage, 0, amounts, is_deposit)
+            self.assertEqual(quote, self.on_chain("calc_token_amount", pool_id=0, amounts=amounts, is_deposit=is_deposit))
+
+    def test_get_staker_info(self):
+        requests = [{"user": admin, "pool_id": 0}, {"user": carol, "pool_id": 0}]
+        info = views.get_staker_info(self.storage, requests)
+        self.assertTrue(info[0]["info"]["rewards"])
+        self.assertEqual(info, self.on_chain("get_staker_info", requests))
+
+    def test_get_referral_rewards(self):
+        tokens = self.storage["storage"]["tokens"][0]
+        requests = [{"user": bob, "token": tokens[2]}, {"user": bob, "token": tokens[1]}, {"user": carol, "token": tokens[2]}]
+        rewards = views.get_referral_rewards(self.storage, requests)
+        self.assertGreater(rewards[0]["reward"], 0)
+        self.assertEqual(rewards, self.on_chain("get_referral_rewards", requests))
@@ -0,0 +1,223 @@
+# Append-only binary trace of simulation metrics
+#
+# A trace file is a small JSON header followed by fixed-size records, one per
+# `simulate.simulate` metrics row. Amounts (reserves, supply, D, fees, ...)
+# are unbounded nats in the contract, so they are stored as fixed-width
+# little-endian integers of `limbs` 64-bit words (256 bits by default).
+# Records are appended as they come and read back through numpy.memmap, so
+# the columns of a trace far bigger than RAM are plain array views:
+#
+#   with TraceWriter("run.trace") as writer:
+#       writer.extend(simulate(backend, schedule, blocks))
+#   trace = Trace("run.trace")
+#   trace["block"], trace.ints("d"), trace.ints("reserves")[:, 0]
+
+import json
+import os
+import struct
+
+import numpy as np
+
+from simulate import AMOUNT_COLUMNS, MAX_TOKENS, METRIC_COLUMNS
+
+MAGIC = b"QSTRACE\x00"
+VERSION = 1
+DEFAULT_LIMBS = 4
+# header is padded so records start aligned
+ALIGNMENT = 64
+
+# metrics columns grouped per token into a single field
+TOKEN_FIELDS = ("reserves", "staker_fees")
+
+
+def _field_of(column):
+    for field in TOKEN_FIELDS:
+        if column.startswith(field + "_"):
+            return field, int(column[len(field) + 1:])
+    return column, None
+
+def record_dtype(limbs=DEFAULT_LIMBS, max_tokens=MAX_TOKENS):
+    fields = [("nulls", "<u4")]
+    seen = set()
+    for column in METRIC_COLUMNS:
+        field, index = _field_of(column)
+        if field in seen:
+            continue
+        seen.add(field)
+        if column in AMOUNT_COLUMNS:
+            shape = (max_tokens, limbs) if index is not None else (limbs,)
+            fields.append((field, "<u8", shape))
+        elif column == "imbalance":
+            fields.append((field, "<f8"))
+        else:
+            fields.append((field, "<i8"))
+    return np.dtype(fields)
+
+def encode_int(value, limbs):
+    """ a nat as `limbs` little-endian 64-bit words """
+    if value < 0:
+        raise ValueError(f"negative amount {value} can't be traced")
+    try:
+        data = value.to_bytes(8 * limbs, "little")
+    except OverflowError:
+        raise OverflowError(f"{value} does not fit into {limbs} words") from None
+    return np.frombuffer(data, dtype="<u8")
+
+def decode_ints(words):
+    """ python ints of an (..., limbs) word array, as an object array of shape (...) """
+    words = np.asarray(words)
+    result = np.zeros(words.shape[:-1], dtype=object)
+    for k in reversed(range(words.shape[-1])):
+        result = (result << 64) + words[..., k].astype(object)
+    return result
+
+
+class TraceWriter:
+    """
+    Appends metrics rows to a trace file, creating it if needed. Rows are
+    buffered and written `chunk` at a time; a reader never sees a half
+    written record, a torn one at the end is ignored.
+    """
+    def __init__(self, path, limbs=DEFAULT_LIMBS, chunk=4096):
+        self.path = path
+        self.chunk = chunk
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            header, offset = read_header(path)
+            limbs = header["limbs"]
+            self.dtype = record_dtype(limbs, header["max_tokens"])
+            # drop a torn record left by an interrupted writer
+            size = os.path.getsize(path)
+            complete = offset + (size - offset) // self.dtype.itemsize * self.dtype.itemsize
+            self.file = open(path, "r+b")
+            self.file.truncate(complete)
+            self.file.seek(complete)
+        else:
+            self.dtype = record_dtype(limbs)
+            self.file = open(path, "wb")
+            self.file.write(_header_bytes(limbs))
+        self.limbs = limbs
+        self.buffer = np.zeros(chunk, dtype=self.dtype)
+        self.pending = 0
+
+    def append(self, row):
+        record = self.buffer[self.pending]
+        record["nulls"] = 0
+        for bit, column in enumerate(METRIC_COLUMNS):
+            value = row[column]
+            field, index = _field_of(column)
+            if value is None:
+                record["nulls"] |= 1 << bit
+                continue
+            if column in AMOUNT_COLUMNS:
+                words = encode_int(value, self.limbs)
+                if index is None:
+                    record[field] = words
+                else:
+                    record[field][index] = words
+            else:
+                record[field] = value
+        self.pending += 1
+        if self.pending == self.chunk:
+            self.flush()
+
+    def extend(self, rows):
+        """ appends every row of an iterable (e.g. `simulate(...)`), returns how many """
+        count = 0
+        for row in rows:
+            self.append(row)
+            count += 1
+        return count
+
+    def flush(self):
+        self.file.write(self.buffer[:self.pending].tobytes())
+        self.file.flush()
+        self.buffer[:self.pending] = 0
+        self.pending = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _header_bytes(limbs):
+    meta = json.dumps({
+        "version": VERSION,
+        "limbs": limbs,
+        "max_tokens": MAX_TOKENS,
+        "columns": list(METRIC_COLUMNS),
+    }).encode()
+    size = len(MAGIC) + 4 + len(meta)
+    padding = -size % ALIGNMENT
+    return MAGIC + struct.pack("<I", len(meta) + padding) + meta + b" " * padding
+
+def read_header(path):
+    """ (header dict, offset of the first record) """
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        length, = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length))
+    if header["version"] != VERSION:
+        raise ValueError(f"unsupported trace version {header['version']}")
+    if header["columns"] != list(METRIC_COLUMNS):
+        raise ValueError(f"{path} was written with different metrics columns")
+    return header, len(MAGIC) + 4 + length
+
+
+class Trace:
+    """
+    Read-only view of a trace file. `trace[field]` is a memmapped column
+    (amount fields as raw words), `ints(field)` decodes amounts to python
+    ints and `row(k)` rebuilds the k-th metrics row.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.header, offset = read_header(path)
+        self.limbs = self.header["limbs"]
+        self.dtype = record_dtype(self.limbs, self.header["max_tokens"])
+        count = (os.path.getsize(path) - offset) // self.dtype.itemsize
+        if count:
+            self.records = np.memmap(path, dtype=self.dtype, mode="r", offset=offset, shape=(count,))
+        else:
+            self.records = np.zeros(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, field):
+        return self.records[field]
+
+    def null(self, column):
+        """ boolean column telling where `column` was None """
+        return (self.records["nulls"] & (1 << METRIC_COLUMNS.index(column))) != 0
+
+    def ints(self, field, rows=slice(None)):
+        return decode_ints(self.records[field][rows])
+
+    def row(self, k):
+        record = self.records[k]
+        row = {}
+        for bit, column in enumerate(METRIC_COLUMNS):
+            field, index = _field_of(column)
+            if record["nulls"] & (1 << bit):
+                row[column] = None
+            elif column in AMOUNT_COLUMNS:
+                words = record[field] if index is None else record[field][index]
+                row[column] = decode_ints(words[None, :])[0]
+            elif column == "imbalance":
+                row[column] = float(record[field])
+            else:
+                row[column] = int(record[field])
+        return row
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.row(k)
@@ -0,0 +1,99 @@
+# Offline versions of the on-chain views (dex_core/views.ligo)
+#
+# Every view reads the full storage as LocalChain keeps it and returns what
+# the contract view would, in the same PyTezos python form. Views depending
+# on the amplification ramp take `now` for Tezos.now. Failing views raise
+# `stable_math.ContractError` with the contract's error string.
+
+from stable_math import (
+    Constants, ContractError, Errors,
+    calc_withdraw_one_coin, d_cache, get_dev_fee, get_pool_A, nat_or_error, perform_swap, require, sum_all_fee, token_key,
+)
+
+def _pool(storage, pool_id):
+    pools = storage["storage"]["pools"]
+    if pool_id not in pools:
+        raise ContractError(Errors.Dex.pool_not_listed)
+    return pools[pool_id]
+
+def get_reserves(storage, pool_id):
+    pool = _pool(storage, pool_id)
+    return {i: info["reserves"] for i, info in pool["tokens_info"].items()}
+
+def get_token_map(storage, pool_id):
+    tokens = storage["storage"]["tokens"]
+    if pool_id not in tokens:
+        raise ContractError(Errors.Dex.pool_not_listed)
+    return tokens[pool_id]
+
+def get_tok_per_share(storage, pool_id):
+    pool = _pool(storage, pool_id)
+    require(pool["total_supply"] != 0, Errors.div_by_zero)
+    return {
+        i: info["reserves"] * Constants.precision // pool["total_supply"]
+        for i, info in pool["tokens_info"].items()
+    }
+
+def calc_divest_one_coin(storage, pool_id, token_amount, i, now=0):
+    pool = _pool(storage, pool_id)
+    amp_f = get_pool_A(pool, now)
+    return calc_withdraw_one_coin(amp_f, token_amount, i, get_dev_fee(storage["storage"]), pool)["dy"]
+
+def get_dy(storage, pool_id, i, j, dx, now=0):
+    pool = _pool(storage, pool_id)
+    dy = perform_swap(i, j, dx, pool, now)
+    fee = sum_all_fee(pool["fee"], get_dev_fee(storage["storage"])) * dy // Constants.fee_denominator
+    return nat_or_error(dy - fee, Errors.Dex.fee_overflow)
+
+def view_A(storage, pool_id, now=0):
+    return get_pool_A(_pool(storage, pool_id), now) // Constants.a_precision
+
+def get_fees(storage, pool_id):
+    return _pool(storage, pool_id)["fee"]
+
+def get_staker_info(storage, requests):
+    """ `requests` is a list of {"user", "pool_id"} """
+    s = storage["storage"]
+    result = []
+    for request in requests:
+        pool = _pool(storage, request["pool_id"])
+        accumulator_f = pool["staker_accumulator"]["accumulator_f"]
+        info = s["stakers_balance"].get((request["user"], request["pool_id"]), {"balance": 0, "earnings": {}})
+        rewards = {}
+        for i, reward in info["earnings"].items():
+            new_former_f = info["balance"] * accumulator_f.get(i, 0)
+            rewards[i] = (reward["reward_f"] + abs(new_former_f - reward["former_f"])) // Constants.accum_precision
+        result.append({
+            "request": request,
+            "info": {"balance": info["balance"], "rewards": rewards},
+        })
+    return result
+
+def get_referral_rewards(storage, requests):
+    """ `requests` is a list of {"user", "token"} """
+    rewards = storage["storage"]["referral_rewards"]
+    return [
+        {"request": request, "reward": rewards.get((request["user"], token_key(request["token"])), 0)}
+        for request in requests
+    ]
+
+def calc_token_amount(storage, pool_id, amounts, is_deposit, now=0):
+    """ shares minted (or burnt) for adding (or removing) `amounts`, fees aside """
+    pool = _pool(storage, pool_id)
+    amp_f = get_pool_A(pool, now)
+    d0 = d_cache.get_D(pool["tokens_info"], amp_f)
+    mod_info = {}
+    for i, info in pool["tokens_info"].items():
+        amount = amounts.get(i, 0)
+        if is_deposit:
+            reserves = info["reserves"] + amount
+        else:
+            reserves = nat_or_error(info["reserves"] - amount, Errors.Math.nat_error)
+        mod_info[i] = dict(info, reserves=reserves)
+    d1 = d_cache.get_D(mod_info, amp_f)
+    if is_deposit:
+        diff = nat_or_error(d1 - d0, Errors.Math.nat_error)
+    else:
+        diff = nat_or_error(d0 - d1, Errors.Math.nat_error)
+    require(d0 != 0, Errors.div_by_zero)
+    return diff * pool["total_supply"] // d0